@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from oscar.core.loading import get_model
+
+from apps.core.tasks import generate_product_thumbnails
+
+
+ProductImage = get_model('catalogue', 'ProductImage')
+
+
+class Command(BaseCommand):
+    help = "Queue thumbnail generation for all existing product images"
+
+    def handle(self, *args, **options):
+        count = 0
+        for image_id in ProductImage.objects.values_list('pk', flat=True).iterator():
+            generate_product_thumbnails.delay(image_id)
+            count += 1
+        self.stdout.write(f'Queued thumbnails for {count} product images')
@@ -1,19 +1,145 @@
 from oscar.apps.catalogue.abstract_models import AbstractProduct
-from oscar.core.thumbnails import get_thumbnailer
+
+from apps.core.thumbnails import (
+    IMAGE_PRESETS,
+    format_srcset,
+    get_srcset,
+    get_thumbnail_url,
+    placeholder_url,
+    prime_thumbnail_urls
+)
+
+def primary_image_source(product: AbstractProduct):
+    """
+    The original image file of a product's primary image, or None
+    """
+    image = product.primary_image()
+    # product.primary_image can return a dict (if product has no image), else a
+    # ProductImage object
+    if isinstance(image, dict):
+        return None
+    return image.original
+
+
+def primary_image_url(product: AbstractProduct, size: str) -> str:
+    """
+    (Relative) url of the thumbnail of a product's primary image
+    """
+    source = primary_image_source(product)
+    # A product without an image is served the placeholder
+    if source is None:
+        return placeholder_url()
+    # thumbnails are pre-generated in the background when a product
+    # image is saved (see apps.core.receivers), here we only lookup the url
+    return get_thumbnail_url(source, size)
+
+
+def primary_image_srcset(product: AbstractProduct, sizes) -> dict:
+    """
+    The generated thumbnails of a product's primary image in ``sizes``,
+    see ``apps.core.thumbnails.get_srcset``
+    """
+    source = primary_image_source(product)
+    return {} if source is None else get_srcset(source, sizes)
+
 
 class ProductImageMixin:
     """
-    Mixin to get the primary image of a Product object
+    Mixin to get the primary image of a Product object, in the sizes of
+    the ``image_preset`` (context) the image is shown in. The preset can be
+    overridden with the 'image_preset' of the serializer context
     """
+    image_preset = 'listing'
+
+    def get_image_sizes(self):
+        preset = getattr(self, 'context', {}).get('image_preset', self.image_preset)
+        return IMAGE_PRESETS[preset]
+
+    def prime_primary_images(self, products):
+        """
+        Lookup the thumbnail urls of the primary images of many ``products``
+        at once, so serializing them one by one is served from memory
+        """
+        sources = [primary_image_source(product) for product in products if product]
+        prime_thumbnail_urls([s for s in sources if s is not None], self.get_image_sizes())
+
     def get_primary_image(self, product: AbstractProduct):
         if not product: # if asscociated product object is deleted
             return ''
-        image = product.primary_image()
-        # product.primary_image can return a dict (if product has no image), else a
-        # ProductImage object, both with similar interface
-        if isinstance(image, dict):
-            source = image.get('original')
-        else:
-            source = image.original
-        thumbnail = get_thumbnailer().generate_thumbnail(source, size="200x200")
-        return self.request.build_absolute_uri(thumbnail.url)
\ No newline at end of file
+        url = primary_image_url(product, self.get_image_sizes()[0])
+        return self.request.build_absolute_uri(url)
+
+    def get_primary_image_srcset(self, product: AbstractProduct):
+        """
+        srcset attributes (of absolute urls) for each image format,
+        eg. {"webp": "https://... 200w, https://... 400w", "jpeg": ...}
+        """
+        if not product:
+            return {}
+        srcset = primary_image_srcset(product, self.get_image_sizes())
+        return format_srcset(srcset, self.request.build_absolute_uri)
+
+
+def _query_list(request, param: str) -> list:
+    if request is None:
+        return []
+    values = request.query_params.getlist(param) if hasattr(request, 'query_params') \
+        else request.GET.getlist(param)
+    return [name.strip() for value in values for name in value.split(',') if name.strip()]
+
+
+def get_sparse_fields(request, field_names, path: str = ''):
+    """
+    Return the subset of ``field_names`` requested with the ``?fields=`` and
+    ``?omit=`` query params (comma separated field names).
+
+    Fields of nested serializers are named by their path, eg. ``?fields=id,product.title``.
+    ``path`` is the path of the serializer the ``field_names`` belong to ('' for the root).
+    If no field of the serializer is listed in ``?fields=``, all its fields are included.
+
+    :param request: The request object
+    :param field_names: A list of field names
+    :param path: The path of the (nested) serializer, eg. 'product'
+    """
+    prefix = f'{path}.' if path else ''
+
+    def names_at_path(param):
+        return [n[len(prefix):] for n in _query_list(request, param) if n.startswith(prefix)]
+
+    requested = names_at_path('fields')
+    # 'product.title' requests the 'product' field (ie. the nested serializer)
+    requested = {name.split('.')[0] for name in requested}
+    omitted = {name for name in names_at_path('omit') if '.' not in name}
+
+    return [
+        name for name in field_names
+        if (not requested or name in requested) and name not in omitted
+    ]
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin to honour the ``?fields=`` and ``?omit=`` query params,
+    see ``get_sparse_fields``.
+
+    Fields which are not requested are dropped from the serializer, so the
+    (expensive) methods of unrequested ``SerializerMethodField``'s are never called.
+    """
+    def get_field_path(self) -> str:
+        names = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return '.'.join(reversed(names))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None:
+            return fields
+        # NB. get_fields is called when the fields are first accessed, after
+        # this serializer has been bound to it's parent
+        names = get_sparse_fields(request, list(fields), self.get_field_path())
+        return {name: fields[name] for name in names}
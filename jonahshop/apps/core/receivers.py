@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from oscar.core.loading import get_model
+
+from apps.core.signals import thumbnails_missing
+from apps.core.tasks import generate_product_thumbnails
+from apps.core.thumbnails import delete_thumbnail_urls
+
+
+ProductImage = get_model('catalogue', 'ProductImage')
+
+
+@receiver(post_save, sender=ProductImage)
+def schedule_thumbnails(sender, instance, **kwargs):
+    # wait for the transaction to commit, else the task may not find the image
+    transaction.on_commit(lambda: generate_product_thumbnails.delay(instance.pk))
+
+
+@receiver(thumbnails_missing, sender=ProductImage)
+def regenerate_thumbnails(sender, instance, **kwargs):
+    transaction.on_commit(lambda: generate_product_thumbnails.delay(instance.pk))
+
+
+@receiver(post_delete, sender=ProductImage)
+def clear_thumbnail_urls(sender, instance, **kwargs):
+    delete_thumbnail_urls(instance.original)
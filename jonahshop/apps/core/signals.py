@@ -0,0 +1,11 @@
+from django.dispatch import Signal
+
+
+# Sent (by the background task) when the thumbnails of a product image
+# have been generated. Arguments: sender (ProductImage), instance
+thumbnails_generated = Signal()
+
+# Sent when the urls of the thumbnails of a product image aren't stored
+# (eg. evicted from the cache), so they are generated again.
+# Arguments: sender (ProductImage), instance
+thumbnails_missing = Signal()
@@ -0,0 +1,128 @@
+from django.db.models import prefetch_related_objects
+from oscar.core.loading import get_model, get_class
+from oscar.apps.catalogue.abstract_models import AbstractProduct
+
+
+PurchaseInfo = get_class('partner.strategy', 'PurchaseInfo')
+Product = get_model('catalogue', 'Product')
+StockRecord = get_model('partner', 'StockRecord')
+
+
+class PurchaseInfoResolver:
+    """
+    Resolve and memoize ``PurchaseInfo`` objects of products for a single
+    strategy (ie. a single request)
+
+    Oscar's strategy selects a product's stockrecord with ``product.stockrecords.first()``
+    which bypasses any prefetched stockrecords, and for parent products it queries the
+    public children and then each child's stockrecord. So resolving price and availability
+    for a page of products costs a couple of queries per product.
+
+    Call :meth:`prime` with the whole page of products, and the stockrecords
+    (and the public children of parent products) are fetched in one query each.
+    Products which weren't primed are resolved through the strategy as usual.
+    """
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self._infos = {}
+        self._stockrecords = {}
+        self._children = {}
+
+    def prime(self, products):
+        """
+        Fetch stockrecords for all ``products`` (and the public children of
+        the parent products among them) in one query each
+
+        :param products: An iterable of Product objects
+        """
+        products = [p for p in products if p is not None and p.pk not in self._infos]
+        if not products:
+            return
+
+        parent_ids = [p.pk for p in products if p.is_parent]
+        if parent_ids:
+            # the product class of a child is it's parent's
+            children = Product.objects.filter(parent_id__in=parent_ids).public() \
+                .select_related('parent__product_class')
+            for parent_id in parent_ids:
+                self._children.setdefault(parent_id, [])
+            for child in children:
+                self._children[child.parent_id].append(child)
+
+        product_ids = [p.pk for p in products if not p.is_parent]
+        product_ids += [c.pk for pid in parent_ids for c in self._children[pid]]
+        # order by pk, to select the same stockrecord as `stockrecords.first()` does
+        for record in StockRecord.objects.filter(product_id__in=product_ids).order_by('pk'):
+            self._stockrecords.setdefault(record.product_id, record)
+        for pk in product_ids:
+            self._stockrecords.setdefault(pk, None)
+
+    def prime_lines(self, lines):
+        """
+        Resolve the purchase info of basket ``lines`` with the stockrecord of
+        each line (selected with the lines), and memoize it for the line
+        (as ``Line.purchase_info`` does) and for it's product.
+
+        Oscar's ``Line.purchase_info`` ignores the line's stockrecord, and
+        queries for the product's stockrecord, for each line.
+        """
+        for line in lines:
+            info = getattr(line, '_info', None)
+            if info is None:
+                if line.stockrecord is not None and not line.product.is_parent:
+                    info = self.strategy.fetch_for_product(line.product, stockrecord=line.stockrecord)
+                else:
+                    info = self.fetch(line.product)
+                line._info = info
+            self._infos.setdefault(line.product_id, info)
+
+    def fetch(self, product: AbstractProduct):
+        """
+        Return the (memoized) ``PurchaseInfo`` of a product
+        """
+        info = self._infos.get(product.pk)
+        if info is None:
+            info = self._resolve(product)
+            self._infos[product.pk] = info
+        return info
+
+    def _resolve(self, product: AbstractProduct):
+        strategy = self.strategy
+        if product.is_parent:
+            if product.pk not in self._children:
+                return strategy.fetch_for_parent(product=product)
+            children_stock = [
+                (child, self._stockrecords[child.pk])
+                for child in self._children[product.pk]
+            ]
+            return PurchaseInfo(
+                price=strategy.parent_pricing_policy(product, children_stock),
+                availability=strategy.parent_availability_policy(product, children_stock),
+                stockrecord=None)
+
+        if product.pk not in self._stockrecords:
+            return strategy.fetch_for_product(product=product)
+        stockrecord = self._stockrecords[product.pk]
+        if stockrecord is not None:
+            return strategy.fetch_for_product(product=product, stockrecord=stockrecord)
+        # passing a `None` stockrecord to the strategy would make it query for one again
+        return PurchaseInfo(
+            price=strategy.pricing_policy(product, None),
+            availability=strategy.availability_policy(product, None),
+            stockrecord=None)
+
+
+def prime_basket_lines(basket, resolver=None) -> list:
+    """
+    Load the lines of ``basket`` with everything they are priced with (their
+    products, product classes, stockrecords and images) in a fixed number of
+    queries, however many lines there are. Returns the lines, which are also
+    those of ``basket.all_lines()``, so the basket totals reuse them
+    """
+    # oscar selects the products and stockrecords, and prefetches the images
+    lines = list(basket.all_lines())
+    # the availability policy needs the product class (a child's is it's parent's)
+    prefetch_related_objects(lines, 'product__product_class', 'product__parent__product_class')
+    (resolver or PurchaseInfoResolver(basket.strategy)).prime_lines(lines)
+    return lines
@@ -0,0 +1,19 @@
+from celery import shared_task
+from oscar.core.loading import get_model
+
+from apps.core.signals import thumbnails_generated
+from apps.core.thumbnails import generate_thumbnails
+
+
+ProductImage = get_model('catalogue', 'ProductImage')
+
+
+@shared_task(name='core.generate_product_thumbnails')
+def generate_product_thumbnails(image_id):
+    try:
+        image = ProductImage.objects.get(pk=image_id)
+    except ProductImage.DoesNotExist:
+        # image was deleted before the task run
+        return
+    generate_thumbnails(image.original)
+    thumbnails_generated.send(sender=ProductImage, instance=image)
@@ -0,0 +1,180 @@
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import TestCase
+from oscar.core.loading import get_model
+
+from apps.core import tasks
+from apps.core.thumbnails import (
+    ThumbnailUrlStore,
+    delete_thumbnail_urls,
+    format_srcset,
+    generate_thumbnails,
+    get_srcset,
+    get_thumbnail_url,
+    placeholder_url,
+    prime_thumbnail_urls,
+    thumbnail_cache_key,
+    url_store
+)
+
+
+ProductImage = get_model('catalogue', 'ProductImage')
+
+
+class Thumbnail:
+    def __init__(self, url):
+        self.url = url
+
+
+class Thumbnailer:
+    def generate_thumbnail(self, source, size, format):
+        return Thumbnail(f'/media/cache/{size}/{source}.{format.lower()}')
+
+
+class ThumbnailUrlTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        url_store.clear()
+        p = patch('apps.core.thumbnails.get_thumbnailer', return_value=Thumbnailer())
+        p.start()
+        self.addCleanup(p.stop)
+        p = patch('apps.core.thumbnails.source_exists', return_value=True)
+        self.source_exists = p.start()
+        self.addCleanup(p.stop)
+
+    def test_returns_placeholder_if_not_generated(self):
+        self.assertEqual(
+            get_thumbnail_url('images/bag.jpg', '200x200'),
+            placeholder_url()
+        )
+
+    def test_returns_url_of_generated_thumbnail(self):
+        generate_thumbnails('images/bag.jpg', sizes=['200x200', '400x400'])
+        self.assertEqual(
+            get_thumbnail_url('images/bag.jpg', '400x400'),
+            '/media/cache/400x400/images/bag.jpg.jpeg'
+        )
+        self.assertEqual(
+            get_thumbnail_url('images/bag.jpg', '400x400', 'WEBP'),
+            '/media/cache/400x400/images/bag.jpg.webp'
+        )
+
+    def test_srcset_of_generated_thumbnails(self):
+        generate_thumbnails('images/bag.jpg', sizes=['200x200', '400x400'], formats=['WEBP'])
+
+        srcset = get_srcset('images/bag.jpg', ['200x200', '400x400', '800x800'])
+        self.assertDictEqual(srcset, {'webp': [
+            ('/media/cache/200x200/images/bag.jpg.webp', 200),
+            ('/media/cache/400x400/images/bag.jpg.webp', 400),
+        ]})
+        self.assertDictEqual(
+            format_srcset(srcset, lambda url: f'http://testserver{url}'),
+            {'webp': (
+                'http://testserver/media/cache/200x200/images/bag.jpg.webp 200w, '
+                'http://testserver/media/cache/400x400/images/bag.jpg.webp 400w'
+            )}
+        )
+
+    def test_deleted_thumbnail_urls(self):
+        generate_thumbnails('images/bag.jpg', sizes=['200x200'])
+        delete_thumbnail_urls('images/bag.jpg', sizes=['200x200'])
+        self.assertEqual(
+            get_thumbnail_url('images/bag.jpg', '200x200'),
+            placeholder_url()
+        )
+
+    def test_missing_source_served_placeholder(self):
+        self.source_exists.return_value = False
+        generate_thumbnails('images/gone.jpg', sizes=['200x200'])
+        self.assertEqual(get_thumbnail_url('images/gone.jpg', '200x200'), placeholder_url())
+        self.assertDictEqual(get_srcset('images/gone.jpg', ['200x200']), {})
+
+    def test_urls_served_from_memory(self):
+        generate_thumbnails('images/bag.jpg', sizes=['200x200'])
+        # as in another process
+        url_store.clear()
+        url = '/media/cache/200x200/images/bag.jpg.jpeg'
+        with patch('apps.core.thumbnails.cache.get_many', wraps=cache.get_many) as get_many:
+            self.assertEqual(get_thumbnail_url('images/bag.jpg', '200x200'), url)
+            self.assertEqual(get_thumbnail_url('images/bag.jpg', '200x200'), url)
+        self.assertEqual(get_many.call_count, 1)
+
+    def test_thumbnails_not_generated_are_looked_up_again(self):
+        get_thumbnail_url('images/bag.jpg', '200x200')
+        generate_thumbnails('images/bag.jpg', sizes=['200x200'])
+        url_store.clear()
+        self.assertEqual(
+            get_thumbnail_url('images/bag.jpg', '200x200'),
+            '/media/cache/200x200/images/bag.jpg.jpeg'
+        )
+
+    def test_prime_page_in_one_lookup(self):
+        sources = [f'images/{i}.jpg' for i in range(12)]
+        for source in sources:
+            generate_thumbnails(source, sizes=['200x200'])
+        url_store.clear()
+
+        with patch('apps.core.thumbnails.cache.get_many', wraps=cache.get_many) as get_many:
+            prime_thumbnail_urls(sources, ['200x200'])
+            for source in sources:
+                self.assertNotEqual(get_thumbnail_url(source, '200x200'), placeholder_url())
+        self.assertEqual(get_many.call_count, 1)
+
+    def test_store_counts_and_evicts(self):
+        store = ThumbnailUrlStore(maxsize=2)
+        cache.set_many({'a': '/a', 'b': '/b', 'c': '/c'})
+
+        store.get_many(['a', 'b', 'x'])
+        store.get_many(['a', 'c'])
+        self.assertDictEqual(store.stats(), {'size': 2, 'local_hits': 1, 'shared_hits': 3, 'misses': 1})
+        # b was the least recently used
+        self.assertListEqual(list(store._lru), ['a', 'c'])
+
+    def test_urls_in_memory_expire(self):
+        store = ThumbnailUrlStore(timeout=60)
+        cache.set('a', '/a')
+        with patch('apps.core.thumbnails.time.monotonic', return_value=1000):
+            store.get_many(['a'])
+        # deleted by another process
+        cache.delete('a')
+        with patch('apps.core.thumbnails.time.monotonic', return_value=1059):
+            self.assertDictEqual(store.get_many(['a']), {'a': '/a'})
+        with patch('apps.core.thumbnails.time.monotonic', return_value=1061):
+            self.assertDictEqual(store.get_many(['a']), {})
+
+    def test_srcset_of_actual_widths(self):
+        class PortraitThumbnailer:
+            def generate_thumbnail(self, source, size, format):
+                thumbnail = Thumbnail(f'/media/cache/{size}/{source}.{format.lower()}')
+                # half as wide as high
+                thumbnail.width = int(size.split('x')[1]) // 2
+                return thumbnail
+
+        with patch('apps.core.thumbnails.get_thumbnailer', return_value=PortraitThumbnailer()):
+            generate_thumbnails('images/gown.jpg', sizes=['200x200', '400x400'])
+        self.assertEqual(
+            format_srcset(get_srcset('images/gown.jpg', ['200x200', '400x400']))['jpeg'],
+            '/media/cache/200x200/images/gown.jpg.jpeg 100w, /media/cache/400x400/images/gown.jpg.jpeg 200w'
+        )
+        self.assertEqual(
+            get_thumbnail_url('images/gown.jpg', '200x200'), '/media/cache/200x200/images/gown.jpg.jpeg')
+
+    def test_urls_stored_without_width(self):
+        cache.set(thumbnail_cache_key('images/bag.jpg', '200x200'), '/media/bag.jpeg')
+        self.assertEqual(get_thumbnail_url('images/bag.jpg', '200x200'), '/media/bag.jpeg')
+        self.assertListEqual(get_srcset('images/bag.jpg', ['200x200'])['jpeg'], [('/media/bag.jpeg', 200)])
+
+    def test_task_skips_deleted_image(self):
+        with patch('apps.core.tasks.generate_thumbnails') as gen_mock:
+            tasks.generate_product_thumbnails(123456)
+        gen_mock.assert_not_called()
+
+    def test_missing_urls_generated_again(self):
+        image = ProductImage(pk=7, original='images/bag.jpg')
+        with patch('apps.core.receivers.generate_product_thumbnails') as task_mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(get_thumbnail_url(image.original, '200x200'), placeholder_url())
+                get_srcset(image.original, ['200x200'])
+        # (requested once)
+        task_mock.delay.assert_called_once_with(7)
@@ -0,0 +1,277 @@
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+from oscar.core.thumbnails import get_thumbnailer
+
+from apps.core.signals import thumbnails_missing
+
+
+# Sizes (geometries) of the thumbnails of product images, for each context
+# images are shown in. The first size of a context is it's default image,
+# the others are alternatives (for other screen sizes) in it's srcset
+IMAGE_PRESETS = getattr(settings, 'PRODUCT_IMAGE_PRESETS', {
+    'listing': ('200x200', '400x400'),
+    'detail': ('200x200', '600x600', '1200x1200'),
+    'basket': ('200x200', '100x100'),
+    'order': ('200x200', '100x100'),
+})
+
+# Formats each size is generated in. The first is the default image,
+# which every client supports
+IMAGE_FORMATS = getattr(settings, 'PRODUCT_IMAGE_FORMATS', ('JPEG', 'WEBP'))
+
+# Sizes generated for each product image
+THUMBNAIL_SIZES = tuple(sorted({size for sizes in IMAGE_PRESETS.values() for size in sizes}))
+
+# Max number of thumbnail urls held in the memory of each process
+THUMBNAIL_URL_LRU_SIZE = getattr(settings, 'THUMBNAIL_URL_LRU_SIZE', 10000)
+# Seconds a url is held in the memory of a process. Urls deleted (eg. with
+# their image) by another process are served by this one until then
+THUMBNAIL_URL_LRU_TIMEOUT = getattr(settings, 'THUMBNAIL_URL_LRU_TIMEOUT', 60)
+# Seconds a source image which couldn't be found is remembered as missing
+MISSING_SOURCE_TIMEOUT = getattr(settings, 'THUMBNAIL_MISSING_SOURCE_TIMEOUT', 60 * 60)
+
+# Seconds the generation of thumbnails, requested because their urls
+# weren't found, isn't requested again (while it is waiting to be run)
+REGENERATE_INTERVAL = getattr(settings, 'THUMBNAIL_REGENERATE_INTERVAL', 60 * 5)
+
+# stored in place of the urls of thumbnails of a missing source image
+MISSING = 'missing'
+
+
+def _source_name(source) -> str:
+    # source is either an image field file or the name of an image
+    return getattr(source, 'name', source)
+
+
+def _size_width(size: str) -> int:
+    return int(size.split('x')[0])
+
+
+def _url_and_width(entry):
+    # thumbnails are stored as (url, width). Urls stored before their
+    # widths were (plain strings) have no width
+    if isinstance(entry, (tuple, list)):
+        return entry
+    return entry, None
+
+
+def thumbnail_cache_key(source, size: str, format: str = IMAGE_FORMATS[0]) -> str:
+    name = md5(f'{_source_name(source)}:{size}:{format}'.encode()).hexdigest()
+    return f'thumbnail-url:{name}'
+
+
+def placeholder_url() -> str:
+    """
+    Url served in place of a thumbnail that hasn't been generated yet
+    """
+    return getattr(settings, 'PRODUCT_THUMBNAIL_PLACEHOLDER_URL', None) \
+        or static('oscar/img/image_not_found.jpg')
+
+
+class ThumbnailUrlStore:
+    """
+    Urls of generated thumbnails, in two tiers: a bounded LRU in the
+    memory of each process, in front of the cache shared by all processes.
+
+    Urls of thumbnails don't change once generated, so a url found in the
+    shared cache is kept in the LRU (for THUMBNAIL_URL_LRU_TIMEOUT), and
+    looked up again without a round trip. So are missing source images, but
+    not thumbnails which haven't been generated yet, so they are served as
+    soon as they are. Urls are deleted from the LRU of the deleting process
+    only, the others hold them until they expire.
+
+    Hits (in each tier) and misses are counted, see :meth:`stats`
+    """
+
+    def __init__(self, maxsize=THUMBNAIL_URL_LRU_SIZE, timeout=THUMBNAIL_URL_LRU_TIMEOUT):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        # key -> (url, expiry time)
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, url):
+        timeout = min(self.timeout, MISSING_SOURCE_TIMEOUT) if url == MISSING else self.timeout
+        self._lru[key] = (url, time.monotonic() + timeout)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def get_many(self, keys) -> dict:
+        """
+        Urls (or the ``MISSING`` marker) of the ``keys`` which are stored.
+        Costs (at most) one round trip to the shared cache
+        """
+        found = {}
+        remote = []
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._lru.get(key)
+                if entry is not None and entry[1] > now:
+                    self._lru.move_to_end(key)
+                    found[key] = entry[0]
+                else:
+                    remote.append(key)
+            self.local_hits += len(found)
+
+        if remote:
+            urls = cache.get_many(remote)
+            with self._lock:
+                for key, url in urls.items():
+                    self._remember(key, url)
+                self.shared_hits += len(urls)
+                self.misses += len(remote) - len(urls)
+            found.update(urls)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, urls: dict, timeout=None):
+        cache.set_many(urls, timeout)
+        with self._lock:
+            for key, url in urls.items():
+                self._remember(key, url)
+
+    def delete_many(self, keys):
+        cache.delete_many(keys)
+        with self._lock:
+            for key in keys:
+                self._lru.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._lru),
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+        }
+
+
+url_store = ThumbnailUrlStore()
+
+
+def source_exists(source) -> bool:
+    storage = getattr(source, 'storage', default_storage)
+    return storage.exists(_source_name(source))
+
+
+def generate_thumbnails(source, sizes=None, formats=None):
+    """
+    Generate thumbnails of ``source`` for all the configured ``sizes`` and
+    ``formats``, and store their urls (and widths, see :func:`get_srcset`)
+    for :func:`get_thumbnail_url`. If the source image is missing, that is
+    stored instead.
+
+    This decodes and resizes images, so it is expected to be called by
+    a background task runner. See ``apps.core.tasks``
+    """
+    sizes = sizes or THUMBNAIL_SIZES
+    formats = formats or IMAGE_FORMATS
+    keys = [(size, format, thumbnail_cache_key(source, size, format)) for size in sizes for format in formats]
+    if not source_exists(source):
+        url_store.set_many({key: MISSING for _, _, key in keys}, MISSING_SOURCE_TIMEOUT)
+        return
+
+    thumbnailer = get_thumbnailer()
+    urls = {}
+    for size, format, key in keys:
+        thumbnail = thumbnailer.generate_thumbnail(source, size=size, format=format)
+        # a thumbnail fits in its size, eg. that of a portrait image is narrower
+        urls[key] = (thumbnail.url, getattr(thumbnail, 'width', None) or _size_width(size))
+    url_store.set_many(urls)
+
+
+def delete_thumbnail_urls(source, sizes=None, formats=None):
+    url_store.delete_many([
+        thumbnail_cache_key(source, size, format)
+        for size in sizes or THUMBNAIL_SIZES for format in formats or IMAGE_FORMATS
+    ])
+
+
+def request_thumbnails(source):
+    """
+    Have the thumbnails of ``source`` generated (again), eg. when their urls
+    have been evicted from the cache. Requested once per REGENERATE_INTERVAL,
+    only for the files of product images (see apps.core.receivers)
+    """
+    image = getattr(source, 'instance', None)
+    if image is None or image.pk is None:
+        return
+    key = f'thumbnail-requested:{md5(_source_name(source).encode()).hexdigest()}'
+    if cache.add(key, True, REGENERATE_INTERVAL):
+        thumbnails_missing.send(sender=type(image), instance=image)
+
+
+def prime_thumbnail_urls(sources, sizes):
+    """
+    Load the thumbnail urls of many ``sources`` (eg. of a page of products)
+    into the in-process store, in one round trip
+    """
+    url_store.get_many([
+        thumbnail_cache_key(source, size, format)
+        for source in sources for size in sizes for format in IMAGE_FORMATS
+    ])
+
+
+def get_thumbnail_url(source, size: str, format: str = IMAGE_FORMATS[0]) -> str:
+    """
+    Return the url of the thumbnail of ``source`` if it has been generated,
+    else a placeholder url. This is only ever a lookup in the url store.
+    """
+    entry = url_store.get(thumbnail_cache_key(source, size, format))
+    if entry is None:
+        request_thumbnails(source)
+    if not entry or entry == MISSING:
+        return placeholder_url()
+    return _url_and_width(entry)[0]
+
+
+def get_srcset(source, sizes) -> dict:
+    """
+    The generated thumbnails of ``source`` in ``sizes``, as (url, width)
+    candidates for each format, eg. ``{'webp': [(url, 200), (url, 400)], ...}``.
+    Thumbnails which haven't been generated yet are left out.
+    This is (at most) a single cache lookup
+    """
+    keys = {
+        thumbnail_cache_key(source, size, format): (format, size)
+        for format in IMAGE_FORMATS for size in sizes
+    }
+    urls = url_store.get_many(list(keys))
+    if len(urls) < len(keys):
+        request_thumbnails(source)
+    srcset = {}
+    for key, (format, size) in keys.items():
+        if urls.get(key, MISSING) != MISSING:
+            url, width = _url_and_width(urls[key])
+            # (urls stored without a width: that of the size, which the thumbnail fits in)
+            srcset.setdefault(format.lower(), []).append((url, width or _size_width(size)))
+    return srcset
+
+
+def format_srcset(srcset: dict, build_url=None) -> dict:
+    """
+    Format the candidates of :func:`get_srcset` as html srcset attributes,
+    eg. ``{'webp': 'https://.../a.webp 200w, https://.../b.webp 400w'}``
+    """
+    build_url = build_url or (lambda url: url)
+    return {
+        format: ', '.join(f'{build_url(url)} {width}w' for url, width in candidates)
+        for format, candidates in srcset.items()
+    }
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ShopapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.shopapi'
+
+    def ready(self):
+        from apps.shopapi import receivers # noqa, connect signal receivers
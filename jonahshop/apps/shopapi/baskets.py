@@ -0,0 +1,421 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from oscar.core.loading import get_model
+
+from apps.core.strategy import PurchaseInfoResolver
+from apps.shopapi.models import BasketRevision, CachedBasket
+from apps.shopapi.offers import offer_results
+from apps.shopapi.cache import (
+    CATALOGUE_VERSION_KEY,
+    OFFERS_VERSION_KEY,
+    basket_cache_id,
+    basket_version_key,
+    bump_version,
+    get_version
+)
+
+
+Product = get_model('catalogue', 'Product')
+Basket = get_model('basket', 'Basket')
+Line = get_model('basket', 'Line')
+
+ADD = 'add'
+SET = 'set'
+REMOVE = 'remove'
+BASKET_OPERATIONS = (ADD, SET, REMOVE)
+
+# Number of changes of a basket which are kept, for delta responses
+MAX_BASKET_CHANGES = 50
+BASKET_CHANGES_TIMEOUT = 60 * 60 * 24
+
+# Times a change of a basket is retried, when the basket was changed
+# (by another request) while it was made, and the seconds waited before
+# the first retry (doubled for each retry after)
+BASKET_MUTATION_RETRIES = getattr(settings, 'BASKET_MUTATION_RETRIES', 3)
+BASKET_MUTATION_BACKOFF = getattr(settings, 'BASKET_MUTATION_BACKOFF', 0.01)
+
+
+class BasketOperationError(Exception):
+    """
+    Operations which can't be applied, ``errors`` maps
+    the index of each operation to it's error message
+    """
+    def __init__(self, errors: dict):
+        self.errors = errors
+        super().__init__(errors)
+
+
+class StaleBasket(Exception):
+    """
+    The basket has changed since the ``revision`` a client has of it
+    """
+    def __init__(self, revision: int):
+        self.revision = revision
+        super().__init__(f'The basket has changed since, it is at revision {revision}')
+
+
+class BasketConflict(Exception):
+    """
+    The basket kept being changed (by other requests) while a change was made
+    """
+
+
+def _changes_key(basket_id) -> str:
+    return f'basket:{basket_id}:changes'
+
+
+def record_basket_change(basket_id, changed=(), removed=()) -> int:
+    """
+    Bump the version of a basket, and log the ids of the lines which
+    were ``changed`` (or created) and ``removed`` by the change.
+    Returns the new version. Changes are recorded once committed (with
+    transaction.on_commit), else a reader could pair the new version
+    with the lines before the change
+    """
+    version = bump_version(basket_version_key(basket_id))
+    key = _changes_key(basket_id)
+    changes = cache.get(key) or []
+    changes.append((version, list(changed), list(removed)))
+    cache.set(key, changes[-MAX_BASKET_CHANGES:], BASKET_CHANGES_TIMEOUT)
+    return version
+
+
+def basket_version(basket) -> str:
+    """
+    The version of the lines of ``basket`` (as sent to clients). Line prices
+    and totals also depend on the catalogue and the offers, so their
+    versions are part of it
+    """
+    return '.'.join(map(str, (
+        get_version(basket_version_key(basket_cache_id(basket))),
+        get_version(CATALOGUE_VERSION_KEY),
+        get_version(OFFERS_VERSION_KEY),
+    )))
+
+
+def basket_changes_since(basket, since: str):
+    """
+    Return the ids of the lines (changed, removed) since version ``since``
+    of ``basket``, or None if they aren't known (eg. the changes have
+    been dropped from the log, or prices changed since)
+    """
+    try:
+        since_version, *others = map(int, since.split('.'))
+    except (AttributeError, ValueError):
+        return None
+    current, *current_others = map(int, basket_version(basket).split('.'))
+    # (a version ahead of the current one is of another basket)
+    if others != current_others or since_version > current:
+        return None
+    changes = [c for c in cache.get(_changes_key(basket_cache_id(basket))) or [] if c[0] > since_version]
+    # versions are consecutive, a missing change (lost, or not logged) is a gap
+    if [c[0] for c in changes] != list(range(since_version + 1, current + 1)):
+        return None
+
+    changed, removed = set(), set()
+    for _, changed_ids, removed_ids in changes:
+        changed.update(changed_ids)
+        removed.update(removed_ids)
+    return changed - removed, removed
+
+
+def basket_revision(basket) -> int:
+    """
+    The revision of ``basket``, 0 if it hasn't been changed yet. Cached
+    baskets use the version of their lines (they are never in a transaction)
+    """
+    if isinstance(basket, CachedBasket):
+        return get_version(basket_version_key(basket.cache_id))
+    if basket.id is None:
+        return 0
+    return BasketRevision.objects.filter(basket_id=basket.id) \
+        .values_list('revision', flat=True).first() or 0
+
+
+def _claim_revision(basket, revision) -> bool:
+    # move the basket from ``revision`` to the next,
+    # False if it isn't at ``revision`` anymore
+    if revision == 0:
+        try:
+            with transaction.atomic():
+                BasketRevision.objects.create(basket=basket, revision=1)
+            return True
+        except IntegrityError:
+            return False
+    return BasketRevision.objects \
+        .filter(basket=basket, revision=revision) \
+        .update(revision=revision + 1) == 1
+
+
+def mutate_basket(basket, mutate, expected=None, retries=BASKET_MUTATION_RETRIES):
+    """
+    Run ``mutate()``, a change of the lines of ``basket`` (eg. adding a
+    product), optimistically: the change is committed with the revision of
+    the basket incremented, only if the basket is still at the revision it
+    was read at. Else it is rolled back and retried (on the current lines),
+    up to ``retries`` times with a growing backoff, then BasketConflict is
+    raised. So no lock is held while the change is made.
+
+    ``expected`` is the revision the client has (eg. of If-Match), StaleBasket
+    is raised if the basket is at another one. Returns the result of
+    ``mutate()`` and the new revision
+    """
+    if isinstance(basket, CachedBasket):
+        return _mutate_cached_basket(basket, mutate, expected, retries)
+
+    for attempt in range(retries + 1):
+        revision = basket_revision(basket)
+        if expected is not None and expected != revision:
+            raise StaleBasket(revision)
+        try:
+            with transaction.atomic():
+                result = mutate()
+                # (the basket is saved by the change, if it is new)
+                if not _claim_revision(basket, revision):
+                    raise BasketConflict()
+            return result, revision + 1
+        except BasketConflict:
+            # the lines are read again
+            basket.reset_offer_applications()
+            if attempt < retries:
+                _backoff(attempt)
+    raise BasketConflict()
+
+
+def _mutate_cached_basket(basket, mutate, expected, retries):
+    # cached baskets aren't changed in a transaction, the changes of one
+    # are made one at a time instead, under a short lock in the cache
+    for attempt in range(retries + 1):
+        if basket.lock():
+            try:
+                # the lines as left by the previous change
+                basket.reload()
+                revision = basket_revision(basket)
+                if expected is not None and expected != revision:
+                    raise StaleBasket(revision)
+                return mutate(), basket_revision(basket)
+            finally:
+                basket.unlock()
+        if attempt < retries:
+            _backoff(attempt)
+    raise BasketConflict()
+
+
+def _backoff(attempt):
+    time.sleep(BASKET_MUTATION_BACKOFF * 2 ** attempt * random.uniform(0.5, 1))
+
+
+def _final_quantities(operations, lines_by_product) -> dict:
+    # apply the operations in order, to the current quantity of each product
+    quantities = {}
+    for op in operations:
+        pk = op['product_id']
+        if pk not in quantities:
+            line = lines_by_product.get(pk)
+            quantities[pk] = line.quantity if line else 0
+        if op['op'] == ADD:
+            quantities[pk] += op['quantity']
+        elif op['op'] == SET:
+            quantities[pk] = op['quantity']
+        else:
+            quantities[pk] = 0
+    return quantities
+
+
+def apply_basket_operations(basket, operations, user=None, request=None) -> dict:
+    """
+    Apply a list of add, set (the quantity) and remove ``operations`` (dicts
+    with an 'op', a 'product_id' and a 'quantity') to ``basket``, all or
+    nothing. Products are looked up in one query, lines are written in bulk
+    and offers are applied once, at the end.
+
+    Lines are matched by product, a product's first line. Raises
+    BasketOperationError if an operation can't be applied.
+    Returns the final quantity of each product operated on
+    """
+    product_ids = {op['product_id'] for op in operations}
+    products = Product.objects.select_related('product_class', 'parent__product_class') \
+        .in_bulk(product_ids)
+    resolver = PurchaseInfoResolver(basket.strategy)
+    resolver.prime(products.values())
+
+    lines = list(basket.all_lines()) if basket.id or isinstance(basket, CachedBasket) else []
+    lines_by_product = {}
+    for line in lines:
+        lines_by_product.setdefault(line.product_id, line)
+    quantities = _final_quantities(operations, lines_by_product)
+
+    errors = {}
+    for index, op in enumerate(operations):
+        pk = op['product_id']
+        if pk not in products:
+            errors[index] = f'Product {pk} does not exist'
+            continue
+        quantity = quantities[pk]
+        current = lines_by_product[pk].quantity if pk in lines_by_product else 0
+        if quantity <= current:
+            # lowering a quantity is always allowed
+            continue
+        info = resolver.fetch(products[pk])
+        if not info.price.exists or info.stockrecord is None:
+            errors[index] = f'{products[pk]} is not available'
+            continue
+        allowed, message = info.availability.is_purchase_permitted(quantity)
+        if not allowed:
+            errors[index] = message
+    if errors:
+        raise BasketOperationError(errors)
+
+    if isinstance(basket, CachedBasket):
+        # (lines of products which are new to the basket are available)
+        basket.set_quantities(quantities, {
+            pk: resolver.fetch(products[pk]).stockrecord.pk
+            for pk, quantity in quantities.items() if quantity > 0 and pk not in lines_by_product
+        })
+    else:
+        _write_basket_lines(basket, quantities, products, lines, lines_by_product, resolver)
+
+    basket.reset_offer_applications()
+    offer_results.apply(basket, user, request)
+    return quantities
+
+
+def _write_basket_lines(basket, quantities, products, lines, lines_by_product, resolver):
+    now = timezone.now()
+    new_lines, changed_lines, removed_ids = [], [], []
+    with transaction.atomic():
+        if not basket.id:
+            basket.save()
+        for pk, quantity in quantities.items():
+            line = lines_by_product.get(pk)
+            if line is None:
+                if quantity > 0:
+                    new_lines.append(_new_line(basket, products[pk], resolver.fetch(products[pk]), quantity))
+            elif quantity <= 0:
+                removed_ids += [l.pk for l in lines if l.product_id == pk]
+            elif quantity != line.quantity:
+                line.quantity = quantity
+                line.date_updated = now
+                changed_lines.append(line)
+
+        Line.objects.bulk_create(new_lines)
+        Line.objects.bulk_update(changed_lines, ['quantity', 'date_updated'])
+        # (deleted lines are logged by apps.shopapi.receivers)
+        Line.objects.filter(pk__in=removed_ids).delete()
+
+        # bulk writes send no signals, and (on some databases)
+        # don't set the primary keys of the created lines
+        new_ids = basket.lines.filter(product__in=[l.product for l in new_lines]) \
+            .values_list('pk', flat=True) if new_lines else []
+        changed_ids = [l.pk for l in changed_lines] + list(new_ids)
+        # logged once committed, so the version is never ahead of the lines
+        transaction.on_commit(lambda: record_basket_change(basket.id, changed_ids))
+
+
+def _new_line(basket, product, info, quantity):
+    # as Basket.add does
+    line = Line(
+        basket=basket,
+        product=product,
+        stockrecord=info.stockrecord,
+        quantity=quantity,
+        line_reference=basket._create_line_reference(product, info.stockrecord, None),
+        price_currency=info.price.currency,
+        price_excl_tax=info.price.excl_tax,
+    )
+    if info.price.is_tax_known:
+        line.price_incl_tax = info.price.incl_tax
+    return line
+
+
+def merge_cached_basket(basket, cached, user=None, request=None):
+    """
+    Write the lines of ``cached`` (a CachedBasket) to ``basket``, eg. the
+    basket of the user who just signed in. A product which is in both keeps
+    the larger quantity (as oscar merges baskets), products which can't be
+    bought anymore are left out. ``cached`` is emptied
+    """
+    if cached.is_empty:
+        return basket
+    current = {}
+    if basket.id:
+        for line in basket.all_lines():
+            current.setdefault(line.product_id, line.quantity)
+    operations = [
+        {'op': SET, 'product_id': line.product_id,
+         'quantity': max(line.quantity, current.get(line.product_id, 0))}
+        for line in cached.all_lines()
+    ]
+    try:
+        mutate_basket(basket, lambda: apply_basket_operations(basket, operations, user, request))
+    except BasketOperationError as e:
+        operations = [op for index, op in enumerate(operations) if index not in e.errors]
+        if operations:
+            mutate_basket(basket, lambda: apply_basket_operations(basket, operations, user, request))
+    cached.flush()
+    return basket
+
+
+def materialize_basket(cached, owner=None, request=None):
+    """
+    Write ``cached`` (a CachedBasket) to the database, as a Basket of
+    ``owner`` and it's lines, eg. at checkout. Returns the basket
+    """
+    basket = Basket(owner=owner)
+    basket.strategy = cached.strategy
+    return merge_cached_basket(basket, cached, owner, request)
+
+
+def merge_baskets(master, slave, add_quantities=False):
+    """
+    Merge the lines (and vouchers) of ``slave`` into ``master``, as
+    Basket.merge does, in a fixed number of queries (Basket.merge costs a
+    few for each line): the lines of both baskets are read with a query
+    each, lines of products already in ``master`` are combined in memory
+    and written in bulk, and the others are moved to ``master`` at once.
+
+    ``slave`` is marked as merged. Offers are not applied, they are
+    (once) when the basket is next read
+    """
+    now = timezone.now()
+    existing = {line.line_reference: line for line in Line.objects.filter(basket=master)}
+    moved_ids, merged_ids, changed = [], [], []
+    for line in Line.objects.filter(basket=slave).only('pk', 'line_reference', 'quantity'):
+        master_line = existing.get(line.line_reference)
+        if master_line is None:
+            moved_ids.append(line.pk)
+            continue
+        merged_ids.append(line.pk)
+        if add_quantities:
+            quantity = master_line.quantity + line.quantity
+        else:
+            quantity = max(master_line.quantity, line.quantity)
+        if quantity != master_line.quantity:
+            master_line.quantity = quantity
+            master_line.date_updated = now
+            changed.append(master_line)
+
+    with transaction.atomic():
+        Line.objects.bulk_update(changed, ['quantity', 'date_updated'])
+        Line.objects.filter(pk__in=merged_ids).delete()
+        # what is left of the slave's lines is new to the master
+        Line.objects.filter(basket=slave).update(basket=master, date_updated=now)
+        changed_ids = [l.pk for l in changed] + moved_ids
+        transaction.on_commit(lambda: record_basket_change(master.id, changed_ids))
+
+        vouchers = list(slave.vouchers.all())
+        if vouchers:
+            slave.vouchers.clear()
+            master.vouchers.add(*vouchers)
+        slave.status = slave.MERGED
+        slave.date_merged = now
+        slave.save()
+
+    slave._lines = None
+    master.reset_offer_applications()
+    return master
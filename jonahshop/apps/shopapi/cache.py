@@ -0,0 +1,180 @@
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import quote_etag
+from django.utils.http import parse_etags
+from oscar.core.loading import get_class
+from rest_framework import status
+from rest_framework.response import Response
+
+
+Selector = get_class('partner.strategy', 'Selector')
+
+CATALOGUE_CACHE_TIMEOUT = getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 60 * 15)
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+OFFERS_VERSION_KEY = 'offers:version'
+
+
+def _initial_version() -> int:
+    # Counters start from the current time (in milliseconds), not from 1.
+    # So a counter that is evicted from the cache doesn't restart at a
+    # version clients (etags) and cache entries have already seen.
+    return int(time.time() * 1000)
+
+
+def get_version(key: str) -> int:
+    """
+    Get the current value of a version counter
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_version(key: str) -> int:
+    """
+    Increment a version counter, so keys built with the previous
+    version are never read again (and expire). Returns the new version
+    """
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # counter has not been set (or was evicted)
+        cache.add(key, _initial_version(), None)
+        return cache.incr(key)
+
+
+def bump_versions(keys):
+    """
+    Increment many version counters at once (eg. after a bulk write), in two
+    round trips instead of one per counter. Unlike bump_version this isn't
+    atomic, so a counter is moved to at least the current time: a concurrent
+    bump (overwritten here) doesn't leave it at a version already seen
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    current = cache.get_many(keys)
+    floor = _initial_version()
+    cache.set_many({key: max(current.get(key, 0) + 1, floor) for key in keys}, None)
+
+
+def product_version_key(product_id) -> str:
+    return f'catalogue:product:{product_id}:version'
+
+
+def invalidate_catalogue(*product_ids):
+    """
+    Invalidate cached catalogue listings, and the cached details
+    of the given products
+    """
+    bump_version(CATALOGUE_VERSION_KEY)
+    for pk in product_ids:
+        if pk is not None:
+            bump_version(product_version_key(pk))
+
+
+def invalidate_products(product_ids):
+    """
+    Invalidate cached catalogue listings, and the cached details of many
+    ``product_ids`` (eg. a batch of an import) with a fixed number of round
+    trips to the cache
+    """
+    bump_version(CATALOGUE_VERSION_KEY)
+    bump_versions(product_version_key(pk) for pk in product_ids if pk is not None)
+
+
+def basket_version_key(basket_id) -> str:
+    return f'basket:{basket_id}:version'
+
+
+def basket_cache_id(basket):
+    # cached baskets (apps.shopapi.models.CachedBasket) have no id
+    return getattr(basket, 'cache_id', None) or basket.id
+
+
+def order_version_key(order_id) -> str:
+    return f'order:{order_id}:version'
+
+
+def strategy_key(request) -> str:
+    strategy = Selector().strategy(request=request)
+    return f'{strategy.__class__.__name__}:{settings.OSCAR_DEFAULT_CURRENCY}'
+
+
+def request_key(request) -> str:
+    """
+    Key for what the response of the request depends on, apart from
+    the data itself. (The host is part of the absolute urls in responses)
+    """
+    params = sorted(request.query_params.lists())
+    raw = f'{request.scheme}:{request.get_host()}:{request.path}:{params}:{strategy_key(request)}'
+    return md5(raw.encode()).hexdigest()
+
+
+def product_list_cache_key(request) -> str:
+    version = get_version(CATALOGUE_VERSION_KEY)
+    return f'catalogue:list:{version}:{request_key(request)}'
+
+
+def product_detail_cache_key(request, product_id) -> str:
+    version = get_version(product_version_key(product_id))
+    return f'catalogue:detail:{product_id}:{version}:{request_key(request)}'
+
+
+def make_etag(*parts) -> str:
+    return md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def product_list_etag(request) -> str:
+    return make_etag(get_version(CATALOGUE_VERSION_KEY), request_key(request))
+
+
+def product_detail_etag(request, product_id) -> str:
+    return make_etag(get_version(product_version_key(product_id)), request_key(request))
+
+
+def basket_etag(request, basket) -> str:
+    # line prices depend on the products, and the totals on the offers
+    basket_id = basket_cache_id(basket)
+    return make_etag(
+        basket_id,
+        get_version(basket_version_key(basket_id)),
+        get_version(OFFERS_VERSION_KEY),
+        get_version(CATALOGUE_VERSION_KEY),
+        request_key(request),
+    )
+
+
+def order_etag(request, order) -> str:
+    # line images depend on the products
+    return make_etag(
+        order.id,
+        get_version(order_version_key(order.id)),
+        get_version(CATALOGUE_VERSION_KEY),
+        request_key(request),
+    )
+
+
+def conditional_response(request, etag: str, get_response):
+    """
+    Answer with a ``304 Not Modified`` if the client's ``If-None-Match``
+    matches ``etag``, without calling ``get_response``. Otherwise return
+    the response of ``get_response`` with the etag set.
+    """
+    etag = quote_etag(etag)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        if etag in etags or '*' in etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+    response = get_response()
+    if response.status_code == status.HTTP_200_OK:
+        response['ETag'] = etag
+    return response
@@ -0,0 +1,98 @@
+import threading
+
+from django.core.cache import cache
+from oscar.core.loading import get_model
+
+from apps.shopapi.cache import get_version, bump_version
+
+
+Category = get_model('catalogue', 'Category')
+Product = get_model('catalogue', 'Product')
+ProductCategory = get_model('catalogue', 'ProductCategory')
+
+CATEGORIES_VERSION_KEY = 'categories:version'
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24
+
+
+def _tree_key(version) -> str:
+    return f'categories:tree:{version}'
+
+
+def build_category_tree() -> list:
+    """
+    Build the tree of browsable categories, with the number of browsable
+    products in each (sub)tree, in two queries. Nodes are dicts with the
+    id, name, slug, product_count and children of a category
+    """
+    categories = list(
+        Category.objects.browsable().order_by('path').values_list('pk', 'path', 'name', 'slug'))
+    steplen = Category.steplen
+
+    # a product counts towards it's categories, and their ancestors (once)
+    products = {path: set() for _, path, _, _ in categories}
+    links = ProductCategory.objects \
+        .filter(product__in=Product.objects.browsable()) \
+        .values_list('category__path', 'product_id')
+    for path, product_id in links:
+        for end in range(steplen, len(path) + 1, steplen):
+            if path[:end] in products:
+                products[path[:end]].add(product_id)
+
+    roots = []
+    nodes = {}
+    # ordered by path, so a parent comes before it's children
+    for pk, path, name, slug in categories:
+        node = {
+            'id': pk,
+            'name': name,
+            'slug': slug,
+            'product_count': len(products[path]),
+            'children': [],
+        }
+        nodes[path] = node
+        if len(path) == steplen:
+            roots.append(node)
+        elif path[:-steplen] in nodes:
+            nodes[path[:-steplen]]['children'].append(node)
+    return roots
+
+
+def categories_changed():
+    """
+    Mark the category tree snapshot as stale, in every process.
+    Expected to be called after the change is committed.
+    """
+    bump_version(CATEGORIES_VERSION_KEY)
+
+
+class CategoryTreeHolder:
+    """
+    Holds the category tree snapshot of this process.
+
+    The snapshot is rebuilt when the version in the (shared) cache changes,
+    and only by the first process to see the new version. Other processes
+    load it from the cache. So serving the tree costs a cache lookup of the
+    version, and no queries.
+    """
+
+    def __init__(self):
+        self._tree = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return the (version, tree) of the current snapshot
+        """
+        version = get_version(CATEGORIES_VERSION_KEY)
+        with self._lock:
+            if self._version != version:
+                tree = cache.get(_tree_key(version))
+                if tree is None:
+                    tree = build_category_tree()
+                    cache.set(_tree_key(version), tree, CATEGORY_TREE_TIMEOUT)
+                self._tree, self._version = tree, version
+            return self._version, self._tree
+
+
+category_tree = CategoryTreeHolder()
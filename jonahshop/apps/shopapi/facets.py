@@ -0,0 +1,257 @@
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from oscar.core.loading import get_model, get_class
+
+from apps.core.strategy import PurchaseInfoResolver
+from apps.shopapi.cache import get_version, bump_version
+
+
+Selector = get_class('partner.strategy', 'Selector')
+Product = get_model('catalogue', 'Product')
+Category = get_model('catalogue', 'Category')
+ProductCategory = get_model('catalogue', 'ProductCategory')
+ProductAttributeValue = get_model('catalogue', 'ProductAttributeValue')
+
+# Boundaries of the price bands, eg. (0, 50, 100) gives bands '0-50', '50-100' and '100-'
+PRODUCT_PRICE_BANDS = getattr(settings, 'PRODUCT_PRICE_BANDS', (0, 50, 100, 250, 500))
+
+FACETS_VERSION_KEY = 'facets:version'
+# A worker more than this many changes behind rebuilds the whole index
+FACETS_MAX_CHANGES = 200
+FACETS_CHANGE_TIMEOUT = 60 * 60
+
+CATEGORY = 'category'
+PRICE = 'price'
+AVAILABILITY = 'availability'
+ATTRIBUTE_PREFIX = 'attr.'
+
+IN_STOCK = 'in_stock'
+OUT_OF_STOCK = 'out_of_stock'
+
+# marks a change that needs the whole index rebuilt
+_REBUILD = 'rebuild'
+
+
+def price_band(price, bands=PRODUCT_PRICE_BANDS):
+    if price is None or price < bands[0]:
+        return None
+    for low, high in zip(bands, bands[1:]):
+        if low <= price < high:
+            return f'{low}-{high}'
+    return f'{bands[-1]}-'
+
+
+def popcount(bits: int) -> int:
+    return bin(bits).count('1')
+
+
+def bitset_ids(bits: int) -> list:
+    """
+    Product ids (set bits) of a bitset, in ascending order
+    """
+    # bit i is the i'th character of the reversed binary string
+    return [i for i, bit in enumerate(reversed(bin(bits)[2:])) if bit == '1']
+
+
+def selected_facets(query_params) -> dict:
+    """
+    Get the facet filters of a request from it's query params, eg.
+    ``?category=3&price=0-50&availability=in_stock&attr.colour=red``.
+    Multiple values of a facet (``?category=3&category=4``) are OR'ed
+    """
+    selected = {}
+    for name, values in query_params.lists():
+        if name in (CATEGORY, PRICE, AVAILABILITY) or name.startswith(ATTRIBUTE_PREFIX):
+            values = [v for value in values for v in value.split(',') if v]
+            if values:
+                selected[name] = values
+    return selected
+
+
+class FacetIndex:
+    """
+    Precomputed facets of the browsable products.
+
+    Each value of a facet (eg. category 3, price band '0-50') holds the set of
+    products having it, as a bitset (an int) indexed by product id. Filtering
+    is AND'ing (and OR'ing) bitsets, and counting is a popcount. So neither
+    costs a query.
+    """
+
+    def __init__(self):
+        self.products = 0
+        # facet -> value -> bitset
+        self.facets = defaultdict(lambda: defaultdict(int))
+
+    def copy(self):
+        index = FacetIndex()
+        index.products = self.products
+        for facet, values in self.facets.items():
+            index.facets[facet].update(values)
+        return index
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        index.add_products(Product.objects.browsable())
+        return index
+
+    def update_products(self, product_ids):
+        """
+        (Re)compute the facets of the given products. Products which
+        are not browsable (anymore) are removed from the index
+        """
+        mask = 0
+        for pk in product_ids:
+            mask |= 1 << pk
+        self.products &= ~mask
+        for values in self.facets.values():
+            for value in list(values):
+                values[value] &= ~mask
+                if not values[value]:
+                    del values[value]
+        self.add_products(Product.objects.browsable().filter(pk__in=product_ids))
+
+    def add_products(self, products, chunk_size=1000):
+        products = products.order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(products.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+            for pk, facet, value in self.product_facets(chunk):
+                self.facets[facet][value] |= 1 << pk
+            for product in chunk:
+                self.products |= 1 << product.pk
+            last_pk = chunk[-1].pk
+
+    def product_facets(self, products: list):
+        """
+        Yield the (product id, facet, value)'s of ``products``
+        """
+        resolver = PurchaseInfoResolver(Selector().strategy())
+        resolver.prime(products)
+        for product in products:
+            info = resolver.fetch(product)
+            available = info.availability.is_available_to_buy
+            yield product.pk, AVAILABILITY, IN_STOCK if available else OUT_OF_STOCK
+            band = price_band(info.price.excl_tax if info.price.exists else None)
+            if band is not None:
+                yield product.pk, PRICE, band
+
+        ids = [p.pk for p in products]
+        # a product is in the ancestors of it's categories too
+        links = list(ProductCategory.objects.filter(product_id__in=ids)
+                     .values_list('product_id', 'category__path'))
+        ancestor_paths = {
+            path[:end] for _, path in links
+            for end in range(Category.steplen, len(path) + 1, Category.steplen)
+        }
+        category_ids = dict(Category.objects.filter(path__in=ancestor_paths).values_list('path', 'pk'))
+        for product_id, path in links:
+            for end in range(Category.steplen, len(path) + 1, Category.steplen):
+                if path[:end] in category_ids:
+                    yield product_id, CATEGORY, str(category_ids[path[:end]])
+
+        # attributes of a parent product are those of it's children
+        values = ProductAttributeValue.objects \
+            .filter(Q(product_id__in=ids) | Q(product__parent_id__in=ids)) \
+            .select_related('attribute', 'value_option', 'product') \
+            .prefetch_related('value_multi_option')
+        for av in values:
+            product_id = av.product.parent_id or av.product_id
+            value = av.value_as_text
+            if value not in (None, ''):
+                yield product_id, f'{ATTRIBUTE_PREFIX}{av.attribute.code}', str(value)
+
+    def _union(self, facet, values) -> int:
+        bits = 0
+        for value in values:
+            bits |= self.facets.get(facet, {}).get(value, 0)
+        return bits
+
+    def filter(self, selected: dict) -> int:
+        """
+        Bitset of the products having (one of) the selected values of every facet
+        """
+        bits = self.products
+        for facet, values in selected.items():
+            bits &= self._union(facet, values)
+        return bits
+
+    def filter_ids(self, selected: dict) -> list:
+        return bitset_ids(self.filter(selected))
+
+    def counts(self, selected: dict) -> dict:
+        """
+        Product counts of the facet values. The counts of a facet's values are
+        filtered by the selected values of the *other* facets only, so a client
+        can see what selecting another value of the same facet will add.
+        """
+        result = {}
+        for facet, values in self.facets.items():
+            others = {f: v for f, v in selected.items() if f != facet}
+            bits = self.filter(others)
+            counts = {value: popcount(bits & value_bits) for value, value_bits in values.items()}
+            result[facet] = {value: count for value, count in counts.items() if count}
+        return result
+
+
+def _change_key(version) -> str:
+    return f'facets:change:{version}'
+
+
+def record_change(product_ids=None):
+    """
+    Record that the facets of ``product_ids`` changed, or that the whole
+    index is to be rebuilt if no ids are given (eg. the category tree changed).
+    Expected to be called after the change is committed.
+    """
+    version = bump_version(FACETS_VERSION_KEY)
+    change = list(product_ids) if product_ids else _REBUILD
+    cache.set(_change_key(version), change, FACETS_CHANGE_TIMEOUT)
+
+
+class FacetIndexHolder:
+    """
+    Holds the facet index of this process, and brings it up to date with the
+    changes recorded (in the shared cache) by any process since it was built.
+    The index is rebuilt if the changes can't be replayed.
+
+    Changes are applied to a copy of the index, so an index returned by
+    :meth:`get` is never modified (while another thread is reading it)
+    """
+
+    def __init__(self):
+        self._index = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self) -> FacetIndex:
+        version = get_version(FACETS_VERSION_KEY)
+        with self._lock:
+            if self._index is None or not self._replay(version):
+                self._index = FacetIndex.build()
+            self._version = version
+            return self._index
+
+    def _replay(self, version) -> bool:
+        if version == self._version:
+            return True
+        if version < self._version or version - self._version > FACETS_MAX_CHANGES:
+            return False
+        keys = [_change_key(v) for v in range(self._version + 1, version + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys) or _REBUILD in changes.values():
+            return False
+        index = self._index.copy()
+        index.update_products({pk for ids in changes.values() for pk in ids})
+        self._index = index
+        return True
+
+
+facet_index = FacetIndexHolder()
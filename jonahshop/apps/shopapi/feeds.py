@@ -0,0 +1,93 @@
+import csv
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from oscar.core.loading import get_model
+from rest_framework.utils.encoders import JSONEncoder
+
+from apps.shopapi.serializers import ProductSerializer
+
+
+Product = get_model('catalogue', 'Product')
+
+PRODUCT_FEED_CHUNK_SIZE = getattr(settings, 'PRODUCT_FEED_CHUNK_SIZE', 500)
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+FEED_FORMATS = {
+    NDJSON: 'application/x-ndjson',
+    CSV: 'text/csv',
+}
+
+
+def feed_products():
+    return Product.objects.browsable().select_related('product_class').order_by('pk')
+
+
+def feed_fields(context) -> list:
+    """
+    Names of the fields of a feed item, ie. the (requested) ProductSerializer fields
+    """
+    return list(ProductSerializer(context=context).fields)
+
+
+def feed_items(context, products=None, chunk_size=PRODUCT_FEED_CHUNK_SIZE):
+    """
+    Yield the serialized products of a feed, one by one.
+
+    Products are read from a server side cursor (``.iterator()``) and
+    serialized a chunk at a time, so the purchase info of a chunk is
+    resolved in bulk, and only a chunk of products is held in memory.
+
+    :param context: The serializer context, the request is needed for absolute urls
+    :param products: A queryset of products, defaults to all browsable products
+    """
+    if products is None:
+        products = feed_products()
+    fields = feed_fields(context)
+    rows = products.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        # .iterator() doesn't prefetch, so prefetch for each chunk
+        if {'image', 'srcset'} & set(fields):
+            prefetch_related_objects(chunk, 'images')
+        yield from ProductSerializer(chunk, many=True, context=context).data
+
+
+def ndjson_lines(items):
+    for item in items:
+        yield json.dumps(item, cls=JSONEncoder, ensure_ascii=False) + '\n'
+
+
+class _Echo:
+    """
+    File like object which returns what is written to it, so the
+    csv writer can write a line at a time to a generator
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(items, fields):
+    writer = csv.DictWriter(_Echo(), fieldnames=fields)
+    yield writer.writeheader()
+    for item in items:
+        # nested values (ie. the srcset) as json
+        yield writer.writerow({
+            name: json.dumps(value) if isinstance(value, dict) else value
+            for name, value in item.items()
+        })
+
+
+def feed_lines(format, context, **kwargs):
+    """
+    Yield the lines of a product feed in ``format``, ndjson or csv
+    """
+    items = feed_items(context, **kwargs)
+    if format == CSV:
+        return csv_lines(items, feed_fields(context))
+    return ndjson_lines(items)
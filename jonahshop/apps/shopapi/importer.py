@@ -0,0 +1,510 @@
+import csv
+import json
+import os
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from oscar.core.loading import get_model, get_class
+from oscar.core.utils import slugify
+
+from apps.core.tasks import generate_product_thumbnails
+from apps.shopapi import facets
+from apps.shopapi.cache import invalidate_products
+from apps.shopapi.categories import categories_changed
+from apps.shopapi.tasks import index_products, refresh_product_listings
+
+
+create_from_breadcrumbs = get_class('catalogue.categories', 'create_from_breadcrumbs')
+Product = get_model('catalogue', 'Product')
+ProductClass = get_model('catalogue', 'ProductClass')
+ProductAttribute = get_model('catalogue', 'ProductAttribute')
+ProductAttributeValue = get_model('catalogue', 'ProductAttributeValue')
+ProductCategory = get_model('catalogue', 'ProductCategory')
+ProductImage = get_model('catalogue', 'ProductImage')
+StockRecord = get_model('partner', 'StockRecord')
+
+CATALOGUE_IMPORT_BATCH_SIZE = getattr(settings, 'CATALOGUE_IMPORT_BATCH_SIZE', 1000)
+
+# columns of attribute values are named 'attr.<attribute code>', eg. 'attr.colour'
+ATTRIBUTE_PREFIX = facets.ATTRIBUTE_PREFIX
+# a product's categories are breadcrumbs separated by '|', eg. 'Clothing > Shirts|Sale'
+CATEGORY_SEPARATOR = '|'
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_csv(file):
+    yield from csv.DictReader(file)
+
+
+def read_json(file, buffer_size=64 * 1024):
+    """
+    Yield the objects of a json array, or of json lines, without
+    loading the whole file
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while True:
+        # skip what separates the objects of an array (or lines)
+        buffer = buffer.lstrip(' \t\r\n,[]')
+        try:
+            obj, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(buffer_size)
+            if not chunk:
+                if buffer:
+                    raise
+                return
+            buffer += chunk
+            continue
+        yield obj
+        buffer = buffer[end:]
+
+
+def read_rows(path):
+    """
+    Yield the rows (dicts) of a csv or json catalogue file
+    """
+    with open(path, encoding='utf-8', newline='') as file:
+        if path.endswith('.csv'):
+            yield from read_csv(file)
+        else:
+            yield from read_json(file)
+
+
+def _text(value) -> str:
+    return '' if value is None else str(value).strip()
+
+
+def _decimal(value, name):
+    value = _text(value)
+    if not value:
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise RowError(f'{name}: {value!r} is not a number')
+
+
+def _integer(value, name):
+    value = _text(value)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise RowError(f'{name}: {value!r} is not an integer')
+
+
+@dataclass
+class ImportStats:
+    rows: int = 0
+    # rows skipped, as they were imported before an interruption
+    resumed: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    # (row number, message) of rows which were not imported
+    errors: list = field(default_factory=list)
+
+
+class ImportProgress:
+    """
+    Number of rows of a file imported so far, saved after each batch is
+    committed, so an interrupted import can be resumed where it stopped
+    """
+
+    def __init__(self, source, path=None):
+        self.source = source
+        self.path = path or f'{source}.import-progress'
+
+    def _stamp(self):
+        stat = os.stat(self.source)
+        return [stat.st_size, stat.st_mtime]
+
+    def load(self) -> int:
+        try:
+            with open(self.path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return 0
+        # the file changed since, start over
+        if state.get('stamp') != self._stamp():
+            return 0
+        return state.get('rows', 0)
+
+    def save(self, rows):
+        with open(self.path, 'w') as file:
+            json.dump({'stamp': self._stamp(), 'rows': rows}, file)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class CatalogueImporter:
+    """
+    Import products, their stockrecords, attribute values, categories and
+    images from rows of a supplier catalogue, matching products by upc.
+
+    Rows are written in batches with ``bulk_create``/``bulk_update``, only
+    what differs from the database is written. As bulk writes send no signals,
+    search indexing, listings and thumbnails of a batch are queued as
+    background tasks once the batch is committed.
+
+    Columns: upc (required), title, description, is_public, product_class,
+    partner_sku, price, num_in_stock, categories, image and attr.<code>.
+    Columns which are missing (or empty) are left as they are.
+    """
+
+    def __init__(self, partner, product_class=None, batch_size=CATALOGUE_IMPORT_BATCH_SIZE):
+        self.partner = partner
+        self.default_product_class = product_class
+        self.batch_size = batch_size
+        self.stats = ImportStats()
+        self._product_classes = {}
+        self._attributes = {}
+        self._categories = {}
+
+    def run(self, rows, skip=0, progress=None, report=None):
+        """
+        Import ``rows``, the first ``skip`` rows are skipped (resuming an
+        import). ``progress`` is an ImportProgress saved after each batch, and
+        ``report`` is called with the stats after each batch
+        """
+        rows = iter(rows)
+        self.stats.resumed = sum(1 for _ in islice(rows, skip))
+        row_number = self.stats.resumed
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            with transaction.atomic():
+                self.import_batch(batch, first_row=row_number + 1)
+            row_number += len(batch)
+            self.stats.rows += len(batch)
+            if progress is not None:
+                progress.save(row_number)
+            if report is not None:
+                report(self.stats)
+        return self.stats
+
+    # Parsing #######################
+
+    def get_product_class(self, name):
+        if name not in self._product_classes:
+            self._product_classes[name] = ProductClass.objects.filter(name__iexact=name).first()
+        if self._product_classes[name] is None:
+            raise RowError(f'product_class: {name!r} does not exist')
+        return self._product_classes[name]
+
+    def get_attribute(self, product_class, code):
+        key = (product_class.pk, code)
+        if key not in self._attributes:
+            self._attributes[key] = ProductAttribute.objects \
+                .select_related('option_group').filter(product_class=product_class, code=code).first()
+        if self._attributes[key] is None:
+            raise RowError(f'{ATTRIBUTE_PREFIX}{code}: no such attribute of {product_class}')
+        return self._attributes[key]
+
+    def get_category(self, breadcrumbs):
+        if breadcrumbs not in self._categories:
+            self._categories[breadcrumbs] = create_from_breadcrumbs(breadcrumbs)
+        return self._categories[breadcrumbs]
+
+    def attribute_value(self, attribute, value):
+        """
+        The (value field, value) of an attribute's value from it's text
+        """
+        name = f'{ATTRIBUTE_PREFIX}{attribute.code}'
+        kind = attribute.type
+        if kind in (attribute.TEXT, attribute.RICHTEXT):
+            return f'value_{kind}', value
+        if kind == attribute.INTEGER:
+            return 'value_integer', _integer(value, name)
+        if kind == attribute.FLOAT:
+            return 'value_float', float(_decimal(value, name))
+        if kind == attribute.BOOLEAN:
+            return 'value_boolean', value.lower() in TRUE_VALUES
+        if kind in (attribute.DATE, attribute.DATETIME):
+            parsed = parse_date(value) if kind == attribute.DATE else parse_datetime(value)
+            if parsed is None:
+                raise RowError(f'{name}: {value!r} is not a valid {kind}')
+            return f'value_{kind}', parsed
+        if kind == attribute.OPTION:
+            option = attribute.option_group.options.filter(option=value).first() \
+                if attribute.option_group else None
+            if option is None:
+                raise RowError(f'{name}: {value!r} is not an option')
+            return 'value_option_id', option.pk
+        raise RowError(f'{name}: {kind} attributes can not be imported')
+
+    def parse_row(self, raw: dict) -> dict:
+        row = {'upc': _text(raw.get('upc'))}
+        if not row['upc']:
+            raise RowError('upc: required')
+        for name in ('title', 'description', 'partner_sku', 'image'):
+            if _text(raw.get(name)):
+                row[name] = _text(raw[name])
+        if _text(raw.get('is_public')):
+            row['is_public'] = _text(raw['is_public']).lower() in TRUE_VALUES
+        price = _decimal(raw.get('price'), 'price')
+        if price is not None:
+            row['price'] = price
+        num_in_stock = _integer(raw.get('num_in_stock'), 'num_in_stock')
+        if num_in_stock is not None:
+            row['num_in_stock'] = num_in_stock
+        if _text(raw.get('product_class')):
+            row['product_class'] = self.get_product_class(_text(raw['product_class']))
+        if _text(raw.get('categories')):
+            row['categories'] = [
+                self.get_category(c.strip())
+                for c in _text(raw['categories']).split(CATEGORY_SEPARATOR) if c.strip()
+            ]
+        attributes = {
+            name[len(ATTRIBUTE_PREFIX):]: _text(value) for name, value in raw.items()
+            if name.startswith(ATTRIBUTE_PREFIX) and _text(value)
+        }
+        if attributes:
+            row['attributes'] = attributes
+        return row
+
+    def resolve_row(self, row, product=None):
+        """
+        Resolve what depends on the row's product (if it exists), ie. it's
+        product class and the attributes of that class
+        """
+        if 'product_class' in row:
+            product_class = row['product_class']
+        elif product is not None:
+            product_class = product.get_product_class()
+        else:
+            product_class = row['product_class'] = self.default_product_class
+        if product_class is None:
+            raise RowError('product_class: required for new products')
+        if 'attributes' in row:
+            row['attributes'] = dict(
+                (attribute.pk, self.attribute_value(attribute, value))
+                for attribute, value in (
+                    (self.get_attribute(product_class, code), value)
+                    for code, value in row['attributes'].items())
+            )
+        return row
+
+    # Writing #######################
+
+    def import_batch(self, raw_rows, first_row=1):
+        rows = {}
+        for number, raw in enumerate(raw_rows, first_row):
+            try:
+                row = self.parse_row(raw)
+            except RowError as e:
+                self.stats.errors.append((number, str(e)))
+                continue
+            # the last row of a upc wins
+            rows[row['upc']] = (number, row)
+
+        existing = Product.objects.select_related('product_class').in_bulk(list(rows), field_name='upc')
+        resolved = []
+        for upc, (number, row) in rows.items():
+            try:
+                resolved.append(self.resolve_row(row, existing.get(upc)))
+            except RowError as e:
+                self.stats.errors.append((number, str(e)))
+        if not resolved:
+            return
+        rows = resolved
+
+        created, updated = self.write_products(rows, existing)
+        ids = dict(Product.objects.filter(upc__in=[r['upc'] for r in rows]).values_list('upc', 'pk'))
+        for row in rows:
+            row['product_id'] = ids[row['upc']]
+
+        image_ids, imaged = self.write_images(rows)
+        updated |= self.write_stockrecords(rows)
+        updated |= self.write_attributes(rows)
+        updated |= self.write_categories(rows)
+        updated = (updated | imaged) - created
+
+        self.stats.created += len(created)
+        self.stats.updated += len(updated)
+        self.stats.unchanged += len(rows) - len(created) - len(updated)
+        changed = created | updated
+        transaction.on_commit(lambda: self.schedule_updates(changed, image_ids))
+
+    def write_products(self, rows, existing):
+        """
+        Create and update the products of ``rows``. Returns the (ids of the)
+        created and updated products
+        """
+        now = timezone.now()
+        new, updated, fields = [], [], set()
+        for row in rows:
+            values = {name: row[name] for name in ('title', 'description', 'is_public') if name in row}
+            if 'product_class' in row:
+                values['product_class_id'] = row['product_class'].pk
+            product = existing.get(row['upc'])
+            if product is None:
+                new.append(Product(upc=row['upc'], slug=slugify(row.get('title', row['upc'])), **values))
+                continue
+            diff = {name: value for name, value in values.items() if getattr(product, name) != value}
+            if diff:
+                for name, value in diff.items():
+                    setattr(product, name, value)
+                product.date_updated = now
+                updated.append(product)
+                fields |= set(diff)
+
+        Product.objects.bulk_create(new, batch_size=self.batch_size)
+        if updated:
+            Product.objects.bulk_update(updated, fields | {'date_updated'}, batch_size=self.batch_size)
+        # bulk_create doesn't set the ids of the products on every database
+        created = set(Product.objects.filter(upc__in=[p.upc for p in new]).values_list('pk', flat=True))
+        return created, {p.pk for p in updated}
+
+    def write_stockrecords(self, rows) -> set:
+        rows = [r for r in rows if {'price', 'num_in_stock', 'partner_sku'} & set(r)]
+        existing = {
+            sr.product_id: sr for sr in
+            StockRecord.objects.filter(partner=self.partner, product_id__in=[r['product_id'] for r in rows])
+        }
+        now = timezone.now()
+        new, updated, fields = [], [], set()
+        for row in rows:
+            values = {name: row[name] for name in ('partner_sku', 'price', 'num_in_stock') if name in row}
+            record = existing.get(row['product_id'])
+            if record is None:
+                values.setdefault('partner_sku', row['upc'])
+                new.append(StockRecord(
+                    product_id=row['product_id'], partner=self.partner,
+                    price_currency=settings.OSCAR_DEFAULT_CURRENCY, **values))
+                continue
+            diff = {name: value for name, value in values.items() if getattr(record, name) != value}
+            if diff:
+                for name, value in diff.items():
+                    setattr(record, name, value)
+                record.date_updated = now
+                updated.append(record)
+                fields |= set(diff)
+
+        StockRecord.objects.bulk_create(new, batch_size=self.batch_size)
+        if updated:
+            StockRecord.objects.bulk_update(updated, fields | {'date_updated'}, batch_size=self.batch_size)
+        return {r.product_id for r in new + updated}
+
+    def write_attributes(self, rows) -> set:
+        rows = [r for r in rows if 'attributes' in r]
+        existing = {
+            (av.product_id, av.attribute_id): av for av in
+            ProductAttributeValue.objects.filter(product_id__in=[r['product_id'] for r in rows])
+        }
+        new, updated, fields = [], [], set()
+        for row in rows:
+            for attribute_id, (name, value) in row['attributes'].items():
+                av = existing.get((row['product_id'], attribute_id))
+                if av is None:
+                    new.append(ProductAttributeValue(
+                        product_id=row['product_id'], attribute_id=attribute_id, **{name: value}))
+                elif getattr(av, name) != value:
+                    setattr(av, name, value)
+                    updated.append(av)
+                    fields.add(name)
+
+        ProductAttributeValue.objects.bulk_create(new, batch_size=self.batch_size)
+        if updated:
+            ProductAttributeValue.objects.bulk_update(updated, fields, batch_size=self.batch_size)
+        return {av.product_id for av in new + updated}
+
+    def write_categories(self, rows) -> set:
+        """
+        Link products to (only) the categories of their row
+        """
+        rows = [r for r in rows if 'categories' in r]
+        existing = {}
+        for link in ProductCategory.objects.filter(product_id__in=[r['product_id'] for r in rows]):
+            existing.setdefault(link.product_id, {})[link.category_id] = link.pk
+
+        new, removed, changed = [], [], set()
+        for row in rows:
+            current = existing.get(row['product_id'], {})
+            wanted = {c.pk for c in row['categories']}
+            new += [
+                ProductCategory(product_id=row['product_id'], category_id=pk)
+                for pk in wanted - set(current)
+            ]
+            removed += [current[pk] for pk in set(current) - wanted]
+            if wanted != set(current):
+                changed.add(row['product_id'])
+
+        ProductCategory.objects.filter(pk__in=removed).delete()
+        ProductCategory.objects.bulk_create(new, batch_size=self.batch_size)
+        return changed
+
+    def write_images(self, rows):
+        """
+        Add the image of a row (a file in the media storage) to it's product,
+        unless the product has it already. Returns the ids of the new images,
+        and of the products they were added to
+        """
+        rows = [r for r in rows if 'image' in r]
+        existing = {}
+        for product_id, name in ProductImage.objects \
+                .filter(product_id__in=[r['product_id'] for r in rows]) \
+                .values_list('product_id', 'original'):
+            existing.setdefault(product_id, set()).add(name)
+
+        new = [
+            ProductImage(
+                product_id=row['product_id'], original=row['image'],
+                display_order=len(existing.get(row['product_id'], ())))
+            for row in rows if row['image'] not in existing.get(row['product_id'], ())
+        ]
+        if not new:
+            return [], set()
+        ProductImage.objects.bulk_create(new, batch_size=self.batch_size)
+        added = {(i.product_id, i.original.name) for i in new}
+        image_ids = [
+            pk for pk, product_id, name in ProductImage.objects
+            .filter(product_id__in=[i.product_id for i in new])
+            .values_list('pk', 'product_id', 'original')
+            if (product_id, name) in added
+        ]
+        return image_ids, {product_id for product_id, _ in added}
+
+    def schedule_updates(self, product_ids, image_ids):
+        """
+        Queue what the signals of a product save would, for a
+        committed batch (bulk writes send no signals)
+        """
+        product_ids = list(product_ids)
+        for image_id in image_ids:
+            generate_product_thumbnails.delay(image_id)
+        if product_ids:
+            index_products.delay(product_ids)
+            refresh_product_listings.delay(product_ids)
+            facets.record_change(product_ids)
+            invalidate_products(product_ids)
+            categories_changed()
+
+
+def import_catalogue(path, partner, product_class=None, batch_size=CATALOGUE_IMPORT_BATCH_SIZE,
+                     resume=False, report=None) -> ImportStats:
+    """
+    Import a csv or json catalogue file, see CatalogueImporter.
+    With ``resume``, rows imported before an interruption are skipped
+    """
+    progress = ImportProgress(path)
+    skip = progress.load() if resume else 0
+    importer = CatalogueImporter(partner, product_class=product_class, batch_size=batch_size)
+    stats = importer.run(read_rows(path), skip=skip, progress=progress, report=report)
+    progress.clear()
+    return stats
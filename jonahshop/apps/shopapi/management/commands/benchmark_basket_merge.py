@@ -0,0 +1,94 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from oscar.core.loading import get_model
+
+from apps.shopapi.baskets import merge_baskets
+
+
+Basket = get_model('basket', 'Basket')
+Line = get_model('basket', 'Line')
+Partner = get_model('partner', 'Partner')
+Product = get_model('catalogue', 'Product')
+ProductClass = get_model('catalogue', 'ProductClass')
+StockRecord = get_model('partner', 'StockRecord')
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the merge of an anonymous basket into the user's basket on "
+        "sign in, with oscar's Basket.merge and the set based merge, for "
+        "baskets of hundreds of lines. Everything is rolled back afterwards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lines', default='10,100,300,600',
+            help='Comma separated numbers of lines of the anonymous basket')
+        parser.add_argument(
+            '--overlap', type=float, default=0.5,
+            help="Share of the anonymous basket's products which are in the user's basket too")
+
+    def handle(self, *args, **options):
+        sizes = [int(n) for n in options['lines'].split(',')]
+        overlap = options['overlap']
+
+        self.stdout.write(
+            f'{"lines":>6} {"oscar queries":>14} {"oscar s":>9} {"set queries":>12} {"set s":>9}')
+        with transaction.atomic():
+            stockrecords = self.create_stockrecords(max(sizes))
+            for size in sizes:
+                oscar = self.measure(
+                    stockrecords[:size], overlap, lambda master, slave: master.merge(slave, add_quantities=False))
+                fast = self.measure(stockrecords[:size], overlap, merge_baskets)
+                if oscar[2] != fast[2]:
+                    self.stderr.write(f'{size} lines: the merged baskets differ')
+                self.stdout.write(
+                    f'{size:>6} {oscar[0]:>14} {oscar[1]:>9.3f} {fast[0]:>12} {fast[1]:>9.3f}')
+            transaction.set_rollback(True)
+
+    def create_stockrecords(self, count):
+        # throwaway products, (bulk created, so no listings or index entries)
+        product_class = ProductClass.objects.create(name='Benchmark', track_stock=False)
+        partner = Partner.objects.create(name='Benchmark')
+        Product.objects.bulk_create([
+            Product(title=f'Benchmark {n}', slug=f'benchmark-{n}', upc=f'benchmark-{n}',
+                    product_class=product_class, structure=Product.STANDALONE)
+            for n in range(count)
+        ])
+        products = Product.objects.filter(upc__startswith='benchmark-').order_by('pk')
+        StockRecord.objects.bulk_create([
+            StockRecord(product=product, partner=partner, partner_sku=product.upc, price=1)
+            for product in products
+        ])
+        return list(StockRecord.objects.filter(partner=partner).order_by('pk'))
+
+    def create_basket(self, stockrecords, owner=None):
+        basket = Basket.objects.create(owner=owner)
+        Line.objects.bulk_create([
+            Line(basket=basket, product_id=record.product_id, stockrecord=record,
+                 line_reference=f'{record.product_id}_{record.pk}', quantity=1 + n % 3,
+                 price_currency=record.price_currency, price_excl_tax=record.price)
+            for n, record in enumerate(stockrecords)
+        ])
+        return basket
+
+    def measure(self, stockrecords, overlap, merge):
+        """
+        Merge a basket of ``stockrecords`` into one with ``overlap`` of them
+        (and as many others). Returns the number of queries, the seconds
+        and the merged lines
+        """
+        sid = transaction.savepoint()
+        shared = int(len(stockrecords) * overlap)
+        master = self.create_basket(stockrecords[:shared])
+        slave = self.create_basket(stockrecords)
+        with CaptureQueriesContext(connection) as ctx:
+            began = time.perf_counter()
+            merge(master, slave)
+            elapsed = time.perf_counter() - began
+        lines = sorted(Line.objects.filter(basket=master).values_list('line_reference', 'quantity'))
+        transaction.savepoint_rollback(sid)
+        return len(ctx.captured_queries), elapsed, lines
@@ -0,0 +1,128 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+from oscar.core.loading import get_model
+
+from apps.shopapi.stock import InsufficientStock, allocate_stock, consume_reservations, reserve_basket
+
+
+Basket = get_model('basket', 'Basket')
+Line = get_model('basket', 'Line')
+Partner = get_model('partner', 'Partner')
+Product = get_model('catalogue', 'Product')
+ProductClass = get_model('catalogue', 'ProductClass')
+StockRecord = get_model('partner', 'StockRecord')
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure how the stock allocation of checkouts scales with the number "
+        "of concurrent buyers of a single SKU (a flash sale). Each buyer takes "
+        "an item at a time until the stock runs out; overselling is an error. "
+        "With --flow=checkout each item is bought as a checkout does: a basket "
+        "is reserved, then (in a transaction of its own) the reservation is "
+        "consumed by the order. Transactions which fail on contention (eg. "
+        "sqlite's \"database is locked\", as sqlite runs a write transaction "
+        "at a time) are retried, and counted as failed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--buyers', default='1,2,4,8,16',
+            help='Comma separated numbers of concurrent buyers to run with')
+        parser.add_argument(
+            '--stock', type=int, default=500, help='Number of items of the SKU in stock')
+        parser.add_argument(
+            '--flow', choices=['allocate', 'checkout'], default='allocate',
+            help='Allocate items directly, or reserve and consume baskets of them')
+
+    def handle(self, *args, **options):
+        buyers = [int(n) for n in options['buyers'].split(',')]
+        stock = options['stock']
+        buy_item = self.check_out if options['flow'] == 'checkout' else self.allocate
+
+        # a throwaway SKU, deleted afterwards
+        product_class = ProductClass.objects.create(name='Benchmark', track_stock=True)
+        product = Product.objects.create(title='Benchmark SKU', product_class=product_class)
+        partner = Partner.objects.create(name='Benchmark')
+        stockrecord = StockRecord.objects.create(
+            product=product, partner=partner, partner_sku='benchmark-sku',
+            price=1, num_in_stock=stock, num_allocated=0)
+        try:
+            self.stdout.write(f'{"buyers":>8} {"sold":>6} {"failed":>7} {"seconds":>9} {"items/s":>9}')
+            for count in buyers:
+                StockRecord.objects.filter(pk=stockrecord.pk).update(num_allocated=0)
+                sold, failed, elapsed = self.run_sale(stockrecord, count, buy_item)
+                stockrecord.refresh_from_db()
+                if sold != stock or stockrecord.num_allocated != stock:
+                    self.stderr.write(
+                        f'{count} buyers: sold {sold}, allocated {stockrecord.num_allocated} of {stock}')
+                self.stdout.write(
+                    f'{count:>8} {sold:>6} {failed:>7} {elapsed:>9.3f} {sold / elapsed:>9.0f}')
+        finally:
+            Basket.objects.filter(lines__stockrecord=stockrecord).delete()
+            product.delete()
+            partner.delete()
+            product_class.delete()
+
+    def allocate(self, stockrecord) -> bool:
+        return allocate_stock(stockrecord.pk, 1)
+
+    def check_out(self, stockrecord) -> bool:
+        with transaction.atomic():
+            basket = Basket.objects.create()
+            Line.objects.create(
+                basket=basket, product_id=stockrecord.product_id, stockrecord=stockrecord,
+                line_reference=f'{stockrecord.product_id}_{stockrecord.pk}', quantity=1,
+                price_currency=stockrecord.price_currency, price_excl_tax=stockrecord.price)
+        # as CheckoutSerializer.create: the stock is reserved in a short
+        # transaction, then the order is placed in another which only
+        # consumes the reservation
+        try:
+            reserve_basket(basket)
+        except InsufficientStock:
+            return False
+        while True:
+            try:
+                with transaction.atomic():
+                    consume_reservations(basket)
+                return True
+            except OperationalError:
+                # the item stays reserved, until the order is placed
+                self.contended()
+
+    def contended(self):
+        with self.lock:
+            self.failed += 1
+
+    def run_sale(self, stockrecord, buyers, buy_item):
+        sold = [0] * buyers
+        self.lock = threading.Lock()
+        self.failed = 0
+        start = threading.Barrier(buyers + 1)
+
+        def buy(n):
+            start.wait()
+            try:
+                while True:
+                    try:
+                        if not buy_item(stockrecord):
+                            break
+                        sold[n] += 1
+                    except OperationalError:
+                        # lost to a concurrent transaction, tried again
+                        self.contended()
+            finally:
+                # each thread has it's own connection
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(n,)) for n in range(buyers)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        began = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return sum(sold), self.failed, time.perf_counter() - began
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.shopapi.recommendations import (
+    RECOMMENDATIONS_CHUNK_SIZE,
+    RECOMMENDATIONS_TOP_K,
+    build_recommendations
+)
+
+
+class Command(BaseCommand):
+    help = "Rebuild the \"customers also bought\" recommendations from the order lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top', type=int, default=RECOMMENDATIONS_TOP_K,
+            help='Number of recommendations kept for each product')
+        parser.add_argument(
+            '--chunk-size', type=int, default=RECOMMENDATIONS_CHUNK_SIZE,
+            help='Number of order lines read at a time')
+
+    def handle(self, *args, **options):
+        count = build_recommendations(k=options['top'], chunk_size=options['chunk_size'])
+        self.stdout.write(f'Built the recommendations of {count} products')
@@ -0,0 +1,44 @@
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from apps.shopapi.feeds import FEED_FORMATS, NDJSON, PRODUCT_FEED_CHUNK_SIZE, feed_lines
+
+
+class Command(BaseCommand):
+    help = "Export all browsable products as a newline delimited json or csv feed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', choices=list(FEED_FORMATS), default=NDJSON)
+        parser.add_argument('--output', help="File to write the feed to, defaults to stdout")
+        parser.add_argument(
+            '--base-url',
+            help="Base of the absolute urls in the feed (an allowed host), "
+                 "defaults to https://<current site domain>")
+        parser.add_argument('--chunk-size', type=int, default=PRODUCT_FEED_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'] or f'https://{Site.objects.get_current().domain}'
+        url = urlsplit(base_url)
+        # urls in the feed are built against this request
+        request = RequestFactory().get('/', secure=url.scheme == 'https', HTTP_HOST=url.netloc)
+
+        lines = feed_lines(options['type'], {'request': request}, chunk_size=options['chunk_size'])
+        start = time.monotonic()
+        count = 0
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for line in lines:
+                    output.write(line)
+                    count += 1
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
+                count += 1
+
+        if options['type'] != NDJSON:
+            count -= 1 # the header
+        self.stderr.write(f'Exported {count} products in {time.monotonic() - start:.1f}s')
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from oscar.core.loading import get_model
+
+from apps.shopapi.importer import CATALOGUE_IMPORT_BATCH_SIZE, import_catalogue
+
+
+Partner = get_model('partner', 'Partner')
+ProductClass = get_model('catalogue', 'ProductClass')
+
+
+class Command(BaseCommand):
+    help = (
+        "Import (create or update) products from a supplier's csv or json catalogue file, "
+        "matching products by upc. See apps.shopapi.importer.CatalogueImporter for the columns"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="A .csv file, or a .json file (an array or json lines)")
+        parser.add_argument('--partner', required=True, help="Name of the partner the stock is from")
+        parser.add_argument('--product-class', help="Product class of new products without one")
+        parser.add_argument('--batch-size', type=int, default=CATALOGUE_IMPORT_BATCH_SIZE)
+        parser.add_argument(
+            '--resume', action='store_true',
+            help="Skip the rows imported by a previous (interrupted) import of the same file")
+
+    def handle(self, *args, **options):
+        partner = Partner.objects.filter(name=options['partner']).first()
+        if partner is None:
+            raise CommandError(f"Partner {options['partner']!r} does not exist")
+        product_class = None
+        if options['product_class']:
+            product_class = ProductClass.objects.filter(name__iexact=options['product_class']).first()
+            if product_class is None:
+                raise CommandError(f"Product class {options['product_class']!r} does not exist")
+
+        start = time.monotonic()
+
+        def report(stats):
+            rate = stats.rows / max(time.monotonic() - start, 1e-6)
+            self.stdout.write(f'{stats.resumed + stats.rows} rows, {rate:.0f} rows/s')
+
+        stats = import_catalogue(
+            options['path'], partner, product_class=product_class,
+            batch_size=options['batch_size'], resume=options['resume'], report=report)
+
+        for row, message in stats.errors:
+            self.stderr.write(f'Row {row}: {message}')
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            f'Imported {stats.rows} rows in {elapsed:.1f}s ({stats.rows / max(elapsed, 1e-6):.0f} rows/s): '
+            f'{stats.created} created, {stats.updated} updated, {stats.unchanged} unchanged, '
+            f'{len(stats.errors)} errors'
+            + (f', {stats.resumed} rows skipped (resumed)' if stats.resumed else '')
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.shopapi.search import product_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full text search index of browsable products"
+
+    def handle(self, *args, **options):
+        count = product_index.rebuild()
+        self.stdout.write(f'Indexed {count} products in {product_index.path}')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from apps.shopapi.cache import invalidate_catalogue
+from apps.shopapi.models import ProductListing
+
+
+class Command(BaseCommand):
+    help = "Recompute the product listing read model of all browsable products"
+
+    def handle(self, *args, **options):
+        count = ProductListing.objects.refresh()
+        invalidate_catalogue()
+        self.stdout.write(f'Refreshed the listings of {count} products')
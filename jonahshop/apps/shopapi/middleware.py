@@ -0,0 +1,182 @@
+import threading
+
+from django.conf import settings
+from django.core.signing import BadSignature, Signer
+from django.utils.functional import SimpleLazyObject
+from oscar.apps.basket.middleware import BasketMiddleware as OscarBasketMiddleware, selector
+
+from apps.shopapi.baskets import (
+    materialize_basket,
+    merge_baskets,
+    merge_cached_basket,
+    mutate_basket
+)
+from apps.shopapi.models import CachedBasket
+from apps.shopapi.offers import offer_results
+
+
+# Where the baskets of anonymous users are kept, DATABASE (as oscar does)
+# or CACHE, see CachedBasket
+DATABASE = 'db'
+CACHE = 'cache'
+
+
+def cached_storage() -> bool:
+    return getattr(settings, 'BASKET_STORAGE', DATABASE) == CACHE
+
+
+def cached_basket_cookie() -> str:
+    return getattr(settings, 'CACHED_BASKET_COOKIE', 'jonahshop_cached_basket')
+
+
+class BasketLoadCounter:
+    """
+    Counts the requests served, and how many of them loaded
+    the basket (and applied offers to it), see :meth:`stats`
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.baskets_loaded = 0
+
+    def request(self):
+        with self._lock:
+            self.requests += 1
+
+    def basket_loaded(self):
+        with self._lock:
+            self.baskets_loaded += 1
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'baskets_loaded': self.baskets_loaded,
+        }
+
+
+basket_loads = BasketLoadCounter()
+
+
+class BasketMiddleware(OscarBasketMiddleware):
+    """
+    Oscar's basket middleware, which (with BASKET_STORAGE = 'cache') keeps
+    the baskets of anonymous users in the cache, referred to by a cookie.
+
+    Nothing is written to the database for a cached basket until it is
+    needed there: at checkout (see materialize_request_basket), or when
+    the user signs in, and it's lines are merged into the user's basket.
+    Baskets which were saved before (eg. before the storage was changed)
+    are still used.
+
+    Unlike oscar's, the strategy of the request is lazy too (it loads the
+    user), so a request which reads neither ``request.basket`` nor
+    ``request.strategy`` (eg. of the product list or the user's details)
+    costs no queries here. Basket loads are counted in ``basket_loads``.
+    Offers are applied through ``offer_results``, so they are only
+    evaluated again when the basket or the offers change
+    """
+
+    def __call__(self, request):
+        basket_loads.request()
+        request.cookies_to_delete = []
+        request.strategy = SimpleLazyObject(
+            lambda: selector.strategy(request=request, user=request.user))
+        request._basket_cache = None
+
+        def load_full_basket():
+            basket = self.get_basket(request)
+            basket.strategy = request.strategy
+            self.apply_offers_to_basket(request, basket)
+            basket_loads.basket_loaded()
+            return basket
+
+        def load_basket_hash():
+            basket = self.get_basket(request)
+            if basket.id:
+                return self.get_basket_hash(basket.id)
+
+        request.basket = SimpleLazyObject(load_full_basket)
+        request.basket_hash = SimpleLazyObject(load_basket_hash)
+
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    def apply_offers_to_basket(self, request, basket):
+        offer_results.apply(basket, request.user, request)
+
+    def merge_baskets(self, master, slave):
+        # the (set based) merge of the basket of the session
+        # into the user's basket, when the user signs in
+        mutate_basket(master, lambda: merge_baskets(master, slave))
+
+    def get_basket(self, request):
+        if request._basket_cache is not None or not cached_storage():
+            return super().get_basket(request)
+
+        cached = self.get_cached_basket(request)
+        if request.user.is_authenticated:
+            basket = super().get_basket(request)
+            if cached is not None:
+                basket.strategy = cached.strategy = request.strategy
+                merge_cached_basket(basket, cached, request.user, request)
+                request.cookies_to_delete.append(cached_basket_cookie())
+            return basket
+
+        if self.get_cookie_key(request) in request.COOKIES:
+            # a basket saved to the database (not cached) before
+            return super().get_basket(request)
+
+        basket = cached if cached is not None else CachedBasket.load()
+        request._basket_cache = basket
+        return basket
+
+    def get_cached_basket(self, request):
+        value = request.COOKIES.get(cached_basket_cookie())
+        if value is None:
+            return None
+        try:
+            return CachedBasket.load(Signer().unsign(value))
+        except BadSignature:
+            request.cookies_to_delete.append(cached_basket_cookie())
+            return None
+
+    def process_response(self, request, response):
+        response = super().process_response(request, response)
+        basket = getattr(request, '_basket_cache', None)
+        if not isinstance(basket, CachedBasket) or basket.token is None:
+            return response
+
+        cookie_key = cached_basket_cookie()
+        if basket.is_empty:
+            if cookie_key in request.COOKIES:
+                response.delete_cookie(cookie_key)
+        elif cookie_key not in request.COOKIES:
+            response.set_cookie(
+                cookie_key, Signer().sign(basket.token),
+                max_age=settings.OSCAR_BASKET_COOKIE_LIFETIME,
+                secure=settings.OSCAR_BASKET_COOKIE_SECURE, httponly=True)
+        return response
+
+
+def materialize_request_basket(request):
+    """
+    Write the basket of ``request`` to the database if it is a cached
+    one (eg. before checkout), and make it the basket of the request.
+    Returns the basket
+    """
+    # (the django request of a rest framework request)
+    request = getattr(request, '_request', request)
+    basket = request.basket
+    if not isinstance(basket, CachedBasket) or basket.is_empty:
+        return basket
+
+    owner = request.user if request.user.is_authenticated else None
+    basket = materialize_basket(basket, owner, request)
+    # the (saved) basket is referred to by oscar's cookie from now on
+    request.basket = request._basket_cache = basket
+    request.cookies_to_delete.append(cached_basket_cookie())
+    return basket
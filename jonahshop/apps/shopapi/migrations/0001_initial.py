@@ -0,0 +1,32 @@
+# Generated by Django 3.2.13 on 2026-10-18 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('catalogue', '0022_auto_20210210_0539'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductListing',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='catalogue.product')),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('rating', models.FloatField(null=True)),
+                ('price_excl_tax', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('availability', models.BooleanField(default=False)),
+                ('image', models.CharField(blank=True, max_length=255)),
+                ('is_parent', models.BooleanField(default=False)),
+                ('date_created', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'ordering': ['-date_created'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.13 on 2026-10-18 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productlisting',
+            name='srcset',
+            field=models.JSONField(default=dict),
+        ),
+    ]
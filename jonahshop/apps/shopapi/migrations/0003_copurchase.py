@@ -0,0 +1,29 @@
+# Generated by Django 3.2.13 on 2026-10-18 10:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogue', '0022_auto_20210210_0539'),
+        ('shopapi', '0002_productlisting_srcset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='co_purchases', to='catalogue.product')),
+                ('recommendation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='co_purchased_with', to='catalogue.product')),
+            ],
+            options={
+                'ordering': ['product', 'rank'],
+                'unique_together': {('product', 'rank')},
+            },
+        ),
+    ]
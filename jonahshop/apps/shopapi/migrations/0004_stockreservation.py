@@ -0,0 +1,29 @@
+# Generated by Django 3.2.13 on 2026-10-18 10:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partner', '0006_auto_20200724_0909'),
+        ('basket', '0009_line_date_updated'),
+        ('shopapi', '0003_copurchase'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('basket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='basket.basket')),
+                ('stockrecord', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='partner.stockrecord')),
+            ],
+            options={
+                'unique_together': {('basket', 'stockrecord')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.13 on 2026-10-18 10:46
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basket', '0009_line_date_updated'),
+        ('shopapi', '0004_stockreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedBasket',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('basket.basket',),
+        ),
+    ]
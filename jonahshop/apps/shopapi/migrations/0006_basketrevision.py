@@ -0,0 +1,22 @@
+# Generated by Django 3.2.13 on 2026-10-18 10:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basket', '0009_line_date_updated'),
+        ('shopapi', '0005_cachedbasket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BasketRevision',
+            fields=[
+                ('basket', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='revision', serialize=False, to='basket.basket')),
+                ('revision', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
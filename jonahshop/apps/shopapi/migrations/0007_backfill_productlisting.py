@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def backfill_listings(apps, schema_editor):
+    # Listings are computed with the strategy and the thumbnail url store,
+    # which work with the actual models, not the historical ones. Products
+    # created afterwards are listed by apps.shopapi.receivers
+    from apps.shopapi.models import ProductListing
+    ProductListing.objects.refresh()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogue', '0022_auto_20210210_0539'),
+        ('partner', '0006_auto_20200724_0909'),
+        ('shopapi', '0006_basketrevision'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_listings, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,351 @@
-from django.db import models
+import secrets
 
-# Create your models here.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from oscar.core.loading import get_model, get_class
+
+from apps.core.mixins import primary_image_srcset, primary_image_url
+from apps.core.thumbnails import IMAGE_PRESETS
+from apps.core.strategy import PurchaseInfoResolver
+from apps.shopapi.cache import basket_version_key, bump_version
+
+
+Selector = get_class('partner.strategy', 'Selector')
+Product = get_model('catalogue', 'Product')
+StockRecord = get_model('partner', 'StockRecord')
+Basket = get_model('basket', 'Basket')
+Line = get_model('basket', 'Line')
+
+# Seconds the lines of an (untouched) cached basket are kept,
+# as long as the cookie which refers to it
+CACHED_BASKET_TIMEOUT = getattr(settings, 'OSCAR_BASKET_COOKIE_LIFETIME', 7 * 24 * 60 * 60)
+# Seconds a cached basket is locked for while it is changed, at most
+# (in case the process changing it dies meanwhile)
+CACHED_BASKET_LOCK_TIMEOUT = getattr(settings, 'CACHED_BASKET_LOCK_TIMEOUT', 5)
+
+
+class ProductListingQuerySet(models.QuerySet):
+
+    def refresh(self, product_ids=None, chunk_size=500) -> int:
+        """
+        Recompute the listings of ``product_ids`` (all browsable products if
+        not given) from the catalogue. Listings of products which are not
+        browsable (anymore) are deleted. Returns the number of listings written
+        """
+        products = Product.objects.browsable()
+        stale = self.exclude(pk__in=products.values('pk'))
+        if product_ids is not None:
+            product_ids = list(product_ids)
+            products = products.filter(pk__in=product_ids)
+            stale = stale.filter(pk__in=product_ids)
+        stale.delete()
+
+        # keyset chunks, as .iterator() doesn't prefetch the images
+        products = products.select_related('product_class') \
+            .prefetch_related('images').order_by('pk')
+        count = 0
+        last_pk = 0
+        while True:
+            chunk = list(products.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+            self._write(chunk)
+            count += len(chunk)
+            last_pk = chunk[-1].pk
+        return count
+
+    def _write(self, products):
+        resolver = PurchaseInfoResolver(Selector().strategy())
+        resolver.prime(products)
+        listings = [self.model.from_product(p, resolver.fetch(p)) for p in products]
+
+        existing = set(self.filter(pk__in=[p.pk for p in products]).values_list('pk', flat=True))
+        with transaction.atomic():
+            # a listing may be created meanwhile by another refresh (of the
+            # same product), computed from the same catalogue
+            self.bulk_create([l for l in listings if l.pk not in existing], ignore_conflicts=True)
+            self.bulk_update(
+                [l for l in listings if l.pk in existing],
+                ProductListing.LISTING_FIELDS
+            )
+
+
+class ProductListing(models.Model):
+    """
+    Read model of the product listing. A flat row per browsable product,
+    holding exactly what the listing shows, so it is served with a single
+    query (no stockrecords, images, strategy or thumbnail lookups).
+
+    Rows are recomputed in the background when a product (or it's stockrecords
+    and images) changes, see apps.shopapi.receivers and apps.shopapi.tasks.
+    """
+    LISTING_FIELDS = [
+        'title', 'rating', 'price_excl_tax', 'availability', 'image', 'srcset', 'is_parent',
+        'date_created',
+    ]
+
+    product = models.OneToOneField(
+        'catalogue.Product', primary_key=True, on_delete=models.CASCADE, related_name='listing')
+    title = models.CharField(max_length=255, blank=True)
+    rating = models.FloatField(null=True)
+    price_excl_tax = models.DecimalField(decimal_places=2, max_digits=12, null=True)
+    availability = models.BooleanField(default=False)
+    # (relative) url of the primary image's thumbnail
+    image = models.CharField(max_length=255, blank=True)
+    # (relative) urls and widths of it's thumbnails for each format, see get_srcset
+    srcset = models.JSONField(default=dict)
+    is_parent = models.BooleanField(default=False)
+    # products are listed latest first, see Product.Meta.ordering
+    date_created = models.DateTimeField(db_index=True)
+
+    objects = ProductListingQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-date_created']
+
+    def __str__(self):
+        return self.title
+
+    @classmethod
+    def from_product(cls, product, purchase_info):
+        return cls(
+            product_id=product.pk,
+            title=product.title,
+            rating=product.rating,
+            price_excl_tax=purchase_info.price.excl_tax,
+            availability=purchase_info.availability.is_available_to_buy,
+            image=primary_image_url(product, IMAGE_PRESETS['listing'][0]),
+            srcset=primary_image_srcset(product, IMAGE_PRESETS['listing']),
+            is_parent=product.is_parent,
+            date_created=product.date_created,
+        )
+
+
+class CoPurchase(models.Model):
+    """
+    "Customers also bought": the top neighbours of a product, by the number
+    of orders they were bought together in. A row per (product, rank),
+    rebuilt offline from the order lines, see apps.shopapi.recommendations
+    """
+    product = models.ForeignKey(
+        'catalogue.Product', on_delete=models.CASCADE, related_name='co_purchases')
+    recommendation = models.ForeignKey(
+        'catalogue.Product', on_delete=models.CASCADE, related_name='co_purchased_with')
+    rank = models.PositiveSmallIntegerField()
+    # number of orders both products were bought in
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        # also the index recommendations are looked up with
+        unique_together = [('product', 'rank')]
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.recommendation_id}'
+
+
+class StockReservation(models.Model):
+    """
+    Stock of a stockrecord held for a basket, from when its checkout starts
+    until the order is placed, or the reservation expires. Reserved stock is
+    allocated (``num_allocated``), so no other checkout can take it.
+    See apps.shopapi.stock
+    """
+    basket = models.ForeignKey(
+        'basket.Basket', on_delete=models.CASCADE, related_name='stock_reservations')
+    stockrecord = models.ForeignKey(
+        'partner.StockRecord', on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    # abandoned reservations are released by a periodic sweeper
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = [('basket', 'stockrecord')]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.stockrecord_id} for {self.basket_id}'
+
+
+class BasketRevision(models.Model):
+    """
+    The revision of a basket, incremented by every change of it's lines
+    (made through apps.shopapi.baskets.mutate_basket). Changes are made
+    optimistically: they are committed only if the revision is still the
+    one the basket was read at, so no lock is held while they are made
+    """
+    basket = models.OneToOneField(
+        'basket.Basket', primary_key=True, on_delete=models.CASCADE, related_name='revision')
+    revision = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.basket_id} @ {self.revision}'
+
+
+class CachedBasket(Basket):
+    """
+    The basket of an anonymous user, kept in the cache instead of the
+    database (see BASKET_STORAGE and apps.shopapi.middleware), as most of
+    them are abandoned.
+
+    It's lines are stored as a compact list of [product id, stockrecord id,
+    quantity], and (unsaved) Line objects are built from it when they are
+    read, so prices, totals and offers work as they do for a Basket. It is
+    never saved: at checkout it is written to the database as a Basket
+    (materialized), and on login it's lines are merged into the user's
+    basket, see apps.shopapi.baskets
+    """
+
+    class Meta:
+        proxy = True
+
+    @classmethod
+    def load(cls, token=None):
+        """
+        The basket stored under ``token``, an empty one if there
+        isn't (a token is assigned when it is first written to)
+        """
+        basket = cls()
+        basket.token = token
+        basket._items = (cache.get(cls._cache_key(token)) if token else None) or []
+        return basket
+
+    @staticmethod
+    def _cache_key(token) -> str:
+        return f'basket:cached:{token}'
+
+    def reload(self):
+        """
+        Read the lines again, as left by changes of other requests
+        """
+        if self.token is not None:
+            self._items = cache.get(self._cache_key(self.token)) or []
+        self._lines = None
+        self.reset_offer_applications()
+
+    def lock(self) -> bool:
+        """
+        Lock the basket against changes by other requests, False if another
+        one holds the lock. Changes of the lines read, modify and write them
+        back, so they are made while it is held (see unlock), by
+        apps.shopapi.baskets.mutate_basket
+        """
+        if self.token is None:
+            # not stored yet, no other request can change it
+            self._lock_id = None
+            return True
+        self._lock_id = secrets.token_urlsafe(8)
+        return cache.add(f'{self._cache_key(self.token)}:lock', self._lock_id, CACHED_BASKET_LOCK_TIMEOUT)
+
+    def unlock(self):
+        if self._lock_id is None:
+            return
+        key = f'{self._cache_key(self.token)}:lock'
+        # (unless it expired, and was taken by another request meanwhile)
+        if cache.get(key) == self._lock_id:
+            cache.delete(key)
+        self._lock_id = None
+
+    @property
+    def cache_id(self) -> str:
+        # what the versions of the basket are kept under, in place of an id
+        return f'cached-{self.token}'
+
+    def _write(self):
+        if self.token is None:
+            self.token = secrets.token_urlsafe(16)
+        cache.set(self._cache_key(self.token), self._items, CACHED_BASKET_TIMEOUT)
+        bump_version(basket_version_key(self.cache_id))
+        self.reset_offer_applications()
+
+    def flush(self):
+        """
+        Remove all the lines (eg. once they have been written to the database)
+        """
+        self._items = []
+        if self.token is not None:
+            cache.delete(self._cache_key(self.token))
+            bump_version(basket_version_key(self.cache_id))
+        self.reset_offer_applications()
+
+    def all_lines(self):
+        if self._lines is None:
+            products = Product.objects \
+                .select_related('product_class', 'parent__product_class') \
+                .in_bulk([product_id for product_id, _, _ in self._items])
+            stockrecords = StockRecord.objects.in_bulk([record_id for _, record_id, _ in self._items])
+            lines = []
+            for product_id, record_id, quantity in self._items:
+                # products (or stockrecords) deleted since they were added are left out
+                if product_id in products and record_id in stockrecords:
+                    lines.append(self._build_line(products[product_id], stockrecords[record_id], quantity))
+            self._lines = lines
+        return self._lines
+
+    def _build_line(self, product, stockrecord, quantity):
+        return Line(
+            basket=self,
+            product=product,
+            stockrecord=stockrecord,
+            quantity=quantity,
+            line_reference=self._create_line_reference(product, stockrecord, None),
+            price_currency=stockrecord.price_currency,
+            price_excl_tax=stockrecord.price,
+        )
+
+    def add(self, product, quantity=1, options=None):
+        """
+        Add ``quantity`` of ``product``, as Basket.add does.
+        Returns the (unsaved) line of the product and whether it was created
+        """
+        if options:
+            raise ValueError("Products with options can't be added to a cached basket")
+        stock_info = self.get_stock_info(product, options)
+        if not stock_info.price.exists:
+            raise ValueError(f'Strategy hasn\'t found a price for product {product}')
+        record_id = stock_info.stockrecord.pk
+
+        for item in self._items:
+            if item[0] == product.pk and item[1] == record_id:
+                item[2] = max(0, item[2] + quantity)
+                created = False
+                break
+        else:
+            self._items.append([product.pk, record_id, quantity])
+            created = True
+        self._items = [item for item in self._items if item[2] > 0]
+        self._write()
+
+        for line in self.all_lines():
+            if line.product_id == product.pk and line.stockrecord_id == record_id:
+                return line, created
+        return self._build_line(product, stock_info.stockrecord, 0), created
+
+    add_product = add
+
+    def set_quantities(self, quantities: dict, stockrecord_ids: dict):
+        """
+        Set the quantity of each product (id) in ``quantities``, products
+        set to 0 are removed. The lines of new products are added with their
+        stockrecord (id) in ``stockrecord_ids``
+        """
+        items = {item[0]: item for item in self._items}
+        for product_id, quantity in quantities.items():
+            if product_id in items:
+                items[product_id][2] = quantity
+            elif quantity > 0:
+                self._items.append([product_id, stockrecord_ids[product_id], quantity])
+        self._items = [item for item in self._items if item[2] > 0]
+        self._write()
+
+    @property
+    def is_empty(self):
+        return not self._items
+
+    @property
+    def num_lines(self):
+        return len(self.all_lines())
+
+    @property
+    def num_items(self):
+        return sum(line.quantity for line in self.all_lines())
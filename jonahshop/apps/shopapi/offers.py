@@ -0,0 +1,120 @@
+import threading
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from oscar.core.loading import get_class
+
+from apps.shopapi.cache import (
+    CATALOGUE_VERSION_KEY,
+    OFFERS_VERSION_KEY,
+    basket_cache_id,
+    basket_version_key,
+    get_version
+)
+
+
+Applicator = get_class('offer.applicator', 'Applicator')
+OfferApplications = get_class('offer.results', 'OfferApplications')
+
+# Seconds the offers applied to a basket are reused for. Offers are also
+# re-applied when they change, this bounds the effect of (eg.) an offer
+# which ends meanwhile, or a user using up an offer in another basket
+OFFER_RESULTS_TIMEOUT = getattr(settings, 'OFFER_RESULTS_TIMEOUT', 60 * 5)
+
+
+def _user_key(user) -> str:
+    # offers are available to users (eg. limited applications per user),
+    # not to groups of them
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    return f'user-{user.pk}'
+
+
+def offer_results_key(basket, lines, user) -> str:
+    """
+    The version of everything applying offers to ``basket`` depends on: it's
+    lines and their quantities, the user, it's vouchers (part of the basket's
+    version), the active offers and the prices of the products
+    """
+    parts = sorted((line.line_reference, line.quantity) for line in lines)
+    parts += [
+        _user_key(user),
+        get_version(basket_version_key(basket_cache_id(basket))),
+        get_version(OFFERS_VERSION_KEY),
+        get_version(CATALOGUE_VERSION_KEY),
+    ]
+    return f'offers:basket:{md5(repr(parts).encode()).hexdigest()}'
+
+
+def _line_state(line):
+    consumer = line.consumer
+    return (
+        line._discount_excl_tax,
+        line._discount_incl_tax,
+        consumer._offers,
+        consumer._affected_quantity,
+        consumer._consumptions,
+    )
+
+
+def _restore_line(line, state):
+    line.clear_discount()
+    if state is not None:
+        consumer = line.consumer
+        (line._discount_excl_tax, line._discount_incl_tax, consumer._offers,
+         consumer._affected_quantity, consumer._consumptions) = state
+
+
+class OfferResultsMemo:
+    """
+    The outcome of applying offers to a basket: the discounts of it's lines
+    and the offer applications, memoized by :func:`offer_results_key`.
+    So reading a basket's totals again, until it (or the offers) change,
+    doesn't run the applicator, which evaluates every active offer and range.
+
+    Hits and misses are counted, see :meth:`stats`
+    """
+
+    def __init__(self, timeout=OFFER_RESULTS_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def apply(self, basket, user=None, request=None):
+        """
+        Apply offers to ``basket``, as ``Applicator().apply`` does
+        """
+        if basket.id is None and basket.is_empty:
+            return
+        lines = list(basket.all_lines())
+        if not lines:
+            return
+
+        key = offer_results_key(basket, lines, user)
+        results = cache.get(key)
+        if results is not None:
+            applications, states = results
+            basket.offer_applications = OfferApplications()
+            basket.offer_applications.applications = applications
+            for line in lines:
+                _restore_line(line, states.get(line.line_reference))
+            with self._lock:
+                self.hits += 1
+            return
+
+        Applicator().apply(basket, user, request)
+        states = {line.line_reference: _line_state(line) for line in lines}
+        cache.set(key, (basket.offer_applications.applications, states), self.timeout)
+        with self._lock:
+            self.misses += 1
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+offer_results = OfferResultsMemo()
@@ -0,0 +1,67 @@
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+
+class PageOrCursorPagination(BasePagination):
+    """
+    Page number pagination, with an opt-in keyset (cursor) pagination mode.
+
+    Clients opt in with ``?pagination=cursor``. In cursor mode pages are
+    fetched by seeking on the ``ordering`` key, instead of a ``COUNT(*)``
+    plus an ``OFFSET`` scan, and the response has opaque ``next`` and
+    ``previous`` cursor links but no ``count``. The next/previous links keep
+    the ``pagination`` query param, so clients only opt in once.
+    """
+    mode_query_param = 'pagination'
+    cursor_mode = 'cursor'
+    # stable sort key for the cursor mode
+    ordering = '-pk'
+
+    def get_paginator(self, request):
+        if self.is_cursor_mode(request):
+            paginator = CursorPagination()
+            paginator.ordering = self.ordering
+            return paginator
+        return PageNumberPagination()
+
+    def is_cursor_mode(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == self.cursor_mode
+            or CursorPagination.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginator = self.get_paginator(request)
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return PageNumberPagination().get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        cursor = CursorPagination()
+        return [
+            *PageNumberPagination().get_schema_operation_parameters(view),
+            {
+                'name': self.mode_query_param,
+                'required': False,
+                'in': 'query',
+                'description': "Set to 'cursor' for cursor pagination (no page count)",
+                'schema': {'type': 'string', 'enum': [self.cursor_mode]},
+            },
+            *cursor.get_schema_operation_parameters(view),
+        ]
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+
+class ProductPagination(PageOrCursorPagination):
+    # same order products are listed in, see Product.Meta.ordering
+    ordering = '-date_created'
+
+
+class OrderPagination(PageOrCursorPagination):
+    # latest orders first, see Order.Meta.ordering
+    ordering = '-date_placed'
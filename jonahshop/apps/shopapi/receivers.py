@@ -0,0 +1,258 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from oscar.core.loading import get_model
+
+from apps.core.signals import thumbnails_generated
+from apps.shopapi import search
+from apps.shopapi import facets
+from apps.shopapi.baskets import record_basket_change
+from apps.shopapi.categories import categories_changed
+from apps.shopapi.stock import release_reservations
+from apps.shopapi.tasks import index_products, refresh_product_listings
+from apps.shopapi.cache import (
+    OFFERS_VERSION_KEY,
+    bump_version,
+    invalidate_catalogue,
+    order_version_key
+)
+
+
+Product = get_model('catalogue', 'Product')
+ProductImage = get_model('catalogue', 'ProductImage')
+Category = get_model('catalogue', 'Category')
+ProductCategory = get_model('catalogue', 'ProductCategory')
+ProductAttributeValue = get_model('catalogue', 'ProductAttributeValue')
+StockRecord = get_model('partner', 'StockRecord')
+Basket = get_model('basket', 'Basket')
+BasketLine = get_model('basket', 'Line')
+Order = get_model('order', 'Order')
+OrderLine = get_model('order', 'Line')
+ConditionalOffer = get_model('offer', 'ConditionalOffer')
+Benefit = get_model('offer', 'Benefit')
+Condition = get_model('offer', 'Condition')
+Range = get_model('offer', 'Range')
+RangeProduct = get_model('offer', 'RangeProduct')
+Voucher = get_model('voucher', 'Voucher')
+
+
+def _product_ids(instance):
+    # the price and availability of a parent product are derived from its
+    # children. Looked up once for (all the receivers of) a change of instance
+    product_id = instance.product_id
+    ids = getattr(instance, '_changed_product_ids', None)
+    if ids is None or ids[0] != product_id:
+        parent_id = Product.objects.filter(pk=product_id).values_list('parent_id', flat=True).first()
+        ids = instance._changed_product_ids = (product_id, parent_id)
+    return ids
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    ids = (instance.pk, instance.parent_id)
+    transaction.on_commit(lambda: invalidate_catalogue(*ids))
+
+
+@receiver(post_save, sender=StockRecord)
+@receiver(post_delete, sender=StockRecord)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(thumbnails_generated, sender=ProductImage)
+@receiver(post_save, sender=ProductAttributeValue)
+@receiver(post_delete, sender=ProductAttributeValue)
+def product_relation_changed(sender, instance, **kwargs):
+    ids = _product_ids(instance)
+    transaction.on_commit(lambda: invalidate_catalogue(*ids))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def category_changed(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_catalogue)
+
+
+@receiver(post_save, sender=Basket)
+@receiver(post_delete, sender=Basket)
+def basket_changed(sender, instance, **kwargs):
+    basket_id = instance.pk
+    transaction.on_commit(lambda: record_basket_change(basket_id))
+
+
+@receiver(m2m_changed, sender=Basket.vouchers.through)
+def basket_vouchers_changed(sender, instance, **kwargs):
+    if isinstance(instance, Basket):
+        basket_id = instance.pk
+        transaction.on_commit(lambda: record_basket_change(basket_id))
+
+
+@receiver(post_save, sender=BasketLine)
+def basket_line_changed(sender, instance, **kwargs):
+    basket_id, line_id = instance.basket_id, instance.pk
+    transaction.on_commit(lambda: record_basket_change(basket_id, changed=[line_id]))
+
+
+@receiver(post_delete, sender=BasketLine)
+def basket_line_deleted(sender, instance, **kwargs):
+    # (the pk of a deleted instance is cleared afterwards)
+    basket_id, line_id = instance.basket_id, instance.pk
+    transaction.on_commit(lambda: record_basket_change(basket_id, removed=[line_id]))
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_changed(sender, instance, **kwargs):
+    key = order_version_key(instance.pk)
+    transaction.on_commit(lambda: bump_version(key))
+
+
+@receiver(post_save, sender=OrderLine)
+@receiver(post_delete, sender=OrderLine)
+def order_line_changed(sender, instance, **kwargs):
+    key = order_version_key(instance.order_id)
+    transaction.on_commit(lambda: bump_version(key))
+
+
+@receiver(post_save, sender=ConditionalOffer)
+@receiver(post_delete, sender=ConditionalOffer)
+@receiver(post_save, sender=Benefit)
+@receiver(post_delete, sender=Benefit)
+@receiver(post_save, sender=Condition)
+@receiver(post_delete, sender=Condition)
+@receiver(post_save, sender=Range)
+@receiver(post_delete, sender=Range)
+@receiver(post_save, sender=RangeProduct)
+@receiver(post_delete, sender=RangeProduct)
+@receiver(post_save, sender=Voucher)
+@receiver(post_delete, sender=Voucher)
+def offers_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_version(OFFERS_VERSION_KEY))
+
+
+# Search index #######################
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if raw: # loading fixtures, rebuild the index afterwards
+        return
+    transaction.on_commit(lambda: search.product_index.update(instance))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: search.product_index.remove(pk))
+
+
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def index_product_categories(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    product_id = instance.product_id
+
+    def update():
+        product = Product.objects.filter(pk=product_id).first()
+        if product is not None:
+            search.product_index.update(product)
+    transaction.on_commit(update)
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    category_id = instance.pk
+
+    def update():
+        # (a category may hold many products, they are indexed in the background)
+        product_ids = list(Product.objects.filter(categories=category_id).values_list('pk', flat=True))
+        if product_ids:
+            index_products.delay(product_ids)
+    transaction.on_commit(update)
+
+
+# Facet index #######################
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_facets_changed(sender, instance, **kwargs):
+    ids = [pk for pk in (instance.pk, instance.parent_id) if pk is not None]
+    transaction.on_commit(lambda: facets.record_change(ids))
+
+
+@receiver(post_save, sender=StockRecord)
+@receiver(post_delete, sender=StockRecord)
+@receiver(post_save, sender=ProductAttributeValue)
+@receiver(post_delete, sender=ProductAttributeValue)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def product_relation_facets_changed(sender, instance, **kwargs):
+    ids = [pk for pk in _product_ids(instance) if pk is not None]
+    transaction.on_commit(lambda: facets.record_change(ids))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_facets_changed(sender, instance, **kwargs):
+    # the category tree changed, rebuild the whole index
+    transaction.on_commit(facets.record_change)
+
+
+# Listing read model #######################
+
+def _refresh_listings(product_ids):
+    ids = [pk for pk in product_ids if pk is not None]
+    transaction.on_commit(lambda: refresh_product_listings.delay(ids))
+
+
+@receiver(post_save, sender=Product)
+def product_listing_changed(sender, instance, **kwargs):
+    # (the listing of a deleted product is deleted with it)
+    _refresh_listings([instance.pk, instance.parent_id])
+
+
+@receiver(post_delete, sender=Product)
+def child_listing_changed(sender, instance, **kwargs):
+    # the price and availability of the parent changed
+    if instance.parent_id is not None:
+        _refresh_listings([instance.parent_id])
+
+
+@receiver(post_save, sender=StockRecord)
+@receiver(post_delete, sender=StockRecord)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(thumbnails_generated, sender=ProductImage)
+def product_relation_listing_changed(sender, instance, **kwargs):
+    _refresh_listings(_product_ids(instance))
+
+
+# Category tree #######################
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def category_tree_changed(sender, instance, **kwargs):
+    # (product counts depend on which products are browsable)
+    transaction.on_commit(categories_changed)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def category_links_changed(sender, action, **kwargs):
+    # product.categories.add() bulk creates the links, without post_save signals
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(categories_changed)
+
+
+# Stock reservations #######################
+
+@receiver(pre_delete, sender=Basket)
+def release_basket_stock(sender, instance, **kwargs):
+    # reservations are deleted with the basket, the stock they hold must be released
+    release_reservations(instance.stock_reservations.all())
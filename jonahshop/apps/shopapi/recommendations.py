@@ -0,0 +1,95 @@
+import heapq
+from collections import Counter, defaultdict
+from itertools import combinations, groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from oscar.core.loading import get_model
+
+from apps.shopapi.cache import bump_version
+from apps.shopapi.models import CoPurchase, ProductListing
+
+
+OrderLine = get_model('order', 'Line')
+
+RECOMMENDATIONS_VERSION_KEY = 'recommendations:version'
+# Number of recommendations kept for each product
+RECOMMENDATIONS_TOP_K = getattr(settings, 'PRODUCT_RECOMMENDATIONS_TOP_K', 10)
+RECOMMENDATIONS_CHUNK_SIZE = getattr(settings, 'PRODUCT_RECOMMENDATIONS_CHUNK_SIZE', 2000)
+
+
+def order_baskets(chunk_size=RECOMMENDATIONS_CHUNK_SIZE):
+    """
+    Yield the set of (parent) product ids of each order. Order lines are
+    read from a server side cursor, ``chunk_size`` at a time, so the
+    orders are never all held in memory
+    """
+    # variants are counted as their parent, the product that is browsed
+    lines = OrderLine.objects \
+        .filter(product__isnull=False) \
+        .annotate(item_id=Coalesce('product__parent_id', 'product_id')) \
+        .order_by('order_id') \
+        .values_list('order_id', 'item_id') \
+        .iterator(chunk_size=chunk_size)
+    for _, order_lines in groupby(lines, key=lambda line: line[0]):
+        yield {item_id for _, item_id in order_lines}
+
+
+def co_occurrences(baskets) -> dict:
+    """
+    Sparse product x product matrix of the number of baskets each pair of
+    products is in, as {product_id: Counter({product_id: count})}.
+    Only the pairs that occur are stored
+    """
+    matrix = defaultdict(Counter)
+    for basket in baskets:
+        # pairs are counted once, the matrix is symmetric
+        for a, b in combinations(sorted(basket), 2):
+            matrix[a][b] += 1
+            matrix[b][a] += 1
+    return matrix
+
+
+def top_neighbours(matrix: dict, k: int = RECOMMENDATIONS_TOP_K):
+    """
+    Yield (product_id, [(neighbour_id, count), ...]) of the ``k`` most
+    co-purchased neighbours of each product, highest counts first
+    """
+    for product_id, neighbours in matrix.items():
+        # ties go to the lowest id, so rebuilds are stable
+        yield product_id, heapq.nsmallest(
+            k, neighbours.items(), key=lambda item: (-item[1], item[0]))
+
+
+def build_recommendations(k=RECOMMENDATIONS_TOP_K, chunk_size=RECOMMENDATIONS_CHUNK_SIZE) -> int:
+    """
+    Rebuild the recommendations of all products from the order lines.
+    Returns the number of products with recommendations
+    """
+    matrix = co_occurrences(order_baskets(chunk_size))
+    rows = [
+        CoPurchase(product_id=product_id, recommendation_id=neighbour_id, rank=rank, score=score)
+        for product_id, neighbours in top_neighbours(matrix, k)
+        for rank, (neighbour_id, score) in enumerate(neighbours)
+    ]
+    # the table is swapped at once, readers never see it half built
+    with transaction.atomic():
+        CoPurchase.objects.all().delete()
+        CoPurchase.objects.bulk_create(rows, batch_size=chunk_size)
+    transaction.on_commit(lambda: bump_version(RECOMMENDATIONS_VERSION_KEY))
+    return len(matrix)
+
+
+def for_products(product_ids, k=RECOMMENDATIONS_TOP_K):
+    """
+    The listings of the products most often bought together with any of
+    ``product_ids`` (eg. the products of a basket), by their score summed
+    over those products. The products themselves are left out
+    """
+    return ProductListing.objects \
+        .filter(product__co_purchased_with__product_id__in=product_ids) \
+        .exclude(product_id__in=product_ids) \
+        .annotate(co_purchase_score=Sum('product__co_purchased_with__score')) \
+        .order_by('-co_purchase_score', 'product_id')[:k]
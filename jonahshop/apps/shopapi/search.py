@@ -0,0 +1,139 @@
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from oscar.core.loading import get_model
+from oscar.apps.catalogue.abstract_models import AbstractProduct
+
+
+Product = get_model('catalogue', 'Product')
+
+PRODUCT_SEARCH_INDEX_PATH = getattr(
+    settings, 'PRODUCT_SEARCH_INDEX_PATH', settings.BASE_DIR / 'product_index.sqlite3')
+PRODUCT_SEARCH_MAX_RESULTS = getattr(settings, 'PRODUCT_SEARCH_MAX_RESULTS', 1000)
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class ProductSearchIndex:
+    """
+    Full text index of browsable products, in an SQLite FTS5 table.
+
+    The index lives in it's own SQLite file (not the project's database),
+    so it needs no external service. It is kept up to date from product
+    signals (see apps.shopapi.receivers), and can be rebuilt with the
+    ``rebuild_product_index`` management command.
+
+    Results are ranked with bm25, and each search term matches as a
+    prefix (ie. 'hand' matches 'handbag').
+    """
+
+    INSERT_SQL = (
+        'INSERT INTO product (rowid, title, upc, categories, description) '
+        'VALUES (?, ?, ?, ?, ?)'
+    )
+
+    def __init__(self, path):
+        self.path = str(path)
+        # sqlite connections can't be shared between threads
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS product USING fts5("
+                "title, upc, categories, description, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            self._local.connection = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _document(self, product: AbstractProduct):
+        categories = ' '.join(c.name for c in product.categories.all())
+        return (product.pk, product.title or '', product.upc or '', categories, product.description or '')
+
+    def update(self, product: AbstractProduct):
+        """
+        Add or update the entry of a product, or remove it if the
+        product is not browsable (anymore)
+        """
+        with self.transaction() as conn:
+            self._update(conn, product)
+
+    def update_many(self, products, removed_ids=()):
+        """
+        Update the entries of many ``products``, and remove the entries
+        of ``removed_ids``, in a single transaction
+        """
+        with self.transaction() as conn:
+            for product in products:
+                self._update(conn, product)
+            conn.executemany('DELETE FROM product WHERE rowid = ?', [(pk,) for pk in removed_ids])
+
+    def _update(self, conn, product: AbstractProduct):
+        conn.execute('DELETE FROM product WHERE rowid = ?', (product.pk,))
+        if product.is_public and product.parent_id is None:
+            conn.execute(self.INSERT_SQL, self._document(product))
+
+    def remove(self, product_id):
+        self.connection.execute('DELETE FROM product WHERE rowid = ?', (product_id,))
+
+    def rebuild(self, products=None, chunk_size=500) -> int:
+        """
+        Replace the whole index with ``products``, defaults to all browsable products
+        """
+        if products is None:
+            products = Product.objects.browsable()
+        # keyset chunks, as .iterator() doesn't prefetch the categories
+        products = products.prefetch_related('categories').order_by('pk')
+        count = 0
+        last_pk = 0
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM product')
+            while True:
+                chunk = list(products.filter(pk__gt=last_pk)[:chunk_size])
+                if not chunk:
+                    break
+                conn.executemany(self.INSERT_SQL, map(self._document, chunk))
+                count += len(chunk)
+                last_pk = chunk[-1].pk
+        return count
+
+    def match_expression(self, query: str) -> str:
+        # quote the terms, so user input is never parsed as FTS5 syntax
+        return ' '.join(f'"{term}"*' for term in _TERM_RE.findall(query))
+
+    def search(self, query: str, limit: int = PRODUCT_SEARCH_MAX_RESULTS) -> list:
+        """
+        Return ids of the products matching all the terms in ``query``, best match first
+        """
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        # the title is weighted above the other columns
+        rows = self.connection.execute(
+            'SELECT rowid FROM product WHERE product MATCH ? '
+            'ORDER BY bm25(product, 10.0, 5.0, 2.0, 1.0) LIMIT ?',
+            (expression, limit)
+        )
+        return [row[0] for row in rows]
+
+
+product_index = ProductSearchIndex(PRODUCT_SEARCH_INDEX_PATH)
@@ -1,4 +1,4 @@
-from .product import ProductSerializer
-from .basket import BasketSerializer, AddProductSerializer, LineSerializer
+from .product import ProductSerializer, ProductListingSerializer, ProductIdsSerializer
+from .basket import BasketSerializer, AddProductSerializer, BasketOperationsSerializer, LineSerializer
 from .checkout import CheckoutSerializer
 from .order import OrderSerializer
\ No newline at end of file
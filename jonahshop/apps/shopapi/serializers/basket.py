@@ -1,11 +1,20 @@
 from decimal import Decimal
+from django.db import models
 from oscar.core.loading import get_model
 
 from rest_framework import serializers
 
+from apps.core.mixins import SparseFieldsMixin
+
+from apps.shopapi.baskets import ADD, BASKET_OPERATIONS, REMOVE
+
 from .product import ProductSerializer
 
 
+# Max number of operations applied to a basket at once
+MAX_BASKET_OPERATIONS = 100
+
+
 class AddProductSerializer(serializers.Serializer):
     """
     Serializer purposely for validating data sent in from
@@ -15,22 +24,72 @@ class AddProductSerializer(serializers.Serializer):
     quantity = serializers.IntegerField(min_value=1)
 
 
+class BasketOperationSerializer(serializers.Serializer):
+    """
+    An operation on the line of a product: add a quantity, set the
+    quantity, or remove the line
+    """
+    op = serializers.ChoiceField(choices=BASKET_OPERATIONS)
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, attrs):
+        if attrs['op'] != REMOVE and 'quantity' not in attrs:
+            raise serializers.ValidationError({'quantity': ['This field is required.']})
+        if attrs['op'] == ADD and attrs['quantity'] < 1:
+            raise serializers.ValidationError({'quantity': ['Ensure this value is greater than or equal to 1.']})
+        return attrs
+
+
+class BasketOperationsSerializer(serializers.Serializer):
+    """
+    Serializer purposely for validating a list of operations
+    sent in from the client side to apply to the basket at once
+    """
+    operations = serializers.ListField(
+        child=BasketOperationSerializer(),
+        allow_empty=False,
+        max_length=MAX_BASKET_OPERATIONS
+    )
+
+
 class BasketProductSerializer(ProductSerializer):
     """
     We are overiding 'ProductSerializer' to remove some fields
     """
+    image_preset = 'basket'
+
     class Meta:
         model = get_model('catalogue', 'Product')
         fields= [
-            'url', 'id', 'title', 'price', 'image',
+            'url', 'id', 'title', 'price', 'image', 'srcset',
         ]
 
 
-class LineSerializer(serializers.ModelSerializer):
+class LineListSerializer(serializers.ListSerializer):
+    """
+    Prime the product serializer of the child serializer with the purchase
+    info (see PurchaseInfoResolver.prime_lines) and the thumbnail urls of
+    all the lines, before serializing them one by one
+    """
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        lines = list(iterable)
+        product_ser = self.child.fields.get('product')
+        if product_ser is not None:
+            if {'price', 'availability'} & set(product_ser.fields):
+                product_ser.purchase_info.prime_lines(lines)
+            if {'image', 'srcset'} & set(product_ser.fields):
+                product_ser.prime_primary_images([line.product for line in lines])
+        return super().to_representation(lines)
+
+
+class LineSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = BasketProductSerializer()
 
     class Meta:
         model = get_model("basket", "Line")
+        list_serializer_class = LineListSerializer
         fields = [
             'id', 'line_reference', 'quantity', 'product'
         ]
@@ -50,4 +109,5 @@ class BasketSerializer(serializers.HyperlinkedModelSerializer):
         return obj.total_excl_tax
 
     def get_total_quantity(self, obj) -> int:
-        return  obj.num_items
\ No newline at end of file
+        # (oscar's num_items queries the lines again)
+        return sum(line.quantity for line in obj.all_lines())
\ No newline at end of file
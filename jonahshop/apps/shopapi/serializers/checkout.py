@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.db import transaction
 from django.utils.translation import gettext as _
 
 from oscar.core.loading import get_model, get_class
@@ -14,6 +15,7 @@ from apps.shipping.methods import NoDeliveryRequired
 from apps.shipping.repository import Repository
 from apps.shipping.serializers.address import ShippingAddressSerializer
 from apps.payapi.paymethods import PaymentMethods
+from apps.shopapi.stock import InsufficientStock, consume_reservations, reserve_basket, stock_changed
 
 
 Order = get_model('order', 'Order')
@@ -23,6 +25,8 @@ BillingAddress = get_model("order", "BillingAddress")
 
 OrderPlacementMixin: OscarOrderPlacementMixin = get_class("checkout.mixins", "OrderPlacementMixin")
 OrderTotalCalculator = get_class("checkout.calculators", "OrderTotalCalculator")
+OrderCreator = get_class("order.utils", "OrderCreator")
+StockRecord = get_model('partner', 'StockRecord')
 
 
 class PriceSerializer(serializers.Serializer):
@@ -40,6 +44,17 @@ class BillingAddressSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class ReservedStockOrderCreator(OrderCreator):
+    """
+    Places orders of baskets whose stock is reserved: the stock of the
+    lines is already allocated, by the reservations (see
+    apps.shopapi.stock.consume_reservations)
+    """
+
+    def update_stock_records(self, line):
+        pass
+
+
 class CheckoutSerializer(serializers.Serializer, OrderPlacementMixin):
 
     shipping_address = ShippingAddressSerializer(many=False, required=True)
@@ -89,7 +104,56 @@ class CheckoutSerializer(serializers.Serializer, OrderPlacementMixin):
         source = Source(source_type=source_type, amount_allocated=total.incl_tax)
         self.add_payment_source(source)
 
+    def reserve_stock(self):
+        # the stock is reserved before the order is placed, so concurrent
+        # checkouts of the last items can't both succeed. (In its own short
+        # transaction, as BasketViewSet.reserve, renewing a reservation the
+        # client made before)
+        try:
+            changed = reserve_basket(self.basket)
+        except InsufficientStock as e:
+            raise serializers.ValidationError({'basket': [str(e)]})
+        stock_changed(StockRecord.objects.filter(pk__in=changed))
+
+    def place_order(self, order_number, user, basket, shipping_address,
+                    shipping_method, shipping_charge, order_total,
+                    billing_address=None, surcharges=None, **kwargs):
+        # Overriden method of OrderPlacementMixin, which places the order
+        # with ReservedStockOrderCreator
+        shipping_address = self.create_shipping_address(user, shipping_address)
+        billing_address = self.create_billing_address(
+            user, billing_address, shipping_address, **kwargs)
+        order = ReservedStockOrderCreator().place_order(
+            user=user,
+            order_number=order_number,
+            basket=basket,
+            shipping_address=shipping_address,
+            shipping_method=shipping_method,
+            shipping_charge=shipping_charge,
+            total=order_total,
+            billing_address=billing_address,
+            status=self.get_initial_order_status(basket),
+            request=self.request,
+            surcharges=surcharges,
+            **kwargs)
+        self.save_payment_details(order)
+        return order
+
     def create(self, validated_data):
+        self.reserve_stock()
+        # the order is placed in a transaction which only consumes the
+        # reservations, and doesn't lock the stockrecords
+        with transaction.atomic():
+            try:
+                changed = consume_reservations(self.basket)
+            except InsufficientStock as e:
+                raise serializers.ValidationError({'basket': [str(e)]})
+            order = self.place_basket_order(validated_data)
+            self.basket.submit()
+        stock_changed(StockRecord.objects.filter(pk__in=changed))
+        return order
+
+    def place_basket_order(self, validated_data):
         order_number = self.generate_order_number(self.basket)
         shipping_charge = self._shipping_method.calculate(self.basket) if self._shipping_method else None
         total: prices.Price = OrderTotalCalculator().calculate(self.basket, shipping_charge)
@@ -102,7 +166,7 @@ class CheckoutSerializer(serializers.Serializer, OrderPlacementMixin):
         self.handle_payment(order_number, total)
 
         # TODO add initial order status
-        order = self.place_order(
+        return self.place_order(
             order_number=order_number,
             user=self.request.user,
             basket=self.basket,
@@ -112,5 +176,3 @@ class CheckoutSerializer(serializers.Serializer, OrderPlacementMixin):
             order_total=total,
             guest_email=vd.get("guest_email", ""),
         )
-        self.basket.submit()
-        return order
\ No newline at end of file
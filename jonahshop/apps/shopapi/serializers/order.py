@@ -2,7 +2,7 @@ from oscar.core.loading import get_model
 from oscar.apps.order.abstract_models import AbstractLine
 from rest_framework import serializers
 
-from apps.core.mixins import ProductImageMixin
+from apps.core.mixins import ProductImageMixin, SparseFieldsMixin
 from apps.shipping.serializers.address import ShippingAddressSerializer
 
 
@@ -12,8 +12,10 @@ ShippingAddress = get_model("order", "ShippingAddress")
 BillingAddress = get_model("order", "BillingAddress")
 
 
-class OrderLineSerializer(serializers.ModelSerializer, ProductImageMixin):
+class OrderLineSerializer(SparseFieldsMixin, serializers.ModelSerializer, ProductImageMixin):
     image = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    image_preset = 'order'
 
     class Meta:
         model = OrderLine
@@ -31,6 +33,7 @@ class OrderLineSerializer(serializers.ModelSerializer, ProductImageMixin):
             'line_price_before_discounts_incl_tax',
             'line_price_before_discounts_excl_tax',
             'image',
+            'srcset',
         ]
 
     @property
@@ -45,6 +48,9 @@ class OrderLineSerializer(serializers.ModelSerializer, ProductImageMixin):
         # assumptions was not followed by the caller
         return self.get_primary_image(order_line.product)
 
+    def get_srcset(self, order_line: AbstractLine) -> dict:
+        return self.get_primary_image_srcset(order_line.product)
+
 
 class OrderSerializer(serializers.ModelSerializer):
 
@@ -1,39 +1,67 @@
+from django.db import models
+from django.utils.functional import cached_property
 from oscar.core.loading import get_model, get_class
 from rest_framework import serializers
 
 from drf_spectacular.utils import extend_schema_field
 from drf_spectacular.types import OpenApiTypes
 
-from apps.core.mixins import ProductImageMixin
+from apps.core.mixins import ProductImageMixin, SparseFieldsMixin
+from apps.core.strategy import PurchaseInfoResolver
+from apps.core.thumbnails import format_srcset
+from apps.shopapi.models import ProductListing
 
 
 Selector = get_class('partner.strategy', 'Selector')
 Product = get_model('catalogue', 'Product')
 
+# Max number of products that can be looked up at once
+MAX_BULK_PRODUCT_IDS = 250
 
-class ProductSerializer(serializers.HyperlinkedModelSerializer, ProductImageMixin):
+
+class ProductListSerializer(serializers.ListSerializer):
+    """
+    Prime the purchase info resolver and the thumbnail urls of the child
+    serializer with the whole list (page) of products before serializing
+    them one by one
+    """
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        products = list(iterable)
+        if {'price', 'availability'} & set(self.child.fields):
+            self.child.purchase_info.prime(products)
+        if {'image', 'srcset'} & set(self.child.fields):
+            self.child.prime_primary_images(products)
+        return super().to_representation(products)
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer, ProductImageMixin):
     price = serializers.SerializerMethodField()
     availability = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
-
-    def __init__(self, *args,  **kwargs):
-        super().__init__(*args, **kwargs)
-        self.strategy = Selector().strategy()
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
+        list_serializer_class = ProductListSerializer
         fields= [
-            'url', 'id', 'title', 'rating', 'price', 'availability', 'is_parent', 'image',
+            'url', 'id', 'title', 'rating', 'price', 'availability', 'is_parent', 'image', 'srcset',
         ]
 
     @property
     def request(self):
         return self.context.get('request')
 
+    @cached_property
+    def purchase_info(self):
+        # a single strategy for the request, the one (oscar's) basket
+        # middleware selected for it, if any
+        strategy = getattr(self.request, 'strategy', None) or Selector().strategy()
+        return PurchaseInfoResolver(strategy)
+
     def get_purchase_info(self, obj):
-        if obj.is_parent:
-            return self.strategy.fetch_for_parent(product=obj)
-        return self.strategy.fetch_for_product(product=obj)
+        # memoized, so price and availability share a single strategy lookup
+        return self.purchase_info.fetch(obj)
 
     def get_price(self, obj) -> float:
         return self.get_purchase_info(obj).price.excl_tax
@@ -44,3 +72,41 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer, ProductImageMixi
     @extend_schema_field(OpenApiTypes.URI)
     def get_image(self, obj: Product):
         return self.get_primary_image(obj)
+
+    def get_srcset(self, obj: Product) -> dict:
+        return self.get_primary_image_srcset(obj)
+
+
+class ProductListingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Serializes the listing read model of a product, to the same
+    representation as ProductSerializer
+    """
+    url = serializers.HyperlinkedIdentityField(view_name='product-detail')
+    id = serializers.ReadOnlyField(source='pk')
+    price = serializers.ReadOnlyField(source='price_excl_tax')
+    image = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProductListing
+        fields = ProductSerializer.Meta.fields
+
+    @extend_schema_field(OpenApiTypes.URI)
+    def get_image(self, obj: ProductListing):
+        return self.context['request'].build_absolute_uri(obj.image)
+
+    def get_srcset(self, obj: ProductListing) -> dict:
+        return format_srcset(obj.srcset, self.context['request'].build_absolute_uri)
+
+
+class ProductIdsSerializer(serializers.Serializer):
+    """
+    Serializer purposely for validating a list of product ids sent in
+    from the client side to lookup products in bulk
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_PRODUCT_IDS
+    )
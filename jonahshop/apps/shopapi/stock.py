@@ -0,0 +1,164 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_save
+from django.utils import timezone
+from oscar.core.loading import get_model
+
+from apps.shopapi.models import StockReservation
+
+
+StockRecord = get_model('partner', 'StockRecord')
+
+# Seconds the stock of a basket is held for, once its checkout starts
+STOCK_RESERVATION_TIMEOUT = getattr(settings, 'STOCK_RESERVATION_TIMEOUT', 60 * 15)
+
+
+class InsufficientStock(Exception):
+
+    def __init__(self, line):
+        self.line = line
+        super().__init__(f'Not enough stock of {line.product} for {line.quantity} items')
+
+
+def allocate_stock(stockrecord_id, quantity) -> bool:
+    """
+    Allocate ``quantity`` items of a stockrecord, if that many are free.
+    A single conditional UPDATE, so concurrent checkouts never oversell.
+    The row stays locked until the enclosing transaction ends, so it should
+    be a short one (see reserve_basket)
+    """
+    allocated = Coalesce(F('num_allocated'), Value(0))
+    return StockRecord.objects \
+        .filter(pk=stockrecord_id, num_in_stock__gte=allocated + quantity) \
+        .update(num_allocated=allocated + quantity) == 1
+
+
+def release_stock(stockrecord_id, quantity):
+    """
+    Release ``quantity`` allocated items of a stockrecord
+    """
+    StockRecord.objects.filter(pk=stockrecord_id).update(
+        num_allocated=Greatest(Coalesce(F('num_allocated'), Value(0)) - quantity, Value(0)))
+
+
+def stock_changed(stockrecords):
+    # the availability of the products changed. As StockRecord.allocate(),
+    # send post_save so cached listings are invalidated (see apps.shopapi.receivers)
+    for stockrecord in stockrecords:
+        post_save.send(
+            sender=StockRecord, instance=stockrecord, created=False, raw=False,
+            using=router.db_for_write(StockRecord, instance=stockrecord))
+
+
+def _tracked_quantities(basket):
+    # the quantity of each stockrecord the lines of the basket need,
+    # as allocated by oscar's OrderCreator.update_stock_records
+    quantities = Counter()
+    lines = {}
+    for line in basket.all_lines():
+        if line.stockrecord_id and line.product.get_product_class().track_stock:
+            quantities[line.stockrecord_id] += line.quantity
+            lines[line.stockrecord_id] = line
+    return quantities, lines
+
+
+@transaction.atomic
+def reserve_basket(basket, timeout=STOCK_RESERVATION_TIMEOUT):
+    """
+    Reserve the stock of the lines of ``basket`` for ``timeout`` seconds,
+    topping up (or releasing) what is already reserved for it. Raises
+    InsufficientStock (and reserves nothing) if a line can't be reserved.
+
+    Returns the stockrecord ids whose allocation changed
+    """
+    quantities, lines = _tracked_quantities(basket)
+    reservations = {
+        r.stockrecord_id: r
+        for r in StockReservation.objects.select_for_update().filter(basket=basket)
+    }
+    expires_at = timezone.now() + timedelta(seconds=timeout)
+    changed = []
+    # in a fixed order, so concurrent checkouts lock rows in the same order
+    for stockrecord_id in sorted(quantities.keys() | reservations.keys()):
+        quantity = quantities.get(stockrecord_id, 0)
+        reservation = reservations.get(stockrecord_id)
+        delta = quantity - (reservation.quantity if reservation else 0)
+        if delta > 0 and not allocate_stock(stockrecord_id, delta):
+            raise InsufficientStock(lines[stockrecord_id])
+        if delta < 0:
+            release_stock(stockrecord_id, -delta)
+        if delta:
+            changed.append(stockrecord_id)
+
+        if reservation is None:
+            StockReservation.objects.create(
+                basket=basket, stockrecord_id=stockrecord_id, quantity=quantity, expires_at=expires_at)
+        elif quantity:
+            reservation.quantity = quantity
+            reservation.expires_at = expires_at
+            reservation.save(update_fields=['quantity', 'expires_at'])
+        else:
+            reservation.delete()
+    return changed
+
+
+@transaction.atomic
+def consume_reservations(basket):
+    """
+    Hand the reserved stock of ``basket`` over to it's order: the stock of
+    the order's lines stays allocated, and oscar doesn't allocate it again
+    (see apps.shopapi.serializers.checkout.ReservedStockOrderCreator). Only
+    the reservations are locked, not the stockrecords, so checkouts of the
+    same stock don't wait for each other while their orders are placed.
+    Raises InsufficientStock if the stock of a line isn't reserved (eg. the
+    reservation expired, and was released).
+
+    Returns the stockrecord ids whose allocation changed
+    """
+    quantities, lines = _tracked_quantities(basket)
+    reservations = StockReservation.objects.select_for_update().filter(basket=basket)
+    reserved = {r.stockrecord_id: r.quantity for r in reservations}
+    for stockrecord_id, quantity in quantities.items():
+        if reserved.get(stockrecord_id, 0) < quantity:
+            raise InsufficientStock(lines[stockrecord_id])
+    # (stock reserved for lines removed since is released)
+    changed = []
+    for stockrecord_id in sorted(reserved):
+        excess = reserved[stockrecord_id] - quantities.get(stockrecord_id, 0)
+        if excess:
+            release_stock(stockrecord_id, excess)
+            changed.append(stockrecord_id)
+    reservations.delete()
+    return changed
+
+
+@transaction.atomic
+def release_reservations(reservations) -> int:
+    """
+    Release the stock held by ``reservations`` (a queryset), and delete them.
+    Returns the number of items released
+    """
+    # reservations being consumed (by a checkout) are skipped
+    reservations = list(reservations.select_for_update(skip_locked=True))
+    quantities = Counter()
+    for reservation in reservations:
+        quantities[reservation.stockrecord_id] += reservation.quantity
+    for stockrecord_id, quantity in sorted(quantities.items()):
+        release_stock(stockrecord_id, quantity)
+    StockReservation.objects.filter(pk__in=[r.pk for r in reservations]).delete()
+
+    stock_changed(StockRecord.objects.filter(pk__in=list(quantities)))
+    return sum(quantities.values())
+
+
+def release_expired_reservations(now=None) -> int:
+    """
+    Release the stock of abandoned checkouts, ie. of expired reservations
+    """
+    expired = StockReservation.objects.filter(expires_at__lte=now or timezone.now())
+    return release_reservations(expired)
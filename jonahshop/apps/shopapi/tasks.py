@@ -1,7 +1,16 @@
 from celery import shared_task
 from django.template.loader import render_to_string
+from oscar.core.loading import get_model
 
 from apps.core.email import send_mail
+from apps.shopapi.cache import invalidate_catalogue
+from apps.shopapi.models import ProductListing
+from apps.shopapi import search
+from apps.shopapi.recommendations import build_recommendations
+from apps.shopapi.stock import release_expired_reservations
+
+
+Product = get_model('catalogue', 'Product')
 
 
 @shared_task(name='shopapi.send_order_details')
@@ -20,4 +29,30 @@ def send_order_details(email_address, uuid64, token, base_url):
         subject='Order #{InsertOrderNumber}',
         body_text=email_text,
         body_html=email_html
-    )
\ No newline at end of file
+    )
+
+
+@shared_task(name='shopapi.refresh_product_listings')
+def refresh_product_listings(product_ids=None):
+    ProductListing.objects.refresh(product_ids)
+    # listings cached (for anonymous users) while the refresh was pending are stale
+    invalidate_catalogue()
+
+
+@shared_task(name='shopapi.index_products')
+def index_products(product_ids):
+    products = Product.objects.prefetch_related('categories').in_bulk(product_ids)
+    search.product_index.update_many(
+        products.values(), [pk for pk in product_ids if pk not in products])
+
+
+@shared_task(name='shopapi.build_product_recommendations')
+def build_product_recommendations():
+    # periodic, see CELERY_BEAT_SCHEDULE
+    build_recommendations()
+
+
+@shared_task(name='shopapi.release_expired_stock_reservations')
+def release_expired_stock_reservations():
+    # periodic, see CELERY_BEAT_SCHEDULE
+    release_expired_reservations()
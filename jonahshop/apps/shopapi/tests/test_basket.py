@@ -1,17 +1,37 @@
 from unittest.mock import ANY, patch, MagicMock
+from django.contrib.auth import get_user_model
+from django.core.signing import Signer
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 
-from oscar.core.loading import get_model
+from oscar.core.loading import get_model, get_class
 from oscar.apps.basket.models import Basket as OscarBasket, Line as OscarLine
 from oscar.apps.catalogue.models import Product as OscarProduct
 from oscar.apps.order.utils import OrderNumberGenerator
 from oscar.apps.order.models import Order
+from oscar.test.factories import create_offer
 
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 from rest_framework import status
 
+from apps.shopapi.baskets import (
+    BasketConflict,
+    StaleBasket,
+    basket_version,
+    merge_baskets,
+    mutate_basket,
+    record_basket_change
+)
+from apps.shopapi.cache import invalidate_catalogue
+from apps.shopapi.middleware import basket_loads, cached_basket_cookie
+from apps.shopapi.models import CachedBasket, StockReservation
+from apps.shopapi.offers import offer_results
 from apps.shopapi.views import BasketViewSet
+from apps.shopapi.serializers.basket import BasketProductSerializer
 from apps.shipping.methods import NoDeliveryRequired
 from apps.payapi.paymethods import PaymentMethods
 from apps.core.token import simple_token
@@ -19,10 +39,35 @@ from apps.core.token import simple_token
 Basket: OscarBasket = get_model('basket', 'Basket')
 Line: OscarLine = get_model('basket', 'Line')
 Product: OscarProduct = get_model('catalogue', 'Product')
+Selector = get_class('partner.strategy', 'Selector')
+Applicator = get_class('offer.applicator', 'Applicator')
+
+
+class CommittingClient(APIClient):
+    """
+    Runs the on_commit callbacks of each request (eg. bumping basket
+    versions), which are otherwise dropped by TestCase
+    """
+
+    def request(self, **kwargs):
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            return super().request(**kwargs)
 
 
 class BasketTestMixin:
     fixtures = ['fixture_all.json' ]
+    client_class = CommittingClient
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # (missing thumbnails, and the refresh of listings after stock
+        # changes, are queued to background tasks)
+        for target in ('apps.core.receivers.generate_product_thumbnails',
+                       'apps.shopapi.receivers.refresh_product_listings'):
+            p = patch(target)
+            p.start()
+            cls.addClassCleanup(p.stop)
 
     @property
     def basket_viewset(self):
@@ -205,6 +250,56 @@ class GetBasketTestCase(BasketTestMixin, APITestCase):
             tuple(map(type, data.values()))
         )
 
+    def test_get_basket_query_count_independent_of_lines(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(self.get_basket_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(ctx.captured_queries)
+
+        products = list(Product.objects.all())
+        self.client.post(self.add_product_url, self.get_add_product_data(products[0]))
+        one_line = count_queries()
+        for product in products[1:]:
+            self.client.post(self.add_product_url, self.get_add_product_data(product))
+
+        self.assertGreater(len(products), 2)
+        self.assertEqual(count_queries(), one_line)
+
+    def test_get_basket_sparse_line_fields(self):
+        self.client.post(self.add_product_url, self.get_add_product_data())
+
+        with patch.object(BasketProductSerializer, 'get_image') as image_mock:
+            response = self.client.get(
+                self.get_basket_url, {'fields': 'id,quantity,product.id,product.title'})
+
+        image_mock.assert_not_called()
+        line = response.json()['lines'][0]
+        self.assertTupleEqual(('id', 'quantity', 'product'), tuple(line.keys()))
+        self.assertTupleEqual(('id', 'title'), tuple(line['product'].keys()))
+
+    def test_basket_not_modified(self):
+        self.client.post(self.add_product_url, self.get_add_product_data())
+        response = self.client.get(self.get_basket_url)
+        etag = response['ETag']
+
+        with patch('apps.shopapi.views.LineSerializer') as ser_mock:
+            response = self.client.get(self.get_basket_url, HTTP_IF_NONE_MATCH=etag)
+
+        ser_mock.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_basket_modified_after_adding_product(self):
+        self.client.post(self.add_product_url, self.get_add_product_data())
+        etag = self.client.get(self.get_basket_url)['ETag']
+
+        self.client.post(self.add_product_url, self.get_add_product_data())
+        response = self.client.get(self.get_basket_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['lines'][0]['quantity'], 2)
+
     def test_basket_not_yet_created(self):
         """
         Test a request for (session) basket if none has been
@@ -231,6 +326,143 @@ class GetBasketTestCase(BasketTestMixin, APITestCase):
         )
 
 
+class BatchBasketTestCase(BasketTestMixin, APITestCase):
+
+    @property
+    def batch_url(self):
+        view = self.basket_viewset
+        return view.reverse_action(view.batch.url_name)
+
+    def batch(self, *operations):
+        return self.client.post(self.batch_url, {'operations': operations}, format='json')
+
+    def test_applies_operations_in_order(self):
+        self.client.post(self.add_product_url, {'product_id': 5, 'quantity': 1})
+
+        response = self.batch(
+            {'op': 'add', 'product_id': 1, 'quantity': 2},
+            {'op': 'add', 'product_id': 3, 'quantity': 1},
+            {'op': 'set', 'product_id': 1, 'quantity': 4},
+            {'op': 'remove', 'product_id': 5},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        quantities = {line['product']['id']: line['quantity'] for line in response.data['lines']}
+        self.assertDictEqual(quantities, {1: 4, 3: 1})
+        self.assertEqual(response.data['total_quantity'], 5)
+
+    def test_creates_anonymous_basket(self):
+        response = self.batch({'op': 'add', 'product_id': 1, 'quantity': 1})
+        self.assertEqual(len(response.data['lines']), 1)
+        # the basket of the session
+        self.assertEqual(self.client.get(self.get_basket_url).data['id'], response.data['id'])
+
+    def test_all_or_nothing(self):
+        response = self.batch(
+            {'op': 'add', 'product_id': 1, 'quantity': 1},
+            {'op': 'add', 'product_id': 999, 'quantity': 1},
+            # 3 in stock
+            {'op': 'set', 'product_id': 4, 'quantity': 5},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertListEqual(sorted(response.data['operations']), [1, 2])
+        self.assertFalse(Line.objects.filter(basket__owner=None, product_id=1).exists())
+
+    def test_invalid_operations(self):
+        response = self.batch({'op': 'add', 'product_id': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.batch_url, {'operations': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_count_independent_of_operations(self):
+        def count_queries(*operations):
+            # (offers applied without the memo, whose hits depend on
+            # when the previous requests' changes were logged)
+            with CaptureQueriesContext(connection) as ctx, \
+                    patch.object(offer_results, 'apply', Applicator().apply):
+                self.batch(*operations)
+            return len(ctx.captured_queries)
+
+        def add(*product_ids):
+            return [{'op': 'add', 'product_id': pk, 'quantity': 1} for pk in product_ids]
+
+        self.batch(*add(5))
+        # new lines
+        one = count_queries(*add(1))
+        self.assertEqual(count_queries(*add(3, 4)), one)
+        # updated lines
+        one = count_queries(*add(1))
+        many = count_queries(*add(1, 3, 5))
+        self.assertEqual(many, one)
+
+
+class BasketDeltaTestCase(BasketTestMixin, APITransactionTestCase):
+    # versions are bumped once changes are committed, before
+    # the (non atomic) add_product and batch views respond
+
+    def batch_url(self, since):
+        view = self.basket_viewset
+        return view.reverse_action(view.batch.url_name) + f'?since={since}'
+
+    def add_product(self, product_id, since=None):
+        url = self.add_product_url + (f'?since={since}' if since else '')
+        return self.client.post(url, {'product_id': product_id, 'quantity': 1})
+
+    def test_delta_of_added_line(self):
+        self.add_product(1)
+        response = self.add_product(3)
+        version = response['X-Basket-Version']
+
+        response = self.add_product(5, since=version)
+        self.assertTrue(response.data['delta'])
+        self.assertListEqual([line['product']['id'] for line in response.data['lines']], [5])
+        self.assertListEqual(response.data['removed_lines'], [])
+        self.assertEqual(response.data['total_quantity'], 3)
+        self.assertEqual(response.data['version'], response['X-Basket-Version'])
+
+    def test_delta_of_removed_and_changed_lines(self):
+        self.add_product(1)
+        self.add_product(3)
+        response = self.client.get(self.get_basket_url)
+        version = response['X-Basket-Version']
+        removed = next(line['id'] for line in response.data['lines'] if line['product']['id'] == 3)
+
+        response = self.client.post(self.batch_url(version), {'operations': [
+            {'op': 'remove', 'product_id': 3},
+            {'op': 'add', 'product_id': 1, 'quantity': 1},
+        ]}, format='json')
+        self.assertTrue(response.data['delta'])
+        self.assertListEqual(response.data['removed_lines'], [removed])
+        self.assertListEqual([line['quantity'] for line in response.data['lines']], [2])
+
+        # nothing changed since
+        response = self.client.get(self.get_basket_url, {'since': response.data['version']})
+        self.assertTrue(response.data['delta'])
+        self.assertListEqual(response.data['lines'], [])
+
+    def test_changes_logged_once_committed(self):
+        master = Basket.objects.get(pk=self.add_product(1).data['id'])
+        slave = Basket.objects.create()
+        slave.strategy = Selector().strategy()
+        slave.add(Product.objects.get(pk=3))
+        version = basket_version(master)
+
+        with transaction.atomic():
+            merge_baskets(master, slave)
+            self.assertEqual(basket_version(master), version)
+        self.assertNotEqual(basket_version(master), version)
+
+    def test_unknown_version_gets_all_lines(self):
+        self.add_product(1)
+        version = self.add_product(3)['X-Basket-Version']
+        # prices may have changed
+        invalidate_catalogue()
+
+        for since in ('garbage', version):
+            response = self.client.get(self.get_basket_url, {'since': since})
+            self.assertFalse(response.data['delta'])
+            self.assertEqual(len(response.data['lines']), 2)
+
+
 class CheckoutTestCase(BasketTestMixin, APITestCase):
 
     def setUp(self) -> None:
@@ -321,6 +553,312 @@ class CheckoutTestCase(BasketTestMixin, APITestCase):
         })
 
 
+    def test_checkout_consumes_reservation(self):
+        product = Product.objects.get(pk=1)
+        stockrecord = product.stockrecords.first()
+        allocated = stockrecord.num_allocated or 0
+        self.client.post(self.add_product_url, data={'product_id': product.id, 'quantity': 2})
+        response = self.client.post(self.basket_viewset.reverse_action('reserve'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stockrecord.refresh_from_db()
+        self.assertEqual(stockrecord.num_allocated, allocated + 2)
+
+        response = self.client.post(self.checkout_url, data=self.get_checkout_data(), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # allocated once, by the reservation
+        stockrecord.refresh_from_db()
+        self.assertEqual(stockrecord.num_allocated, allocated + 2)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class BasketRevisionTestCase(BasketTestMixin, APITestCase):
+
+    def add_product(self, if_match=None, quantity=1):
+        headers = {'HTTP_IF_MATCH': if_match} if if_match else {}
+        return self.client.post(
+            self.add_product_url, {'product_id': 1, 'quantity': quantity}, **headers)
+
+    def quantity(self):
+        return Line.objects.get(basket__owner=None, product_id=1).quantity
+
+    def test_revision_incremented_by_changes(self):
+        self.assertEqual(self.add_product()['X-Basket-Revision'], '1')
+        self.assertEqual(self.add_product()['X-Basket-Revision'], '2')
+        self.assertEqual(self.client.get(self.get_basket_url)['X-Basket-Revision'], '2')
+
+    def test_if_match(self):
+        self.add_product()
+        response = self.add_product(if_match='"1"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # the client has an old revision
+        response = self.add_product(if_match='"1"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(response.data['revision'], 2)
+        self.assertEqual(self.quantity(), 2)
+
+    @patch('apps.shopapi.baskets.time.sleep')
+    def test_retries_on_conflict(self, sleep):
+        self.add_product()
+        # another request changes the basket, while the first attempt is made
+        with patch('apps.shopapi.baskets._claim_revision', side_effect=[False, True]) as conflict:
+            response = self.add_product(quantity=2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(conflict.call_count, 2)
+        self.assertEqual(sleep.call_count, 1)
+        # (the failed attempt was rolled back)
+        self.assertEqual(self.quantity(), 3)
+
+        with patch('apps.shopapi.baskets._claim_revision', return_value=False):
+            response = self.add_product()
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.quantity(), 3)
+
+    def test_changes_not_in_request_transaction(self):
+        view = BasketViewSet.as_view({'post': 'add_product'})
+        self.assertTrue(getattr(view, '_non_atomic_requests', None))
+        # stock is reserved in transactions of their own
+        for action in ('reserve', 'checkout'):
+            view = BasketViewSet.as_view({'post': action})
+            self.assertTrue(getattr(view, '_non_atomic_requests', None))
+        view = BasketViewSet.as_view({'get': 'list'})
+        self.assertFalse(getattr(view, '_non_atomic_requests', None))
+
+
+class MergeBasketsTestCase(BasketTestMixin, APITestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(email='merge@example.com', password='pass')
+        self.strategy = Selector().strategy()
+
+    def make_basket(self, quantities, owner=None):
+        basket = Basket.objects.create(owner=owner)
+        basket.strategy = self.strategy
+        for pk, quantity in quantities.items():
+            basket.add(Product.objects.get(pk=pk), quantity)
+        return basket
+
+    def quantities(self, basket):
+        return dict(basket.lines.values_list('product_id', 'quantity'))
+
+    def test_merges_lines(self):
+        master = self.make_basket({1: 1, 3: 2}, owner=self.user)
+        slave = self.make_basket({1: 3, 3: 1, 5: 1})
+
+        merge_baskets(master, slave)
+        self.assertDictEqual(self.quantities(master), {1: 3, 3: 2, 5: 1})
+        self.assertFalse(slave.lines.exists())
+        self.assertEqual(Basket.objects.get(pk=slave.pk).status, Basket.MERGED)
+
+        merge_baskets(master, self.make_basket({1: 1}), add_quantities=True)
+        self.assertEqual(self.quantities(master)[1], 4)
+
+    def test_query_count_independent_of_lines(self):
+        def count_queries(master_lines, slave_lines):
+            master = self.make_basket(master_lines, owner=self.user)
+            slave = self.make_basket(slave_lines)
+            with CaptureQueriesContext(connection) as ctx:
+                merge_baskets(master, slave)
+            master.delete()
+            return len(ctx.captured_queries)
+
+        few = count_queries({1: 1}, {1: 2, 3: 1})
+        many = count_queries({1: 1, 3: 1, 5: 1}, {1: 2, 3: 2, 5: 2, 4: 1})
+        self.assertEqual(many, few)
+
+    def load_basket(self, token=None):
+        basket = CachedBasket.load(token)
+        basket.strategy = Selector().strategy()
+        return basket
+
+    def test_changes_made_to_current_lines(self):
+        basket = self.load_basket()
+        mutate_basket(basket, lambda: basket.add(Product.objects.get(pk=1)))
+        # read by another request, before the next change
+        other = self.load_basket(basket.token)
+        _, revision = mutate_basket(basket, lambda: basket.add(Product.objects.get(pk=3)))
+
+        mutate_basket(other, lambda: other.add(Product.objects.get(pk=5)))
+        product_ids = [product_id for product_id, _, _ in CachedBasket.load(basket.token)._items]
+        self.assertListEqual(product_ids, [1, 3, 5])
+
+        with self.assertRaises(StaleBasket):
+            mutate_basket(other, lambda: other.add(Product.objects.get(pk=1)), expected=revision)
+
+    @patch('apps.shopapi.baskets.time.sleep')
+    def test_conflict_while_changed_by_another_request(self, sleep):
+        basket = self.load_basket()
+        mutate_basket(basket, lambda: basket.add(Product.objects.get(pk=1)))
+        other = self.load_basket(basket.token)
+        self.assertTrue(other.lock())
+
+        with self.assertRaises(BasketConflict):
+            mutate_basket(basket, lambda: basket.add(Product.objects.get(pk=3)))
+        self.assertEqual(sleep.call_count, 3)
+
+        other.unlock()
+        mutate_basket(basket, lambda: basket.add(Product.objects.get(pk=3)))
+        self.assertEqual(len(CachedBasket.load(basket.token)._items), 2)
+
+    def test_merged_on_login(self):
+        master = self.make_basket({1: 1}, owner=self.user)
+        self.client.post(self.add_product_url, {'product_id': 1, 'quantity': 2})
+        self.client.post(self.add_product_url, {'product_id': 3, 'quantity': 1})
+
+        self.client.force_login(self.user)
+        response = self.client.get(self.get_basket_url)
+        self.assertEqual(response.data['id'], master.id)
+        self.assertDictEqual(self.quantities(master), {1: 2, 3: 1})
+        self.assertEqual(response['X-Basket-Revision'], '1')
+
+
+class LazyBasketTestCase(BasketTestMixin, APITestCase):
+
+    def setUp(self) -> None:
+        basket_loads.reset()
+        self.addCleanup(basket_loads.reset)
+        # a session basket
+        self.client.post(self.add_product_url, self.get_add_product_data())
+
+    def test_basket_loaded_only_when_read(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('product-list'))
+        self.assertFalse([q for q in ctx.captured_queries if 'basket' in q['sql']])
+
+        self.client.get(self.get_basket_url)
+        self.assertDictEqual(basket_loads.stats(), {'requests': 3, 'baskets_loaded': 2})
+
+
+class OfferResultsTestCase(BasketTestMixin, APITestCase):
+
+    def setUp(self) -> None:
+        # 20% off everything
+        self.offer = create_offer()
+        self.client.post(self.add_product_url, {'product_id': 1, 'quantity': 2})
+        offer_results.hits = offer_results.misses = 0
+
+    def get_total(self):
+        return self.client.get(self.get_basket_url).data['total_price']
+
+    def test_offers_applied_once_per_basket_version(self):
+        total = self.get_total()
+        self.assertEqual(self.get_total(), total)
+        self.assertDictEqual(offer_results.stats(), {'hits': 1, 'misses': 1})
+
+        product = Product.objects.get(pk=1)
+        price = product.stockrecords.first().price
+        self.assertEqual(total, price * 2 * 80 / 100)
+
+    def test_offers_applied_again_after_changes(self):
+        total = self.get_total()
+        self.client.post(self.add_product_url, {'product_id': 1, 'quantity': 1})
+        self.assertNotEqual(self.get_total(), total)
+
+        misses = offer_results.misses
+        self.offer.benefit.value = 50
+        with self.captureOnCommitCallbacks(execute=True):
+            self.offer.benefit.save()
+        self.get_total()
+        self.assertEqual(offer_results.misses, misses + 1)
+
+
+@override_settings(BASKET_STORAGE='cache')
+class CachedBasketTestCase(BasketTestMixin, APITestCase):
+
+    def setUp(self) -> None:
+        self.p = patch('apps.shopapi.views.send_order_details')
+        self.p.start()
+        self.addCleanup(self.p.stop)
+
+    def add_products(self, *product_ids):
+        for pk in product_ids:
+            response = self.client.post(self.add_product_url, {'product_id': pk, 'quantity': 1})
+        return response
+
+    def test_no_database_writes_until_checkout(self):
+        baskets, lines = Basket.objects.count(), Line.objects.count()
+        self.add_products(1, 3, 1)
+        response = self.client.post(self.batch_url, {'operations': [
+            {'op': 'add', 'product_id': 5, 'quantity': 2},
+            {'op': 'remove', 'product_id': 3},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Basket.objects.count(), baskets)
+        self.assertEqual(Line.objects.count(), lines)
+
+        response = self.client.get(self.get_basket_url)
+        quantities = {line['product']['id']: line['quantity'] for line in response.data['lines']}
+        self.assertDictEqual(quantities, {1: 2, 5: 2})
+        self.assertEqual(response.data['total_quantity'], 4)
+        self.assertIsNone(response.data['id'])
+
+    @property
+    def batch_url(self):
+        view = self.basket_viewset
+        return view.reverse_action(view.batch.url_name)
+
+    def test_basket_not_modified(self):
+        self.add_products(1)
+        etag = self.client.get(self.get_basket_url)['ETag']
+        response = self.client.get(self.get_basket_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.add_products(3)
+        response = self.client.get(self.get_basket_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_baskets_of_sessions_are_separate(self):
+        self.add_products(1)
+        self.client.cookies.clear()
+        response = self.client.get(self.get_basket_url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_delta_since_version(self):
+        version = self.add_products(1)['X-Basket-Version']
+        response = self.client.get(self.get_basket_url, {'since': version})
+        self.assertTrue(response.data['delta'])
+        self.assertListEqual(response.data['lines'], [])
+
+        # (the lines of a cached basket have no ids, their changes aren't logged)
+        self.add_products(3)
+        response = self.client.get(self.get_basket_url, {'since': version})
+        self.assertFalse(response.data['delta'])
+        self.assertEqual(len(response.data['lines']), 2)
+
+        # changes are logged under the version key of the basket
+        token = Signer().unsign(self.client.cookies[cached_basket_cookie()].value)
+        version = response.data['version']
+        record_basket_change(CachedBasket.load(token).cache_id, removed=[42])
+        response = self.client.get(self.get_basket_url, {'since': version})
+        self.assertTrue(response.data['delta'])
+        self.assertListEqual(response.data['removed_lines'], [42])
+
+    def test_materialized_at_checkout(self):
+        self.add_products(1, 1, 3)
+        response = self.client.post(self.checkout_url, data=self.get_checkout_data(), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(order.num_items, 3)
+        self.assertEqual(order.basket.status, Basket.SUBMITTED)
+        # the cached basket is gone
+        self.assertEqual(self.client.get(self.get_basket_url).status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_merged_on_login(self):
+        user = get_user_model().objects.create_user(email='cached@example.com', password='pass')
+        basket = Basket.objects.create(owner=user)
+        basket.strategy = Selector().strategy()
+        basket.add(Product.objects.get(pk=1), 3)
+        self.add_products(1, 3)
+
+        self.client.force_login(user)
+        response = self.client.get(self.get_basket_url)
+        self.assertEqual(response.data['id'], basket.id)
+        quantities = dict(basket.lines.values_list('product_id', 'quantity'))
+        # the larger quantity of a product in both baskets is kept
+        self.assertDictEqual(quantities, {1: 3, 3: 1})
+        self.assertFalse(Basket.objects.filter(owner=None, lines__product_id=3).exists())
+
 
 def get_add_product_response_shape():
     return {
@@ -339,7 +877,8 @@ def get_add_product_response_shape():
                 'id': int,
                 'title': str,
                 'price': float,
-                'image': str
+                'image': str,
+                'srcset': dict
             }
         }
     }
@@ -362,6 +901,7 @@ def get_basket_response_shape():
                     'title': 'Ladies wedding gown',
                     'price': 200.32,
                     'image': 'http:/path/to/image/',
+                    'srcset': {'jpeg': 'http:/path/to/image/ 200w'},
                 }
             },
             {
@@ -374,6 +914,7 @@ def get_basket_response_shape():
                     'title': 'Ladies wedding gown',
                     'price': 32.32,
                     'image': 'http:/path/to/image/',
+                    'srcset': {'jpeg': 'http:/path/to/image/ 200w'},
                 }
             }
         ]
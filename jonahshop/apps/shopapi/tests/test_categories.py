@@ -0,0 +1,79 @@
+from unittest.mock import patch
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from oscar.core.loading import get_model
+from rest_framework.test import APITestCase
+
+from apps.shopapi.categories import CategoryTreeHolder
+
+
+Category = get_model('catalogue', 'Category')
+Product = get_model('catalogue', 'Product')
+
+
+class CategoryTreeTestCase(APITestCase):
+    fixtures = ['fixture_all.json' ]
+
+    def setUp(self):
+        cache.clear()
+        # a fresh snapshot (of this test's database) for each test
+        p = patch('apps.shopapi.views.category_tree', CategoryTreeHolder())
+        p.start()
+        self.addCleanup(p.stop)
+        p = patch('apps.shopapi.receivers.search')
+        p.start()
+        self.addCleanup(p.stop)
+
+    def get_tree(self):
+        return self.client.get(reverse('category-list')).json()
+
+    def test_tree_with_product_counts(self):
+        ladies = Category.objects.get(name='Ladies')
+        with self.captureOnCommitCallbacks(execute=True):
+            ladies.add_child(name='Bags')
+
+        tree = self.get_tree()
+
+        self.assertListEqual(
+            [node['name'] for node in tree],
+            ['Ladies', 'Men', 'Kids', 'Official', 'Casual']
+        )
+        self.assertEqual(tree[0]['product_count'], 2)
+        self.assertDictEqual(
+            tree[0]['children'][0],
+            {'id': tree[0]['children'][0]['id'], 'name': 'Bags', 'slug': 'bags', 'product_count': 0, 'children': []}
+        )
+
+    def test_snapshot_is_served_without_queries(self):
+        self.get_tree()
+        with CaptureQueriesContext(connection) as ctx:
+            self.get_tree()
+        selects = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertListEqual(selects, [])
+
+    def test_snapshot_rebuilt_on_product_category_change(self):
+        self.get_tree()
+        product = Product.objects.filter(categories__name='Ladies').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            product.categories.remove(Category.objects.get(name='Ladies'))
+        self.get_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            product.categories.add(Category.objects.get(name='Kids'))
+
+        tree = {node['name']: node['product_count'] for node in self.get_tree()}
+        self.assertEqual(tree['Ladies'], 1)
+        self.assertEqual(tree['Kids'], 1)
+
+    def test_snapshot_shared_by_processes(self):
+        CategoryTreeHolder().get()
+        # another process loads the snapshot from the cache
+        with CaptureQueriesContext(connection) as ctx:
+            CategoryTreeHolder().get()
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_not_modified(self):
+        etag = self.client.get(reverse('category-list'))['ETag']
+        response = self.client.get(reverse('category-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
@@ -5,6 +5,7 @@ from oscar.apps.catalogue.models import Product as OscarProduct
 from oscar.apps.basket.models import Basket as OscarBasket
 from oscar.apps.order.abstract_models import AbstractOrder
 
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import APITestCase, APIRequestFactory
 
 from apps.shopapi.serializers.checkout import CheckoutSerializer
@@ -15,6 +16,7 @@ from apps.payapi.paymethods import PaymentMethods
 
 Product: OscarProduct = get_model('catalogue', 'Product')
 Selector = get_class('partner.strategy', 'Selector')
+StockRecord = get_model('partner', 'StockRecord')
 
 class CheckoutSerializerTestCase(APITestCase):
     fixtures = ['fixture_all.json' ]
@@ -159,4 +161,14 @@ class CheckoutSerializerTestCase(APITestCase):
         self.assertEqual(
             order.total_incl_tax,
             order.sources.first().amount_allocated
-        )
\ No newline at end of file
+        )
+
+    def test_rejects_basket_out_of_stock(self):
+        # another checkout took one of the 3 items of a line in stock
+        StockRecord.objects.get(pk=3).allocate(1)
+        cser = CheckoutSerializer(data=self.get_data(), context={'request': self.request})
+        cser.is_valid()
+
+        with self.assertRaises(ValidationError):
+            cser.save()
+        self.assertEqual(StockRecord.objects.get(pk=3).num_allocated, 1)
@@ -0,0 +1,92 @@
+from unittest.mock import patch
+from django.core.cache import cache
+from django.urls import reverse
+from oscar.core.loading import get_model
+from rest_framework.test import APITestCase
+
+from apps.shopapi.facets import FacetIndex, FacetIndexHolder, price_band
+from apps.shopapi.models import ProductListing
+
+
+Product = get_model('catalogue', 'Product')
+StockRecord = get_model('partner', 'StockRecord')
+
+
+class FacetsTestCase(APITestCase):
+    fixtures = ['fixture_all.json' ]
+
+    @classmethod
+    def setUpTestData(cls):
+        ProductListing.objects.refresh()
+
+    def setUp(self):
+        cache.clear()
+        # a fresh index (of this test's database) for each test
+        p = patch('apps.shopapi.views.facet_index', FacetIndexHolder())
+        p.start()
+        self.addCleanup(p.stop)
+        p = patch('apps.shopapi.receivers.refresh_product_listings')
+        p.start()
+        self.addCleanup(p.stop)
+
+    def get_listing(self, params):
+        return self.client.get(reverse('product-list'), params).data
+
+    def test_price_band(self):
+        self.assertEqual(price_band(45), '0-50')
+        self.assertEqual(price_band(50), '50-100')
+        self.assertEqual(price_band(900), '500-')
+
+    def test_facet_counts(self):
+        facets = self.get_listing({'facets': 'true'})['facets']
+
+        self.assertDictEqual(facets['category'], {'1': 2, '2': 2})
+        self.assertDictEqual(facets['price'], {'0-50': 1, '50-100': 1, '250-500': 2})
+        self.assertDictEqual(facets['availability'], {'in_stock': 4})
+
+    def test_filter_by_category(self):
+        data = self.get_listing({'category': '2'})
+        ids = {p['id'] for p in data['results']}
+        self.assertSetEqual(ids, set(Product.objects.filter(categories=2).values_list('pk', flat=True)))
+
+    def test_counts_of_filtered_facet_exclude_its_own_filter(self):
+        data = self.get_listing({'category': '1', 'facets': 'true'})
+
+        self.assertEqual(data['count'], 2)
+        # selecting another category is still possible
+        self.assertDictEqual(data['facets']['category'], {'1': 2, '2': 2})
+        # prices are of the filtered products
+        self.assertDictEqual(data['facets']['price'], {'0-50': 1, '50-100': 1})
+
+    def test_filter_multiple_values(self):
+        data = self.get_listing({'price': '0-50,50-100'})
+        self.assertEqual(data['count'], 2)
+
+    def test_index_updated_on_stockrecord_change(self):
+        index = FacetIndexHolder()
+        index.get()
+
+        record = StockRecord.objects.get(price='45.00')
+        record.num_in_stock = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            record.save()
+
+        counts = index.get().counts({})
+        self.assertDictEqual(counts['availability'], {'in_stock': 3, 'out_of_stock': 1})
+
+    def test_index_rebuilt_on_category_change(self):
+        holder = FacetIndexHolder()
+        first = holder.get()
+        category = get_model('catalogue', 'Category').objects.get(pk=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        self.assertIsNot(first, holder.get())
+
+    def test_unbrowsable_product_removed(self):
+        index = FacetIndex.build()
+        product = Product.objects.get(pk=1)
+        product.is_public = False
+        product.save()
+
+        index.update_products([product.pk])
+        self.assertNotIn(product.pk, index.filter_ids({}))
@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from oscar.core.loading import get_model
+from rest_framework.test import APITestCase, APIRequestFactory
+
+from apps.shopapi.feeds import feed_items
+
+
+Product = get_model('catalogue', 'Product')
+
+
+class ProductFeedTestCase(APITestCase):
+    fixtures = ['fixture_all.json' ]
+
+    def get_feed(self, params=None):
+        response = self.client.get(reverse('product-feed'), params)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson_feed(self):
+        response, content = self.get_feed()
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        items = [json.loads(line) for line in content.splitlines()]
+        self.assertListEqual(
+            [item['id'] for item in items],
+            list(Product.objects.browsable().order_by('pk').values_list('pk', flat=True))
+        )
+        self.assertTrue(all(item['price'] and item['image'] for item in items))
+
+    def test_csv_feed(self):
+        response, content = self.get_feed({'type': 'csv', 'fields': 'id,price,availability'})
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), Product.objects.browsable().count())
+        self.assertListEqual(list(rows[0]), ['id', 'price', 'availability'])
+
+    def test_unknown_feed_type(self):
+        response = self.client.get(reverse('product-feed'), {'type': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_queries_per_chunk(self):
+        """
+        Products are read in chunks, and the stockrecords and images
+        of a chunk are fetched in one query each
+        """
+        request = APIRequestFactory().get('/')
+        with CaptureQueriesContext(connection) as ctx:
+            items = list(feed_items({'request': request}, chunk_size=2))
+
+        self.assertEqual(len(items), 4)
+        # the products (a single cursor), then the images and
+        # stockrecords of each of the 2 chunks
+        self.assertLessEqual(len(ctx.captured_queries), 1 + 2 * 2)
+
+    @override_settings(ALLOWED_HOSTS=['shop.example.com'])
+    def test_export_command(self):
+        out = io.StringIO()
+        call_command(
+            'export_product_feed', base_url='https://shop.example.com',
+            stdout=out, stderr=io.StringIO())
+
+        items = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(items), Product.objects.browsable().count())
+        self.assertTrue(items[0]['url'].startswith('https://shop.example.com/'))
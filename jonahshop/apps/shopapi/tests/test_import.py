@@ -0,0 +1,124 @@
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import TestCase
+from oscar.core.loading import get_model
+
+from apps.shopapi.importer import CatalogueImporter, ImportProgress, read_json
+
+
+Product = get_model('catalogue', 'Product')
+ProductClass = get_model('catalogue', 'ProductClass')
+ProductAttribute = get_model('catalogue', 'ProductAttribute')
+ProductAttributeValue = get_model('catalogue', 'ProductAttributeValue')
+StockRecord = get_model('partner', 'StockRecord')
+Partner = get_model('partner', 'Partner')
+
+CSV = """upc,title,product_class,price,num_in_stock,categories,attr.size
+B-001,Leather Bag,Bag,120.00,5,Ladies|Accessories > Bags,40
+B-002,Straw Bag,Bag,35.50,0,Ladies,
+B-003,Broken Bag,Bag,not a price,1,,
+"""
+
+
+class ImportCatalogueTestCase(TestCase):
+    fixtures = ['fixture_all.json' ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        ProductAttribute.objects.create(
+            product_class=ProductClass.objects.get(name='Bag'), name='Size', code='size', type='integer')
+        # the background tasks queued after each batch
+        self.tasks = {}
+        for name in ('index_products', 'refresh_product_listings', 'generate_product_thumbnails'):
+            p = patch(f'apps.shopapi.importer.{name}')
+            self.tasks[name] = p.start()
+            self.addCleanup(p.stop)
+        # new categories are indexed on save (their products in the background)
+        for target in ('apps.shopapi.receivers.search', 'apps.shopapi.receivers.index_products'):
+            p = patch(target)
+            p.start()
+            self.addCleanup(p.stop)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def import_file(self, path, **options):
+        out, err = io.StringIO(), io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                'import_catalogue', path, partner='Michael Mensah',
+                stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_creates_products(self):
+        out, err = self.import_file(self.write_file('catalogue.csv', CSV))
+
+        bag = Product.objects.get(upc='B-001')
+        self.assertEqual(bag.title, 'Leather Bag')
+        self.assertEqual(bag.stockrecords.get().price, Decimal('120.00'))
+        self.assertSetEqual({c.name for c in bag.categories.all()}, {'Ladies', 'Bags'})
+        self.assertEqual(bag.attribute_values.get(attribute__code='size').value, 40)
+        self.assertTrue(Product.objects.filter(upc='B-002').exists())
+        # the row with an invalid price is reported, not imported
+        self.assertFalse(Product.objects.filter(upc='B-003').exists())
+        self.assertIn('Row 3: price', err)
+        self.assertIn('2 created, 0 updated, 0 unchanged, 1 errors', out)
+        self.assertIn('rows/s', out)
+
+        ids = sorted(self.tasks['index_products'].delay.call_args[0][0])
+        self.assertListEqual(ids, sorted(Product.objects.filter(upc__startswith='B-').values_list('pk', flat=True)))
+
+    def test_updates_only_what_changed(self):
+        self.import_file(self.write_file('catalogue.csv', CSV))
+        changed = CSV.replace('35.50', '30.00')
+
+        out, _ = self.import_file(self.write_file('changed.csv', changed))
+
+        self.assertIn('0 created, 1 updated, 1 unchanged', out)
+        record = StockRecord.objects.get(product__upc='B-002')
+        self.assertEqual(record.price, Decimal('30.00'))
+
+    def test_writes_in_batches(self):
+        path = self.write_file('catalogue.csv', CSV)
+        out, _ = self.import_file(path, batch_size=1)
+        # a progress line for each batch
+        self.assertEqual(out.count('rows/s'), 3 + 1)
+        self.assertEqual(Product.objects.filter(upc__startswith='B-').count(), 2)
+
+    def test_resume(self):
+        path = self.write_file('catalogue.csv', CSV)
+        # the first 2 rows were imported before an interruption
+        ImportProgress(path).save(2)
+
+        out, _ = self.import_file(path, resume=True)
+        self.assertIn('2 rows skipped', out)
+        self.assertFalse(Product.objects.filter(upc__startswith='B-').exists())
+        self.assertFalse(os.path.exists(ImportProgress(path).path))
+
+    def test_import_json(self):
+        rows = [{'upc': 'J-1', 'title': 'Json Bag', 'product_class': 'Bag', 'price': '10'}]
+        self.import_file(self.write_file('catalogue.json', json.dumps(rows)))
+        self.assertEqual(Product.objects.get(upc='J-1').title, 'Json Bag')
+
+    def test_read_json_lines_and_arrays(self):
+        objects = [{'upc': str(i), 'title': 'x' * 50} for i in range(100)]
+        array = io.StringIO(json.dumps(objects, indent=2))
+        lines = io.StringIO('\n'.join(map(json.dumps, objects)))
+
+        self.assertListEqual(list(read_json(array, buffer_size=16)), objects)
+        self.assertListEqual(list(read_json(lines, buffer_size=16)), objects)
+
+    def test_product_class_required_for_new_products(self):
+        importer = CatalogueImporter(Partner.objects.first())
+        stats = importer.run([{'upc': 'N-1', 'title': 'No class'}])
+        self.assertEqual(stats.created, 0)
+        self.assertEqual(stats.errors, [(1, 'product_class: required for new products')])
@@ -2,11 +2,13 @@ from unittest.mock import patch
 import pytest
 import tempfile
 from django.conf import settings
+from django.core.cache import cache
 from django.test import RequestFactory
 
 from oscar.core.loading import get_model
 from oscar.apps.order.models import Order as OsOrder, Line as OsOrderLine
 
+from apps.core.thumbnails import generate_thumbnails, placeholder_url, url_store
 from apps.shopapi.serializers import OrderSerializer
 from apps.shopapi.serializers.order import OrderLineSerializer
 from apps.shipping.serializers.address import ShippingAddressSerializer
@@ -80,21 +82,27 @@ def product_class():
 
 @pytest.fixture
 def product(product_class):
-    return Product.objects.create(
-        title='School Bag',
-        product_class=product_class
-    )
+    # don't add the product to the search index, nor queue it's listing refresh
+    with patch('apps.shopapi.receivers.search'), \
+            patch('apps.shopapi.receivers.refresh_product_listings'):
+        return Product.objects.create(
+            title='School Bag',
+            product_class=product_class
+        )
 
 
 @pytest.fixture
 def product_image(product):
-    return ProductImage.objects.create(
-        product=product,
-        original=tempfile.NamedTemporaryFile(
-            suffix='.jpg',
-            dir=settings.MEDIA_ROOT
-        ).name
-    )
+    # don't queue thumbnail generation and listing refresh (to celery)
+    with patch('apps.core.receivers.generate_product_thumbnails'), \
+            patch('apps.shopapi.receivers.refresh_product_listings'):
+        return ProductImage.objects.create(
+            product=product,
+            original=tempfile.NamedTemporaryFile(
+                suffix='.jpg',
+                dir=settings.MEDIA_ROOT
+            ).name
+        )
 
 
 @pytest.fixture
@@ -145,10 +153,12 @@ def test_serializes_order_data_with_shipping_address(order: OsOrder, order_data:
 
 def test_serializes_line_data(order_line, line_data):
     ctx = {'request': RequestFactory().get('/media/')}
-    lser = OrderLineSerializer(order_line, context=ctx)
-    data = lser.data
+    with patch('apps.core.receivers.generate_product_thumbnails'):
+        lser = OrderLineSerializer(order_line, context=ctx)
+        data = lser.data
     data.pop('id')
     data.pop('image')
+    data.pop('srcset')
     assert data == line_data
 
 
@@ -159,12 +169,32 @@ def test_line_serilizer_add_image_path_to_data(order_line, product_image):
 
     class Thumbnailer:
         url = image_path
-        def generate_thumbnail(self, source, size):
+        def generate_thumbnail(self, source, size, format):
             return self
 
-    with patch('apps.core.mixins.get_thumbnailer') as thm_mock:
+    with patch('apps.core.thumbnails.get_thumbnailer') as thm_mock, \
+            patch('apps.core.thumbnails.source_exists', return_value=True):
         thm_mock.return_value = Thumbnailer()
-        lser = OrderLineSerializer(order_line, context=ctx)
-        data = lser.data
+        # thumbnails are generated by a background task
+        generate_thumbnails(product_image.original)
+
+    lser = OrderLineSerializer(order_line, context=ctx)
+    data = lser.data
     
-    assert data['image'] == request.build_absolute_uri(image_path)
\ No newline at end of file
+    assert data['image'] == request.build_absolute_uri(image_path)
+
+
+def test_line_serializer_placeholder_image_not_generated(order_line, product_image):
+    request = RequestFactory().get('/media/')
+    ctx = {'request': request}
+    cache.clear()
+    url_store.clear()
+
+    with patch('apps.core.thumbnails.get_thumbnailer') as thm_mock, \
+            patch('apps.core.receivers.generate_product_thumbnails') as task_mock:
+        data = OrderLineSerializer(order_line, context=ctx).data
+
+    thm_mock.assert_not_called()
+    # but they are queued to be generated again
+    task_mock.delay.assert_called_once_with(product_image.pk)
+    assert data['image'] == request.build_absolute_uri(placeholder_url())
\ No newline at end of file
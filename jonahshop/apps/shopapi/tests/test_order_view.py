@@ -1,8 +1,10 @@
+from unittest.mock import patch
 import pytest
 from django.conf import settings
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
+from rest_framework.pagination import CursorPagination
 
 from oscar.core.loading import get_model
 from oscar.apps.order.models import Order as OsOrder, Line as OsOrderLine, ShippingAddress as OShippingAddress
@@ -168,6 +170,7 @@ def test_anonymous_request_contains_order_lines(order_url, order_credentials, li
     line1 = response.data['lines'][1]
     line1.pop('id')
     line1.pop('image')
+    line1.pop('srcset')
     assert line_data == line1
 
 
@@ -209,6 +212,21 @@ def test_retrieve_only_orders_belonging_to_user(test_client, order_list, order_d
     assert (order_nouser.number not in numbers)
     assert len(data) == len(order_list)
 
+def test_retrieve_list_of_orders_with_cursor(test_client, order_list):
+    url = reverse('order-list')
+    with patch.object(CursorPagination, 'page_size', 2):
+        response = test_client.get(url, {'pagination': 'cursor'})
+        first_page = response.data
+        response = test_client.get(first_page['next'])
+        second_page = response.data
+
+    assert 'count' not in first_page
+    assert first_page['previous'] is None
+    assert second_page['next'] is None
+
+    numbers = [d['number'] for d in first_page['results'] + second_page['results']]
+    assert sorted(numbers) == sorted(o.number for o in order_list)
+
 # def test_return_a_204_for_empty_order_list(test_client):
 #     user = User.objects.create(email='anotheruser@mail.com', password='12345')
 #     client = APIClient()
@@ -231,6 +249,28 @@ def test_retreive_order_together_with_lines(order_lines, test_client):
     assert len(order_lines) == len(response.data['lines'])
 
 
+def test_retreive_order_omit_line_image(order_lines, test_client):
+    order = order_lines[0].order
+    url = reverse('order-detail', args=[order.number])
+    response = test_client.get(url, {'omit': 'image,srcset'})
+    assert 'image' not in response.data['lines'][0]
+    assert 'title' in response.data['lines'][0]
+
+
+def test_order_not_modified(order_lines, test_client):
+    order = order_lines[0].order
+    url = reverse('order-detail', args=[order.number])
+    etag = test_client.get(url)['ETag']
+
+    response = test_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    order.status = 'Cancelled'
+    order.save()
+    response = test_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+
+
 def test_cant_request_order_for_another_user(test_client, order_data, shipping_address):
     order_nouser = create_order(order_data, shipping_address, '3001090')
     response = test_client.get(reverse('order-detail', args=[order_nouser.number]))
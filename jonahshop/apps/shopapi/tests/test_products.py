@@ -1,11 +1,35 @@
+from decimal import Decimal
+from importlib import import_module
+from types import SimpleNamespace
+from unittest.mock import patch
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from oscar.core.loading import get_model
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APIRequestFactory
+
+from apps.core.thumbnails import generate_thumbnails, url_store
+from apps.shopapi.cache import get_version, invalidate_products, product_version_key
+from apps.shopapi.models import ProductListing, ProductListingQuerySet
+from apps.shopapi.serializers import ProductSerializer
+from apps.shopapi.serializers.product import MAX_BULK_PRODUCT_IDS
+from apps.shopapi.tasks import refresh_product_listings
+
+
+Product = get_model('catalogue', 'Product')
+StockRecord = get_model('partner', 'StockRecord')
+ProductAttribute = get_model('catalogue', 'ProductAttribute')
+ProductAttributeValue = get_model('catalogue', 'ProductAttributeValue')
 
 
 class ProductsTestCase(APITestCase):
     fixtures = ['fixture_all.json' ]
 
+    @classmethod
+    def setUpTestData(cls):
+        ProductListing.objects.refresh()
+
     @property
     def product_class(self):
         return get_model('catalogue', 'Product')
@@ -17,9 +41,314 @@ class ProductsTestCase(APITestCase):
         self.assertEqual(len(response.data['results']), len(products))
 
     def test_product_listing_fields(self):
-        fields = ('url', 'id', 'title', 'rating', 'price', 'availability', 'is_parent', 'image')
+        fields = ('url', 'id', 'title', 'rating', 'price', 'availability', 'is_parent', 'image', 'srcset')
         response = self.client.get(reverse('product-list'))
         self.assertTupleEqual(
             fields,
             tuple(response.data['results'][0].keys())
         )
+
+    def test_product_listing_sparse_fields(self):
+        with patch.object(ProductSerializer, 'get_price') as price_mock:
+            response = self.client.get(reverse('product-list'), {'fields': 'id,title'})
+
+        price_mock.assert_not_called()
+        self.assertTupleEqual(
+            ('id', 'title'),
+            tuple(response.data['results'][0].keys())
+        )
+
+    def test_product_listing_omit_fields(self):
+        response = self.client.get(reverse('product-list'), {'omit': 'image,srcset,availability'})
+        self.assertTupleEqual(
+            ('url', 'id', 'title', 'rating', 'price', 'is_parent'),
+            tuple(response.data['results'][0].keys())
+        )
+
+    def test_bulk_lookup_in_requested_order(self):
+        ids = list(self.product_class.objects.browsable().values_list('pk', flat=True))
+        ids = ids[::-1] + [99999]
+        url = reverse('product-bulk')
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {'ids': ','.join(map(str, ids))})
+
+        results = response.data['results']
+        self.assertListEqual([r['id'] for r in results], ids)
+        self.assertDictEqual(results[-1], {'id': 99999, 'not_found': True})
+        self.assertIn('price', results[0])
+        # products, their images and stockrecords
+        selects = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 3)
+
+    def test_bulk_lookup_query_count_independent_of_products(self):
+        """
+        The product classes (read by the availability policy) are selected
+        with the products, not fetched for each of them
+        """
+        ids = list(self.product_class.objects.browsable().values_list('pk', flat=True))
+        url = reverse('product-bulk')
+
+        def selects(ids):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(url, {'ids': ','.join(map(str, ids))})
+            return [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+
+        one = selects(ids[:1])
+        self.assertGreater(len(ids), 2)
+        self.assertEqual(len(selects(ids)), len(one))
+        self.assertFalse([sql for sql in one if sql.startswith('SELECT "catalogue_productclass"')])
+
+    def test_detail_selects_product_class(self):
+        product = self.product_class.objects.browsable().first()
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('product-detail', args=[product.pk]))
+        selects = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertFalse([sql for sql in selects if sql.startswith('SELECT "catalogue_productclass"')])
+
+    def test_srcset_of_listing_and_detail_presets(self):
+        class Thumbnailer:
+            def generate_thumbnail(self, source, size, format):
+                return SimpleNamespace(url=f'/media/cache/{size}.{format.lower()}')
+
+        cache.clear()
+        url_store.clear()
+        product = self.product_class.objects.get(pk=1)
+        with patch('apps.core.thumbnails.get_thumbnailer', return_value=Thumbnailer()), \
+                patch('apps.core.thumbnails.source_exists', return_value=True):
+            generate_thumbnails(product.primary_image().original)
+        ProductListing.objects.refresh([product.pk])
+
+        listing = self.client.get(reverse('product-list'), {'fields': 'id,srcset'}).data['results']
+        srcset = next(p['srcset'] for p in listing if p['id'] == product.pk)
+        self.assertEqual(
+            srcset['webp'],
+            'http://testserver/media/cache/200x200.webp 200w, http://testserver/media/cache/400x400.webp 400w'
+        )
+        detail = self.client.get(reverse('product-detail', args=[product.pk])).data
+        self.assertTrue(detail['srcset']['jpeg'].endswith('/media/cache/1200x1200.jpeg 1200w'))
+
+    def test_bulk_lookup_rejects_too_many_ids(self):
+        ids = ','.join(str(i) for i in range(1, MAX_BULK_PRODUCT_IDS + 2))
+        response = self.client.get(reverse('product-bulk'), {'ids': ids})
+        self.assertEqual(response.status_code, 400)
+
+    def test_product_listing_cursor_pagination(self):
+        products = self.product_class.objects.browsable()
+        response = self.client.get(reverse('product-list'), {'pagination': 'cursor'})
+
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['next'])
+        self.assertListEqual(
+            [p['id'] for p in response.data['results']],
+            [p.id for p in products.order_by('-date_created')]
+        )
+
+    @patch.object(ProductSerializer, 'get_image', return_value='')
+    def test_listing_query_count_independent_of_page_size(self, _):
+        """
+        Stockrecords for a page of products are fetched in a single
+        query, regardless of the number of products on the page
+        """
+        request = APIRequestFactory().get(reverse('product-list'))
+        ctx = {'request': request}
+        qs = self.product_class.objects.browsable().base_queryset()
+
+        with CaptureQueriesContext(connection) as one_product:
+            ProductSerializer(qs[:1], many=True, context=ctx).data
+        with CaptureQueriesContext(connection) as all_products:
+            data = ProductSerializer(qs, many=True, context=ctx).data
+
+        self.assertEqual(len(one_product), len(all_products))
+        self.assertTrue(all(item['availability'] for item in data))
+
+
+class ProductsCacheTestCase(APITestCase):
+    fixtures = ['fixture_all.json' ]
+
+    @classmethod
+    def setUpTestData(cls):
+        ProductListing.objects.refresh()
+
+    def setUp(self):
+        cache.clear()
+        # refresh listings right away, instead of queuing the task (to celery)
+        p = patch('apps.shopapi.receivers.refresh_product_listings.delay', refresh_product_listings)
+        p.start()
+        self.addCleanup(p.stop)
+        p = patch('apps.shopapi.receivers.search')
+        p.start()
+        self.addCleanup(p.stop)
+
+    def test_anonymous_listing_is_cached(self):
+        url = reverse('product-list')
+        response = self.client.get(url)
+
+        with CaptureQueriesContext(connection) as ctx:
+            cached = self.client.get(url)
+        self.assertEqual(response.json(), cached.json())
+        # only the savepoint queries of ATOMIC_REQUESTS
+        selects = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertListEqual(selects, [])
+
+    def test_listing_cache_invalidated_on_product_change(self):
+        url = reverse('product-list')
+        self.client.get(url)
+
+        product = Product.objects.browsable().first()
+        product.title = 'New title'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        response = self.client.get(url)
+        titles = [p['title'] for p in response.data['results']]
+        self.assertIn('New title', titles)
+
+    def test_detail_cache_invalidated_on_stockrecord_change(self):
+        product = Product.objects.browsable().first()
+        url = reverse('product-detail', args=[product.id])
+        self.client.get(url)
+
+        stockrecord = product.stockrecords.first()
+        stockrecord.price = '1.50'
+        with self.captureOnCommitCallbacks(execute=True):
+            stockrecord.save()
+
+        response = self.client.get(url)
+        self.assertEqual(response.data['price'], Decimal('1.50'))
+
+    def test_parent_of_changed_stockrecord_looked_up_once(self):
+        stockrecord = Product.objects.browsable().first().stockrecords.first()
+        with CaptureQueriesContext(connection) as ctx, \
+                self.captureOnCommitCallbacks(execute=True):
+            stockrecord.save()
+        lookups = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT "catalogue_product"."parent_id"')]
+        self.assertEqual(len(lookups), 1)
+
+    def test_many_products_invalidated_at_once(self):
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+        versions = {pk: get_version(product_version_key(pk)) for pk in product_ids}
+
+        with patch('apps.shopapi.cache.cache.set_many', wraps=cache.set_many) as set_many:
+            invalidate_products(product_ids)
+        set_many.assert_called_once()
+        for pk in product_ids:
+            self.assertGreater(get_version(product_version_key(pk)), versions[pk])
+
+    def test_listing_not_modified(self):
+        url = reverse('product-list')
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_detail_modified_after_product_change(self):
+        product = Product.objects.browsable().first()
+        url = reverse('product-detail', args=[product.id])
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_modified_after_attribute_change(self):
+        product = Product.objects.browsable().first()
+        url = reverse('product-detail', args=[product.id])
+        attribute = ProductAttribute.objects.create(
+            product_class=product.get_product_class(), name='Size', code='size', type='integer')
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            value = ProductAttributeValue.objects.create(product=product, attribute=attribute, value_integer=40)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            value.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cache_not_invalidated_before_commit(self):
+        # a request in between would cache the old data under the new version
+        product = Product.objects.browsable().first()
+        url = reverse('product-detail', args=[product.id])
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cache_key_covers_query_params(self):
+        url = reverse('product-list')
+        self.client.get(url)
+        response = self.client.get(url, {'pagination': 'cursor'})
+        self.assertNotIn('count', response.data)
+
+
+class ProductListingTestCase(APITestCase):
+    fixtures = ['fixture_all.json' ]
+
+    def setUp(self):
+        ProductListing.objects.refresh()
+        p = patch('apps.shopapi.receivers.refresh_product_listings')
+        self.refresh_mock = p.start()
+        self.addCleanup(p.stop)
+
+    def test_listing_matches_product_serializer(self):
+        request = APIRequestFactory().get(reverse('product-list'))
+        products = Product.objects.browsable().base_queryset()
+        expected = ProductSerializer(products, many=True, context={'request': request}).data
+
+        response = self.client.get(reverse('product-list'))
+        self.assertListEqual(response.json()['results'], [dict(p) for p in expected])
+
+    def test_listing_is_a_single_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('product-list'), {'pagination': 'cursor'})
+        selects = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 1)
+
+    def test_refresh_queued_on_stockrecord_change(self):
+        record = StockRecord.objects.get(price='45.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            record.save()
+        self.refresh_mock.delay.assert_called_once_with([record.product_id])
+
+    def test_refresh_updates_price_and_availability(self):
+        record = StockRecord.objects.get(price='45.00')
+        record.price = '40.00'
+        record.num_in_stock = 0
+        record.save()
+
+        ProductListing.objects.refresh([record.product_id])
+        listing = ProductListing.objects.get(pk=record.product_id)
+        self.assertEqual(listing.price_excl_tax, Decimal('40.00'))
+        self.assertFalse(listing.availability)
+
+    def test_migration_backfills_listings(self):
+        ProductListing.objects.all().delete()
+        migration = import_module('apps.shopapi.migrations.0007_backfill_productlisting')
+        migration.backfill_listings(None, None)
+        self.assertEqual(ProductListing.objects.count(), Product.objects.browsable().count())
+
+    def test_write_of_listing_created_meanwhile(self):
+        # another refresh created the listing after this one looked it up
+        products = list(Product.objects.browsable().filter(pk=1))
+        with patch.object(ProductListingQuerySet, 'filter', return_value=ProductListing.objects.none()):
+            ProductListing.objects.all()._write(products)
+        self.assertEqual(ProductListing.objects.filter(pk=1).count(), 1)
+
+    def test_refresh_removes_unbrowsable_product(self):
+        product = Product.objects.get(pk=1)
+        product.is_public = False
+        product.save()
+
+        ProductListing.objects.refresh([product.pk])
+        self.assertFalse(ProductListing.objects.filter(pk=product.pk).exists())
+        self.assertEqual(ProductListing.objects.count(), 3)
@@ -0,0 +1,106 @@
+import io
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from oscar.core.loading import get_model
+from rest_framework.test import APITestCase
+
+from apps.shopapi.models import CoPurchase, ProductListing
+from apps.shopapi.recommendations import build_recommendations, co_occurrences, top_neighbours
+
+
+Order = get_model('order', 'Order')
+OrderLine = get_model('order', 'Line')
+
+
+class RecommendationsTestCase(APITestCase):
+    fixtures = ['fixture_all.json' ]
+
+    @classmethod
+    def setUpTestData(cls):
+        ProductListing.objects.refresh()
+        # products bought together: 1 with 3 (twice), 1 with 4 (once)
+        for number, product_ids in enumerate([[1, 3], [1, 3, 4], [5], [3, 3]]):
+            order = Order.objects.create(
+                number=f'2000{number}', currency='GHC', total_incl_tax=1, total_excl_tax=1)
+            for product_id in product_ids:
+                OrderLine.objects.create(
+                    order=order, product_id=product_id, title='Line', quantity=1,
+                    line_price_incl_tax=1, line_price_excl_tax=1,
+                    line_price_before_discounts_incl_tax=1, line_price_before_discounts_excl_tax=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_co_occurrences(self):
+        matrix = co_occurrences([{1, 3}, {1, 3, 4}, {5}])
+        self.assertDictEqual(dict(matrix[1]), {3: 2, 4: 1})
+        self.assertDictEqual(dict(matrix[4]), {1: 1, 3: 1})
+        self.assertNotIn(5, matrix)
+        self.assertListEqual(dict(top_neighbours(matrix, k=1))[3], [(1, 2)])
+
+    def test_build_recommendations(self):
+        self.assertEqual(build_recommendations(), 3)
+        self.assertListEqual(
+            list(CoPurchase.objects.filter(product_id=1).values_list('recommendation_id', 'rank', 'score')),
+            [(3, 0, 2), (4, 1, 1)]
+        )
+        # rebuilt from scratch
+        build_recommendations(k=1)
+        self.assertEqual(CoPurchase.objects.filter(product_id=1).count(), 1)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('build_recommendations', top=2, stdout=out)
+        self.assertIn('recommendations of 3 products', out.getvalue())
+
+    def test_serves_recommendations_in_one_query(self):
+        build_recommendations()
+        url = reverse('product-recommendations', args=[1])
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        selects = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 1)
+        results = response.json()['results']
+        self.assertListEqual([p['id'] for p in results], [3, 4])
+        self.assertIn('price', results[0])
+
+        # unchanged until rebuilt
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            build_recommendations(k=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_no_recommendations(self):
+        response = self.client.get(reverse('product-recommendations', args=[5]))
+        self.assertListEqual(response.json()['results'], [])
+
+    def test_non_numeric_product_id_not_found(self):
+        response = self.client.get('/api/products/abc/recommendations/')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/api/products/abc/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_basket_recommendations(self):
+        build_recommendations()
+        url = reverse('basket-recommendations')
+        add_url = reverse('basket-add-product')
+
+        self.client.post(add_url, {'product_id': 1, 'quantity': 1}, format='json')
+        response = self.client.get(url)
+        self.assertListEqual([p['id'] for p in response.json()['results']], [3, 4])
+
+        # products already in the basket aren't recommended, scores add up
+        self.client.post(add_url, {'product_id': 3, 'quantity': 1}, format='json')
+        response = self.client.get(url)
+        self.assertListEqual([p['id'] for p in response.json()['results']], [4])
+
+    def test_empty_basket_recommendations(self):
+        build_recommendations()
+        response = self.client.get(reverse('basket-recommendations'))
+        self.assertListEqual(response.json()['results'], [])
@@ -0,0 +1,77 @@
+import tempfile
+from unittest.mock import patch
+from django.urls import reverse
+from oscar.core.loading import get_model
+from rest_framework.test import APITestCase
+
+from apps.shopapi.search import ProductSearchIndex
+
+
+Product = get_model('catalogue', 'Product')
+Category = get_model('catalogue', 'Category')
+
+
+class ProductSearchTestCase(APITestCase):
+    fixtures = ['fixture_all.json' ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.index = ProductSearchIndex(f'{self.tmpdir.name}/index.sqlite3')
+        p = patch('apps.shopapi.search.product_index', self.index)
+        p.start()
+        self.addCleanup(p.stop)
+        p = patch('apps.shopapi.receivers.refresh_product_listings')
+        p.start()
+        self.addCleanup(p.stop)
+        self.index.rebuild()
+
+    def search(self, q):
+        response = self.client.get(reverse('product-search'), {'q': q})
+        return [p['id'] for p in response.data['results']]
+
+    def test_search_by_title(self):
+        product = Product.objects.get(title='Pink Cute Handbag')
+        self.assertListEqual(self.search('handbag'), [product.id])
+
+    def test_search_matches_prefix(self):
+        product = Product.objects.get(title='Pink Cute Handbag')
+        self.assertListEqual(self.search('pink hand'), [product.id])
+
+    def test_search_ranks_title_matches_first(self):
+        dress = Product.objects.get(title='Ghanaian made flower dress')
+        suite = Product.objects.get(title='Office Slim Fit Suite')
+        suite.description = 'Goes well with a dress'
+        self.index.update(suite)
+
+        self.assertListEqual(self.search('dress'), [dress.id, suite.id])
+
+    def test_search_ignores_query_syntax(self):
+        self.assertListEqual(self.search('"AND OR* ('), [])
+        self.assertListEqual(self.search(''), [])
+
+    def test_index_updated_on_product_save(self):
+        product = Product.objects.get(title='Pink Cute Handbag')
+        product.title = 'Blue Leather Purse'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        self.assertListEqual(self.search('purse'), [product.id])
+        self.assertListEqual(self.search('handbag'), [])
+
+    def test_index_updated_on_product_delete(self):
+        product = Product.objects.get(title='Pink Cute Handbag')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertListEqual(self.search('handbag'), [])
+
+    def test_products_of_renamed_category_queued(self):
+        category = Category.objects.filter(product__isnull=False).distinct().first()
+        category.name = 'Renamed'
+        with patch('apps.shopapi.receivers.index_products') as task_mock, \
+                self.captureOnCommitCallbacks(execute=True):
+            category.save()
+
+        product_ids = set(Product.objects.filter(categories=category).values_list('pk', flat=True))
+        task_mock.delay.assert_called_once()
+        self.assertSetEqual(set(task_mock.delay.call_args[0][0]), product_ids)
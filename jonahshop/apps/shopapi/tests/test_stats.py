@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework import status
+
+
+class CacheStatsTestCase(APITestCase):
+
+    def test_stats_of_process_caches(self):
+        user = get_user_model().objects.create_user(email='staff@example.com', password='pass', is_staff=True)
+        self.client.force_authenticate(user)
+
+        response = self.client.get(reverse('stats-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTupleEqual(
+            ('thumbnail_urls', 'offer_results', 'basket_loads'), tuple(response.data.keys()))
+        self.assertIn('local_hits', response.data['thumbnail_urls'])
+
+    def test_stats_only_for_staff(self):
+        user = get_user_model().objects.create_user(email='user@example.com', password='pass')
+        self.client.force_authenticate(user)
+        response = self.client.get(reverse('stats-list'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
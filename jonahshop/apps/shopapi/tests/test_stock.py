@@ -0,0 +1,108 @@
+from datetime import timedelta
+from unittest.mock import patch
+from django.urls import reverse
+from django.utils import timezone
+from oscar.core.loading import get_model, get_class
+from rest_framework.test import APITestCase
+
+from apps.shopapi.models import StockReservation
+from apps.shopapi.stock import (
+    InsufficientStock,
+    allocate_stock,
+    consume_reservations,
+    release_expired_reservations,
+    reserve_basket
+)
+from apps.userapi.models import User
+
+
+Basket = get_model('basket', 'Basket')
+StockRecord = get_model('partner', 'StockRecord')
+Selector = get_class('partner.strategy', 'Selector')
+
+
+class StockReservationTestCase(APITestCase):
+    fixtures = ['fixture_all.json' ]
+
+    def setUp(self):
+        # basket 1 holds 2 of stockrecord 2 (23 in stock), 3 of
+        # stockrecord 3 (3 in stock) and 1 of stockrecord 4 (83 in stock)
+        self.basket = Basket.objects.get(pk=1)
+        self.basket.strategy = Selector().strategy()
+        for name in ('refresh_product_listings', 'search'):
+            p = patch(f'apps.shopapi.receivers.{name}')
+            p.start()
+            self.addCleanup(p.stop)
+
+    def allocated(self, pk):
+        return StockRecord.objects.get(pk=pk).num_allocated or 0
+
+    def test_allocate_only_free_stock(self):
+        self.assertTrue(allocate_stock(3, 2))
+        self.assertFalse(allocate_stock(3, 2))
+        self.assertTrue(allocate_stock(3, 1))
+        self.assertEqual(self.allocated(3), 3)
+
+    def test_reserve_basket(self):
+        reserve_basket(self.basket)
+        self.assertEqual(self.allocated(2), 2)
+        self.assertEqual(self.allocated(3), 3)
+        self.assertEqual(self.basket.stock_reservations.count(), 3)
+
+        # reserving again only reserves what changed
+        line = self.basket.lines.get(stockrecord_id=2)
+        line.quantity = 5
+        line.save()
+        self.basket.reset_offer_applications()
+        self.basket._lines = None
+        self.assertListEqual(reserve_basket(self.basket), [2])
+        self.assertEqual(self.allocated(2), 5)
+
+    def test_reserves_nothing_if_out_of_stock(self):
+        allocate_stock(3, 1)
+        with self.assertRaises(InsufficientStock):
+            reserve_basket(self.basket)
+        self.assertEqual(self.allocated(2), 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_consume_reservations(self):
+        reserve_basket(self.basket)
+        # the reserved stock stays allocated, for the order
+        self.assertListEqual(consume_reservations(self.basket), [])
+        self.assertEqual(self.allocated(3), 3)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_consume_unreserved_stock(self):
+        with self.assertRaises(InsufficientStock):
+            consume_reservations(self.basket)
+
+        # stock reserved for a line removed since is released
+        reserve_basket(self.basket)
+        self.basket.lines.filter(stockrecord_id=2).delete()
+        self.basket._lines = None
+        self.assertListEqual(consume_reservations(self.basket), [2])
+        self.assertEqual(self.allocated(2), 0)
+        self.assertEqual(self.allocated(3), 3)
+
+    def test_release_expired_reservations(self):
+        reserve_basket(self.basket, timeout=60)
+        self.assertEqual(release_expired_reservations(), 0)
+
+        released = release_expired_reservations(timezone.now() + timedelta(seconds=61))
+        self.assertEqual(released, 2 + 3 + 1)
+        self.assertEqual(self.allocated(3), 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_reserve_action(self):
+        user = User.objects.get(pk=1)
+        self.client.force_authenticate(user)
+        response = self.client.post(reverse('basket-reserve'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.data['expires_at'])
+        self.assertEqual(self.allocated(3), 3)
+
+        # another checkout took the last items meanwhile
+        release_expired_reservations(timezone.now() + timedelta(days=1))
+        allocate_stock(3, 1)
+        response = self.client.post(reverse('basket-reserve'))
+        self.assertEqual(response.status_code, 409)
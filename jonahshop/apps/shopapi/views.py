@@ -1,37 +1,89 @@
 from collections import namedtuple
-from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.core.cache import cache
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.http import parse_etags, urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes
 
 from oscar.core.loading import get_model, get_class
 from oscar.apps.basket.models import Basket as OscarBasket
 from oscar.apps.order.abstract_models import AbstractOrder
 
-from rest_framework import viewsets, status, mixins
+from rest_framework import viewsets, status, mixins, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.pagination import PageNumberPagination
 
 
 from apps.shopapi.serializers import (
     BasketSerializer,
     ProductSerializer,
+    ProductListingSerializer,
+    ProductIdsSerializer,
     AddProductSerializer,
+    BasketOperationsSerializer,
     LineSerializer,
     CheckoutSerializer,
     OrderSerializer
 )
+from apps.core.mixins import get_sparse_fields
+from apps.core.strategy import prime_basket_lines
+from apps.core.thumbnails import url_store
 from apps.core.token import simple_token
 from apps.shopapi.tasks import send_order_details
+from apps.shopapi.models import ProductListing
 from apps.shopapi.serializers.order import AnonymousOrderSerialer, OrderLineSerializer
 from apps.shopapi.permissions import OrderViewPermission
+from apps.shopapi.pagination import ProductPagination, OrderPagination
+from apps.shopapi import search as product_search
+from apps.shopapi.feeds import FEED_FORMATS, NDJSON, feed_lines
+from apps.shopapi.facets import facet_index, selected_facets
+from apps.shopapi.categories import category_tree
+from apps.shopapi.recommendations import RECOMMENDATIONS_VERSION_KEY, for_products
+from apps.shopapi.baskets import (
+    BasketConflict,
+    BasketOperationError,
+    StaleBasket,
+    apply_basket_operations,
+    basket_changes_since,
+    basket_revision,
+    basket_version,
+    mutate_basket
+)
+from apps.shopapi.middleware import basket_loads, materialize_request_basket
+from apps.shopapi.offers import offer_results
+from apps.shopapi.stock import InsufficientStock, reserve_basket, stock_changed
+from apps.shopapi.cache import (
+    CATALOGUE_CACHE_TIMEOUT,
+    CATALOGUE_VERSION_KEY,
+    basket_etag,
+    conditional_response,
+    get_version,
+    make_etag,
+    order_etag,
+    product_detail_cache_key,
+    product_detail_etag,
+    product_list_cache_key,
+    product_list_etag,
+    request_key
+)
 # Create your views here.
 
 
 Product = get_model('catalogue', 'Product')
 Basket = get_model('basket', 'Basket')
+StockRecord = get_model('partner', 'StockRecord')
 Order = get_model('order', 'Order')
 OrderPlacementMixin = get_class("checkout.mixins", "OrderPlacementMixin")
 
 
+# Response header with the version of the basket's lines, see
+# BasketViewSet.get_basket_response
+BASKET_VERSION_HEADER = 'X-Basket-Version'
+# Response header with the revision of the basket, which clients send
+# back as If-Match with changes of the basket, see BasketViewSet.mutate
+BASKET_REVISION_HEADER = 'X-Basket-Revision'
+
 OrderCredentials = namedtuple('OrderCredentials', ['uuid', 'token'])
 
 def generate_anonymous_order_credentials(order: AbstractOrder) -> OrderCredentials:
@@ -46,6 +98,224 @@ class ProductViewSet(viewsets.ModelViewSet):
     # ... See oscar.core.catalogue.managers.ProductQuerySet
     queryset = Product.objects.browsable().base_queryset()
     serializer_class = ProductSerializer
+    pagination_class = ProductPagination
+    # (product ids are numeric, anything else is not found)
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        if self.action == 'list':
+            # listings are served from the read model, a row per product. See ProductListing
+            qs = ProductListing.objects.all()
+        else:
+            qs = self.get_product_queryset()
+
+        # filters on category, attributes, price band and availability, eg.
+        # ?category=3&attr.colour=red&price=0-50&availability=in_stock
+        selected = selected_facets(self.request.query_params)
+        if selected:
+            qs = qs.filter(pk__in=self.get_facet_index().filter_ids(selected))
+        return qs
+
+    def get_product_queryset(self):
+        # The serializer fetches the stockrecords (and children of parent products)
+        # itself, in bulk, see PurchaseInfoResolver. So of what base_queryset()
+        # prefetches, only the images are needed, and only if they are requested.
+        # (the product class is needed by the strategy's availability policy)
+        qs = Product.objects.browsable().select_related('product_class')
+        fields = get_sparse_fields(self.request, ProductSerializer.Meta.fields)
+        if {'image', 'srcset'} & set(fields):
+            qs = qs.prefetch_related('images')
+        return qs
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'recommendations'):
+            return ProductListingSerializer
+        return super().get_serializer_class()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'retrieve':
+            context['image_preset'] = 'detail'
+        return context
+
+    def get_facet_index(self):
+        # the same snapshot of the index for the whole request
+        if not hasattr(self, '_facet_index'):
+            self._facet_index = facet_index.get()
+        return self._facet_index
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        # facet counts are included on request, ie. ?facets=true
+        if self.request.query_params.get('facets') in ('1', 'true'):
+            selected = selected_facets(self.request.query_params)
+            response.data['facets'] = self.get_facet_index().counts(selected)
+        return response
+
+    # Responses to anonymous users are the same for everyone, so they are cached.
+    # Cache entries are invalidated when products (or their stockrecords, images
+    # and categories) change. See apps.shopapi.receivers
+
+    def get_cached_response(self, key, get_response):
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = get_response()
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, CATALOGUE_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return conditional_response(
+            request, product_list_etag(request),
+            lambda: self.get_list_response(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_field]
+        return conditional_response(
+            request, product_detail_etag(request, pk),
+            lambda: self.get_detail_response(request, *args, **kwargs)
+        )
+
+    def get_list_response(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        return self.get_cached_response(
+            product_list_cache_key(request),
+            lambda: super(ProductViewSet, self).list(request, *args, **kwargs)
+        )
+
+    def get_detail_response(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().retrieve(request, *args, **kwargs)
+        return self.get_cached_response(
+            product_detail_cache_key(request, kwargs[self.lookup_field]),
+            lambda: super(ProductViewSet, self).retrieve(request, *args, **kwargs)
+        )
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full text search of the browsable products, best matches first.
+        Every term in the query 'q' is matched as a prefix
+
+        http://example.com/api/products/search/?q=pink+hand
+        """
+        ids = product_search.product_index.search(request.query_params.get('q', ''))
+        # ranked ids are paginated, so no cursor pagination
+        paginator = PageNumberPagination()
+        page = paginator.paginate_queryset(ids, request, view=self)
+        products = self.get_queryset().in_bulk(page)
+        # keep the ranking order, and skip products which are no longer browsable
+        results = [products[pk] for pk in page if pk in products]
+
+        ser = self.get_serializer(results, many=True)
+        return paginator.get_paginated_response(ser.data)
+
+    @action(detail=False, methods=['get'])
+    def bulk(self, request):
+        """
+        Lookup many products at once, in a single query. Products are returned
+        in the order of the requested ids. An id not matching a browsable product
+        is returned as {"id": <id>, "not_found": true}
+
+        http://example.com/api/products/bulk/?ids=4,1,9
+        """
+        raw_ids = request.query_params.get('ids', '')
+        ids_ser = ProductIdsSerializer(
+            data={'ids': [i.strip() for i in raw_ids.split(',') if i.strip()]})
+
+        if not ids_ser.is_valid():
+            return Response(ids_ser.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = ids_ser.validated_data['ids']
+        products = self.get_queryset().in_bulk(set(ids))
+        # serialize the found products together, so their purchase info is resolved in bulk
+        found = [products[pk] for pk in dict.fromkeys(ids) if pk in products]
+        data = dict(zip([p.pk for p in found], self.get_serializer(found, many=True).data))
+
+        results = [data.get(pk, {'id': pk, 'not_found': True}) for pk in ids]
+        return Response({'results': results})
+
+    @action(detail=True, methods=['get'])
+    def recommendations(self, request, pk=None):
+        """
+        "Customers also bought": the products most often bought together with
+        this product, most often first. Recommendations are built offline
+        (see apps.shopapi.recommendations), and served with a single query
+
+        http://example.com/api/products/4/recommendations/
+        """
+        def get_response():
+            listings = ProductListing.objects \
+                .filter(product__co_purchased_with__product_id=pk) \
+                .order_by('product__co_purchased_with__rank')
+            ser = self.get_serializer(listings, many=True)
+            return Response({'results': ser.data})
+
+        etag = make_etag(
+            'recommendations', pk,
+            get_version(RECOMMENDATIONS_VERSION_KEY),
+            get_version(CATALOGUE_VERSION_KEY),
+            request_key(request),
+        )
+        return conditional_response(request, etag, get_response)
+
+    @action(detail=False, methods=['get'])
+    def feed(self, request):
+        """
+        Export all browsable products, as newline delimited json (the default)
+        or csv. For marketplace and ad platform feeds. The feed is streamed,
+        so it is never built in memory
+
+        http://example.com/api/products/feed/?type=csv
+        """
+        feed_type = request.query_params.get('type', NDJSON)
+        if feed_type not in FEED_FORMATS:
+            return Response(
+                {'type': [f"Must be one of: {', '.join(FEED_FORMATS)}"]},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        def get_response():
+            lines = feed_lines(feed_type, self.get_serializer_context())
+            response = StreamingHttpResponse(lines, content_type=FEED_FORMATS[feed_type])
+            response['Content-Disposition'] = f'attachment; filename="products.{feed_type}"'
+            return response
+
+        return conditional_response(request, product_list_etag(request), get_response)
+
+
+class CategoryViewSet(viewsets.ViewSet):
+
+    def list(self, request):
+        """
+        The whole tree of browsable categories, with the number of
+        browsable products in each category (and it's subcategories).
+        Served from a snapshot, rebuilt when categories change
+
+        http://example.com/api/categories/
+        """
+        version, tree = category_tree.get()
+        return conditional_response(
+            request, make_etag('categories', version), lambda: Response(tree))
+
+
+class CacheStatsViewSet(viewsets.ViewSet):
+    permission_classes = [permissions.IsAdminUser]
+
+    def list(self, request):
+        """
+        Hits and misses of the caches held in memory, as counted by the
+        process serving the request (each process counts it's own)
+
+        http://example.com/api/stats/
+        """
+        return Response({
+            'thumbnail_urls': url_store.stats(),
+            'offer_results': offer_results.stats(),
+            'basket_loads': basket_loads.stats(),
+        })
 
 
 class BasketViewSet(
@@ -55,10 +325,53 @@ class BasketViewSet(
 
     serializer_class = BasketSerializer
 
+    # changes of the basket are made optimistically (see mutate), and stock
+    # is reserved in short transactions of their own (see reserve), not in
+    # a transaction held for the whole request
+    non_atomic_actions = {'add_product', 'batch', 'reserve', 'checkout'}
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if actions and set(actions.values()) <= cls.non_atomic_actions:
+            view = transaction.non_atomic_requests(view)
+        return view
+
     def get_object(self):
         basket = self.context['request'].basket
         return basket
 
+    def handle_exception(self, exc):
+        if isinstance(exc, StaleBasket):
+            return Response(
+                {'detail': str(exc), 'revision': exc.revision},
+                status=status.HTTP_412_PRECONDITION_FAILED,
+                headers={BASKET_REVISION_HEADER: exc.revision})
+        if isinstance(exc, BasketConflict):
+            return Response(
+                {'detail': 'The basket is being changed by another request, try again'},
+                status=status.HTTP_409_CONFLICT)
+        return super().handle_exception(exc)
+
+    def mutate(self, basket, mutate):
+        """
+        Make a change of the basket (``mutate()``), see
+        apps.shopapi.baskets.mutate_basket. Clients can send the revision of
+        the basket they have as If-Match, so the change is only made if the
+        basket hasn't changed since (412 Precondition Failed otherwise).
+        Returns the result of ``mutate()``
+        """
+        expected = None
+        if_match = self.request.META.get('HTTP_IF_MATCH')
+        if if_match and if_match.strip() != '*':
+            etags = parse_etags(if_match)
+            try:
+                expected = int(etags[0].strip('"'))
+            except (IndexError, ValueError):
+                raise StaleBasket(basket_revision(basket))
+        result, _ = mutate_basket(basket, mutate, expected)
+        return result
+
     def list(self, request):
         """
         Normally you would expect the 'list' action to respond with a
@@ -95,20 +408,48 @@ class BasketViewSet(
             # (session or auth user's) basket
             basket: OscarBasket = request.basket
 
-        if basket.id is None:
+        if basket.id is None and basket.is_empty:
             # The session basket hasn't been created (commited) for the
-            # user yet (aka. no lines attached)
+            # user yet (aka. no lines attached), or it is an empty cached basket
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-        ctx = {'request': request}
-        basket_ser = BasketSerializer(basket, context=ctx)
-        line_ser = LineSerializer(
-            basket.all_lines(), context=ctx, many=True)
+        return conditional_response(
+            request, basket_etag(request, basket),
+            lambda: self.get_basket_response(basket)
+        )
 
-        data = basket_ser.data
-        data['lines'] = line_ser.data
+    def get_basket_response(self, basket: OscarBasket):
+        """
+        The basket and it's lines. Clients which send the version of the
+        basket they have (?since=<X-Basket-Version>) get a delta instead:
+        only the lines which changed since then, and the ids of the removed
+        lines ('delta' is false, and all lines are sent, if the changes
+        since that version are unknown)
+        """
+        # read before the lines, so lines changed meanwhile are sent again
+        version = basket_version(basket)
+        since = self.request.query_params.get('since')
+        changes = basket_changes_since(basket, since) if since else None
 
-        return Response(data)
+        # lines are loaded (and priced) once, for the totals and the lines
+        lines = prime_basket_lines(basket)
+        ctx = {'request': self.request}
+        data = BasketSerializer(basket, context=ctx).data
+        if since:
+            data['version'] = version
+            data['delta'] = changes is not None
+        if changes is not None:
+            changed, removed = changes
+            lines = [line for line in lines if line.pk in changed]
+            data['removed_lines'] = sorted(removed)
+        elif since:
+            data['removed_lines'] = []
+        data['lines'] = LineSerializer(lines, context=ctx, many=True).data
+
+        return Response(data, headers={
+            BASKET_VERSION_HEADER: version,
+            BASKET_REVISION_HEADER: basket_revision(basket),
+        })
 
     @action(detail=False, methods=['post'])
     def add_product(self, request):
@@ -124,7 +465,11 @@ class BasketViewSet(
         product = Product.objects.get(pk=vd['product_id'])
 
         basket: OscarBasket = request.basket
-        line, created = basket.add(product, vd['quantity'])
+        line, created = self.mutate(basket, lambda: basket.add(product, vd['quantity']))
+
+        if request.query_params.get('since'):
+            # a delta of the basket's lines
+            return self.get_basket_response(basket)
 
         ctx = {'request': request}
         basket_ser = BasketSerializer(basket, context=ctx)
@@ -134,10 +479,101 @@ class BasketViewSet(
         data['is_line_created'] = created
         data['line'] = line_ser.data
 
-        return Response(data)
+        return Response(data, headers={
+            BASKET_VERSION_HEADER: basket_version(basket),
+            BASKET_REVISION_HEADER: basket_revision(basket),
+        })
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply many operations to the basket's lines at once, all or nothing,
+        eg. to re-order the lines of an order, or add a bundle of products.
+        Operations are applied in order, each is one of:
+
+            {"op": "add", "product_id": 4, "quantity": 2}
+            {"op": "set", "product_id": 4, "quantity": 1}
+            {"op": "remove", "product_id": 4}
+
+        Responds with the basket and it's lines, as 'list' does (or a delta
+        of the lines, see get_basket_response). Operations
+        which can't be applied are reported by their index in 'operations'
+
+        http://example.com/api/basket/batch/
+        """
+        ops_ser = BasketOperationsSerializer(data=request.data)
+        if not ops_ser.is_valid():
+            return Response(ops_ser.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        basket: OscarBasket = request.basket
+        try:
+            self.mutate(basket, lambda: apply_basket_operations(
+                basket, ops_ser.validated_data['operations'], request.user, request))
+        except BasketOperationError as e:
+            return Response({'operations': e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return self.get_basket_response(basket)
+
+    @action(detail=False, methods=['get'])
+    def recommendations(self, request):
+        """
+        "Customers also bought": the products most often bought together with
+        the products of the basket, which aren't in the basket already
+
+        http://example.com/api/basket/recommendations/
+        """
+        basket: OscarBasket = request.basket
+
+        def get_response():
+            product_ids = {line.product_id for line in basket.all_lines()}
+            listings = for_products(product_ids) if product_ids else []
+            ser = ProductListingSerializer(listings, many=True, context={'request': request})
+            return Response({'results': ser.data})
+
+        etag = make_etag(
+            'recommendations',
+            basket_etag(request, basket),
+            get_version(RECOMMENDATIONS_VERSION_KEY),
+        )
+        return conditional_response(request, etag, get_response)
+
+    @action(detail=False, methods=['post'])
+    def reserve(self, request):
+        """
+        Hold the stock of the basket's lines while the user goes through
+        checkout (eg. payment), so it is still there when the order is placed.
+        Reservations expire after STOCK_RESERVATION_TIMEOUT seconds. Reserving
+        again renews them, with the current quantities of the lines
+
+        http://example.com/api/basket/reserve/
+        """
+        # (a cached basket is written to the database, to hold it's stock)
+        with transaction.atomic():
+            basket: OscarBasket = materialize_request_basket(request)
+        if basket.id is None or basket.is_empty:
+            return Response(
+                {'basket': ['Cannot reserve the stock of an empty basket']},
+                status=status.HTTP_400_BAD_REQUEST)
+        # committed at once, so the stockrecords aren't locked for longer
+        # than the reservation takes (eg. while an order is placed)
+        try:
+            with transaction.atomic():
+                changed = reserve_basket(basket)
+        except InsufficientStock as e:
+            return Response({'basket': [str(e)]}, status=status.HTTP_409_CONFLICT)
+        stock_changed(StockRecord.objects.filter(pk__in=changed))
+
+        reservations = basket.stock_reservations.all()
+        return Response({
+            'expires_at': min(r.expires_at for r in reservations) if reservations else None,
+        })
 
     @action(detail=False, methods=['post'])
     def checkout(self, request):
+        # the order is placed from a basket in the database. The stock is
+        # reserved, and the order placed, in transactions of their own (see
+        # CheckoutSerializer.create)
+        with transaction.atomic():
+            materialize_request_basket(request)
         ctx = {'request': request}
         cser = CheckoutSerializer(data=request.data, context=ctx)
 
@@ -162,6 +598,7 @@ class OrderViewSet(mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.Ge
 
     permission_classes = [OrderViewPermission]
     serializer_class = OrderSerializer
+    pagination_class = OrderPagination
     lookup_field = 'number'
 
     def get_queryset(self):
@@ -172,7 +609,11 @@ class OrderViewSet(mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.Ge
         return  qs
 
     def retrieve(self, request, *args, **kwargs):
-        return self.get_detail_response(self.get_object())
+        order = self.get_object()
+        return conditional_response(
+            request, order_etag(request, order),
+            lambda: self.get_detail_response(order)
+        )
 
     @action(detail=False, methods=['post'])
     def anonymous(self, request):
@@ -207,7 +648,9 @@ class OrderViewSet(mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.Ge
         """
         ctx = {'request': self.request}
         # Retrieve lines associated with this order
-        lines = order.lines.prefetch_related('product__images').all()
+        lines = order.lines.all()
+        if {'image', 'srcset'} & set(get_sparse_fields(self.request, OrderLineSerializer.Meta.fields)):
+            lines = lines.prefetch_related('product__images')
         order_data = OrderSerializer(order, context=ctx).data
         lines_data = OrderLineSerializer(lines, many=True, context=ctx).data
         order_data['lines'] = lines_data
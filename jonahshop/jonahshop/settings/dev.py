@@ -13,6 +13,9 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 from pathlib import Path
 import os
 
+from celery.schedules import crontab
+from corsheaders.defaults import default_headers
+
 from oscar.defaults import *
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -116,8 +119,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    # oscar
-    'oscar.apps.basket.middleware.BasketMiddleware',
+    # oscar's, which can keep anonymous baskets in the cache (BASKET_STORAGE)
+    'apps.shopapi.middleware.BasketMiddleware',
     'django.contrib.flatpages.middleware.FlatpageFallbackMiddleware',
 ]
 
@@ -214,7 +217,14 @@ MEDIA_ROOT = os.path.expanduser("~/media/jonahshop")
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-# Basic search backend
+# Boundaries of the price bands products are filtered (faceted) by
+PRODUCT_PRICE_BANDS = (0, 50, 100, 250, 500)
+
+# Full text index of products for the api (/api/products/search/)
+# Rebuild with: manage.py rebuild_product_index
+PRODUCT_SEARCH_INDEX_PATH = BASE_DIR / 'product_index.sqlite3'
+
+# Basic search backend (used by oscar's own search views)
 HAYSTACK_CONNECTIONS = {
     'default': {
         'ENGINE': 'haystack.backends.simple_backend.SimpleEngine',
@@ -232,6 +242,23 @@ OSCAR_SHOP_NAME = "JonahShop"
 OSCAR_SHOP_TAGLINE = "Shop All You Clothing and Apparels at a Convenience"
 OSCAR_DEFAULT_CURRENCY = "GH₵"
 
+# Thumbnails of product images are generated by celery workers when an
+# image is saved, and the web workers only look up their urls from the cache.
+# So in production CACHES must point to a cache shared by all processes.
+# Thumbnail sizes for each context images are shown in, the first is the
+# default image and all are in the srcset. Each is generated in every format
+PRODUCT_IMAGE_PRESETS = {
+    'listing': ('200x200', '400x400'),
+    'detail': ('200x200', '600x600', '1200x1200'),
+    'basket': ('200x200', '100x100'),
+    'order': ('200x200', '100x100'),
+}
+PRODUCT_IMAGE_FORMATS = ('JPEG', 'WEBP')
+
+# Seconds to cache product list/detail responses for anonymous users.
+# (entries are invalidated on product changes, see apps.shopapi.receivers)
+CATALOGUE_CACHE_TIMEOUT = 60 * 15
+
 
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -251,6 +278,27 @@ SPECTACULAR_SETTINGS = {
 
 # CELERY_IMPORTS = ['userapi.tasks']
 
+CELERY_BEAT_SCHEDULE = {
+    # "customers also bought", rebuilt from the order lines every night
+    'build-product-recommendations': {
+        'task': 'shopapi.build_product_recommendations',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    # release the stock held by abandoned checkouts
+    'release-expired-stock-reservations': {
+        'task': 'shopapi.release_expired_stock_reservations',
+        'schedule': 60,
+    },
+}
+
+# Seconds the stock of a basket is held for, once its checkout starts
+STOCK_RESERVATION_TIMEOUT = 60 * 15
+
+# Where the baskets of anonymous users are kept: 'db' (as oscar does), or
+# 'cache', where they are written to the database only at checkout or when
+# the user signs in. Cached baskets must be in a cache shared by all processes
+BASKET_STORAGE = 'db'
+
 ASGI_APPLICATION = "jonahshop.asgi.application"
 
 if DEBUG:
@@ -260,6 +308,9 @@ if DEBUG:
         "http://127.0.0.1:3000",
     )
     CORS_ALLOW_CREDENTIALS = True
+    # the version (and revision) of the basket, see apps.shopapi.views.BasketViewSet
+    CORS_EXPOSE_HEADERS = ['X-Basket-Version', 'X-Basket-Revision']
+    CORS_ALLOW_HEADERS = list(default_headers) + ['if-match']
 
 
 INTERNAL_IPS = ('127.0.0.1', )
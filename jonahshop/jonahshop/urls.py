@@ -26,9 +26,11 @@ from apps.userapi import views as user_views
 
 router = routers.DefaultRouter()
 router.register(r'basket', views.BasketViewSet, basename='basket') # basket, not, baskets -- see viewset for reason
-router.register(r'products', views.ProductViewSet, 'products')
-router.register(r'orders', views.OrderViewSet, basename='orders')
+router.register(r'products', views.ProductViewSet, basename='product')
+router.register(r'categories', views.CategoryViewSet, basename='category')
+router.register(r'orders', views.OrderViewSet, basename='order')
 router.register(r'addresses', user_views.UserAddressViewset, basename='address')
+router.register(r'stats', views.CacheStatsViewSet, basename='stats')
 
 urlpatterns = [
     # path('admin/', admin.site.urls),